@@ -7,5 +7,7 @@ api_bp = Blueprint('api', __name__)
 # Import at bottom to avoid circular imports
 # https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-xxiii-application-programming-interfaces-apis
 # pylint: disable=wrong-import-position
-from app.api.routes import proxy, signed_url, after_request
+from app.api.routes import (request_id, proxy, signed_url, request_metrics, request_timing,
+                            after_request, stats, batch_proxy, facets, recommendations,
+                            similar, events, image_derivatives, admission_control)
 from app.api import error_handlers
@@ -0,0 +1,262 @@
+"""Admission control: load shedding in front of the routes.
+
+When PostgREST slows down every worker thread ends up waiting on it, and requests queue
+in front of the workers without limit, so the latency of every client grows with the
+backlog. Requests are admitted here before any work is done instead:
+- Every client IP gets a token bucket of `burst` requests refilled at `rate` per second.
+  Requests sending an API key header also take a token from the bucket of the key.
+  Keys are not validated here, so a client can not get more than the rate of its IP by
+  sending a new key with every request. Over either bucket: 429.
+- Every route runs at most `concurrency[route]` requests at the same time (routes are
+  URL rules, as in the metrics), `max_queue` more wait at most `queue_timeout` seconds
+  for a slot. A full queue or an expired wait: 503.
+Both are answered right away with a Retry-After header, in the ServerError JSON format.
+"""
+import collections
+import math
+import threading
+import time
+from typing import List, Optional, Tuple
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # Requests per second refilled in the bucket of every client, and size of the buckets.
+    "rate": 50.0,
+    "burst": 100,
+    # Header with the API key of a client, limited on top of its IP.
+    "client_header": "X-API-Key",
+    # Use the last X-Forwarded-For address as the IP, only behind a load balancer that sets it.
+    "trust_forwarded_for": False,
+    # Max number of buckets kept, the least recently seen clients are forgotten.
+    "max_clients": 100000,
+    # URL rule -> max concurrent requests, `default_concurrency` for the others.
+    "concurrency": {},
+    "default_concurrency": 64,
+    # Requests of a route waiting for a slot, and max seconds they wait.
+    "max_queue": 64,
+    "queue_timeout": 1.0,
+    # Path prefixes that are never limited, so the API can be observed while shedding.
+    "exempt_paths": ["/metrics", "/stats/"],
+}
+
+
+class TokenBuckets:
+    """Token bucket of every client, the least recently seen are dropped past `max_clients`."""
+
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # client -> (tokens, updated_at)
+        self._buckets = collections.OrderedDict()
+
+    def take(self, client: str) -> Tuple[bool, float]:
+        """Take a token from the bucket of a client.
+
+        Args:
+            client (str): Client key.
+
+        Returns:
+            Tuple[bool, float]: True if a token was taken, otherwise the seconds until
+                the next one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RouteLimiter:
+    """Concurrency limit of a route, with a bounded queue of waiting requests."""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float) -> Optional[str]:
+        """Take a slot, waiting at most `timeout` seconds if the route is busy.
+
+        Args:
+            timeout (float): Max seconds to wait.
+
+        Returns:
+            Optional[str]: None if a slot was taken, otherwise why it was not,
+                `queue_full` or `queue_timeout`.
+        """
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return None
+            if self.waiting >= self.max_queue:
+                return "queue_full"
+
+            deadline = time.monotonic() + timeout
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "queue_timeout"
+                    self._condition.wait(remaining)
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right away, never waits nor queues.
+
+        Returns:
+            bool: True if a slot was taken.
+        """
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        """Give a slot back and wake up a waiting request."""
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self) -> dict:
+        """Current usage."""
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting}
+
+
+class AdmissionController:
+    """Token buckets and route limiters of the process."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.buckets = TokenBuckets(settings["rate"], settings["burst"], settings["max_clients"])
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._rejected = collections.Counter()
+
+    def is_exempt(self, path: str) -> bool:
+        """Check if a path is never limited."""
+        return not self.settings["enabled"] or \
+            any(path.startswith(prefix) for prefix in self.settings["exempt_paths"])
+
+    def get_limiter(self, route: str) -> RouteLimiter:
+        """Limiter of a route, created on first use.
+
+        Args:
+            route (str): URL rule.
+
+        Returns:
+            RouteLimiter: Limiter.
+        """
+        limiter = self._limiters.get(route)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(route, RouteLimiter(
+                    self.settings["concurrency"].get(route, self.settings["default_concurrency"]),
+                    self.settings["max_queue"]))
+        return limiter
+
+    def take_tokens(self, clients: List[str]) -> Tuple[bool, float]:
+        """Take a token from the bucket of every key of a client, stops at the first
+        empty bucket so a refused client does not create buckets for its other keys.
+
+        Args:
+            clients (List[str]): Client keys, see `get_client_keys`.
+
+        Returns:
+            Tuple[bool, float]: True if every token was taken, otherwise the seconds until
+                the next one.
+        """
+        for client in clients:
+            allowed, wait = self.buckets.take(client)
+            if not allowed:
+                return False, wait
+        return True, 0.0
+
+    def reject(self, route: str, reason: str) -> None:
+        """Count a rejected request."""
+        self._rejected[(route, reason)] += 1
+
+    def stats(self) -> dict:
+        """Usage of every route and rejected requests.
+
+        Returns:
+            dict: Statistics.
+        """
+        return {
+            "clients": len(self.buckets),
+            "routes": {route: limiter.stats() for route, limiter in self._limiters.items()},
+            "rejected": {f"{route} {reason}": count
+                         for (route, reason), count in self._rejected.items()},
+        }
+
+
+def get_client_keys(headers, remote_addr: str, settings: dict) -> List[str]:
+    """Keys of the token buckets of a client.
+
+    Args:
+        headers (Mapping): Incoming request headers.
+        remote_addr (str): Address of the peer.
+        settings (dict): Admission settings.
+
+    Returns:
+        List[str]: IP of the client, then its API key if one is sent.
+    """
+    client_ip = remote_addr
+    if settings["trust_forwarded_for"]:
+        forwarded_for = headers.get("X-Forwarded-For", "")
+        if forwarded_for:
+            # The load balancer appends the address it received the request from.
+            client_ip = forwarded_for.split(',')[-1].strip()
+    clients = [f"ip:{client_ip}"]
+
+    api_key = headers.get(settings["client_header"], None)
+    if api_key:
+        clients.append(f"key:{api_key}")
+    return clients
+
+
+def retry_after(seconds: float) -> int:
+    """Retry-After value, whole seconds and at least 1."""
+    return max(1, math.ceil(seconds))
+
+
+_settings = dict(DEFAULT_SETTINGS)
+controller = AdmissionController(_settings)
+
+
+def configure(settings: dict) -> None:
+    """Set the admission settings, usually from the `admission` key of the config.
+
+    Args:
+        settings (dict): Admission settings, missing keys fall back to the defaults.
+    """
+    global controller  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    controller = AdmissionController(dict(_settings))
+
+
+def get_settings() -> dict:
+    """Current admission settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
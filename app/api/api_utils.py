@@ -1,15 +1,18 @@
 """Utility functions that are used in API requests
 """
 from urllib.parse import urlencode, urlunparse, urlparse, urljoin
-from typing import Union
+from typing import Callable, NamedTuple, Optional, Union
+import json
 import re
 import toolz
 import requests
 
-from flask import request
+from flask import current_app, request
 
 from app.logger import logger
-from app.api.error_handlers import PostgrestHTTPException
+from app.api import cache, cursor, metrics, timing, upstream
+from app import utils
+from app.api.error_handlers import PostgrestHTTPException, ServerError
 
 
 def add_default_sorting(request_params: dict, default_sort: str = "int_id") -> dict:
@@ -61,76 +64,372 @@ def get_sort_columns(sort_params: Union[list, str]) -> list:
     return sort_params
 
 
-def create_pivot_value_request_param(request_params: dict, postgrest_host: str) -> dict:
-    """Find the pivot value for a seek pagination.
+class PivotLookup(NamedTuple):
+    """Everything needed to look up the pivot values of a seek pagination."""
+    sort_terms: list
+    sort_cols: list
+    int_id: int
+
+
+class LinkContext(NamedTuple):
+    """Parts of the incoming request used to build the next link."""
+    url: str
+    client_params: dict
+    secret: str
+
+
+def get_keyset_terms(sort_terms: list) -> list:
+    """Order terms that identify a row, the sort columns up to and including `int_id`.
+    Columns after `int_id` never break ties since `int_id` is unique.
+
+    Args:
+        sort_terms (list): PostgREST order terms.
+
+    Returns:
+        list: Order terms, ending with an `int_id` term.
+    """
+    keyset_terms = []
+    for term in sort_terms:
+        keyset_terms.append(term)
+        if cursor.parse_sort_term(term)[0] == "int_id":
+            return keyset_terms
+    return keyset_terms + ["int_id"]
+
+
+def get_pivot_lookup(request_params: dict) -> Optional[PivotLookup]:
+    """Check if the request needs pivot values for a seek pagination.
     This should only happen if the user is sorting by anything other than `int_id`,
     and wants to get data after a certain `int_id`.
-    NOTE: This function performs an O(1) SELECT to find the pivot value.
 
     Args:
-        request_params (dict): Original request params
-        postgrest_host (str): URL to PostgREST
+        request_params (dict): Request params.
 
     Returns:
-        dict: Request params with pivot value added
+        Optional[PivotLookup]: Pivot to look up, None if no pivot value is needed.
     """
     try:
         split_sort = request_params['order'].split(",")
         int_id_q = request_params.get('int_id', None)
         split_int_id_q = int_id_q.split(".")
     except AttributeError:
+        return None
+
+    sort_col, _ = cursor.parse_sort_term(split_sort[0])
+    if sort_col == "int_id" or split_int_id_q[0] != "gt":
+        return None
+
+    try:
+        int_id = int(split_int_id_q[1])
+    except ValueError:
+        logger.debug("Could not get int_id.")
+        return None
+
+    sort_terms = get_keyset_terms(split_sort)
+    sort_cols = [cursor.parse_sort_term(term)[0] for term in sort_terms[:-1]]
+    return PivotLookup(sort_terms, sort_cols, int_id)
+
+
+def create_pivot_value_request_param(request_params: dict, postgrest_host: str,
+                                     relation: str) -> dict:
+    """Find the pivot values for a seek pagination.
+    NOTE: This function performs one O(1) SELECT for all the sort columns whose pivot
+    values are not already in the pivot value cache.
+
+    Args:
+        request_params (dict): Original request params
+        postgrest_host (str): URL to PostgREST
+        relation (str): PostgREST relation the page is queried from, the pivot row
+            is looked up in the same relation.
+
+    Returns:
+        dict: Request params with pivot value added
+    """
+    pivot_lookup = get_pivot_lookup(request_params)
+    if pivot_lookup is None:
         return request_params
 
-    if split_sort[0] != "int_id" and split_int_id_q[0] == "gt":
-        sort_col = split_sort[0]
-        try:
-            int_id = int(split_int_id_q[1])
-        except ValueError:
-            logger.debug("Could not get int_id.")
-            return request_params
-
-        pivot_value_payload = {
-            "int_id": int_id,
-            "col": sort_col
-        }
-        resp = requests.post(urljoin(postgrest_host, "rpc/pivot_value"),
-                             data=pivot_value_payload)
+    pivot_values = {col: cache.pivot_value_cache.get(relation, pivot_lookup.int_id, col)
+                    for col in pivot_lookup.sort_cols}
+    missing_cols = [col for col, value in pivot_values.items() if value is None]
+    if missing_cols:
+        metrics.PIVOT_RPCS.inc()
+        with timing.span("pivot"):
+            resp = upstream.request("POST", urljoin(postgrest_host, "rpc/pivot_values"),
+                                    json=create_pivot_values_payload(relation, pivot_lookup,
+                                                                     missing_cols))
 
         if resp.status_code >= 300:
             raise PostgrestHTTPException(resp)
 
-        pivot_value = resp.json()
-        if pivot_value:
-            return {**request_params, sort_col: f"gte.{pivot_value}"}
+        looked_up_values = read_pivot_values(resp.json(), missing_cols)
+        if looked_up_values is None:
+            return apply_pivot_values(request_params, pivot_lookup, None)
+        for col, pivot_value in looked_up_values.items():
+            cache.pivot_value_cache.set(relation, pivot_lookup.int_id, col, pivot_value)
+        pivot_values.update(looked_up_values)
+
+    return apply_pivot_values(request_params, pivot_lookup, pivot_values)
+
+
+def create_pivot_values_payload(relation: str, pivot_lookup: PivotLookup, cols: list) -> dict:
+    """Arguments of `rpc/pivot_values` (sql/postgREST.sql).
+
+    Args:
+        relation (str): PostgREST relation of the pivot row.
+        pivot_lookup (PivotLookup): Pivot to look up.
+        cols (list): Sort columns to look up.
+
+    Returns:
+        dict: JSON body of the RPC.
+    """
+    return {"relation": relation, "int_id": pivot_lookup.int_id, "cols": cols}
+
+
+def read_pivot_values(row: Optional[dict], cols: list) -> Optional[dict]:
+    """Pivot values of a `rpc/pivot_values` response.
+
+    Args:
+        row (Optional[dict]): Response, column -> value, None if the row was not found.
+        cols (list): Sort columns that were looked up.
+
+    Returns:
+        Optional[dict]: Value of every column, None for NULL values.
+            None if the row was not found.
+    """
+    if row is None:
+        return None
+    return {col: row.get(col, None) for col in cols}
+
+
+def apply_pivot_values(request_params: dict, pivot_lookup: PivotLookup,
+                       pivot_values: Optional[dict]) -> dict:
+    """Replace the `int_id` filter with the seek filters of the pivot values that were
+    looked up.
+
+    Args:
+        request_params (dict): Request params.
+        pivot_lookup (PivotLookup): Pivot that was looked up.
+        pivot_values (Optional[dict]): Value of every sort column, NULL values are None.
+            None if the row was not found.
+
+    Returns:
+        dict: Request params with pivot value added
+    """
+    if pivot_values is None:
+        # The pivot row is gone, only its `int_id` is left to seek from.
+        return request_params
+
+    return create_seek_params(toolz.dissoc(request_params, "int_id"),
+                              pivot_lookup.sort_terms,
+                              {**pivot_values, "int_id": pivot_lookup.int_id})
+
+
+def create_cursor_request_params(request_params: dict, secret: str) -> dict:
+    """Replace the `cursor` query param with the seek filters it describes.
+
+    Args:
+        request_params (dict): Request params.
+        secret (str): Secret the cursor was signed with.
+
+    Raises:
+        ServerError: If the cursor is invalid or was created for another order.
+
+    Returns:
+        dict: Request params with seek filters instead of the cursor.
+    """
+    cursor_q = request_params.get("cursor", None)
+    if cursor_q is None:
+        return request_params
+
+    page_cursor = cursor.decode_cursor(cursor_q, secret)
+    sort_terms = get_sort_columns(request_params.get("order", "int_id"))
+    if page_cursor["order"] != sort_terms:
+        raise ServerError(400, hint="The cursor was created for a different order.")
+
+    params_without_cursor = toolz.dissoc(request_params, "cursor")
+    sort_columns = [cursor.parse_sort_term(term)[0] for term in page_cursor["order"]]
+    return create_seek_params(params_without_cursor,
+                              page_cursor["order"],
+                              {**dict(zip(sort_columns, page_cursor["values"])),
+                               "int_id": page_cursor["int_id"]})
+
+
+def create_seek_params(request_params: dict, sort_terms: list, last_row: dict) -> dict:
+    """Add the keyset filter that selects the rows after the last row of a page,
+    (c1, c2, int_id) > (v1, v2, last_id) in the order of the sort terms:
+        and=(c1.gte.v1,or(c1.gt.v1,and(c1.eq.v1,c2.gt.v2),and(c1.eq.v1,c2.eq.v2,int_id.gt.N)))
+    `gt` becomes `lt` for descending columns. NULLs are placed where Postgres sorts them,
+    see `get_after_conditions`. The redundant bound on the first column lets Postgres
+    serve the page from a (c1, int_id) index range scan.
+
+    Args:
+        request_params (dict): Request params.
+        sort_terms (list): PostgREST order terms.
+        last_row (dict): Value of every sort column and `int_id` in the last row
+            of the previous page.
+
+    Returns:
+        dict: Request params with seek filters added.
+    """
+    keyset_terms = get_keyset_terms(sort_terms)
+
+    branches, equal_conditions = [], []
+    for term in keyset_terms:
+        col, _ = cursor.parse_sort_term(term)
+        for condition in get_after_conditions(term, last_row[col]):
+            conditions = [*equal_conditions, condition]
+            branches.append(conditions[0] if len(conditions) == 1
+                            else f"and({','.join(conditions)})")
+        equal_conditions.append(f"{col}.is.null" if last_row[col] is None
+                                else f"{col}.eq.{quote_filter_value(last_row[col])}")
+
+    seek_conditions = [branches[0] if len(branches) == 1 else f"or({','.join(branches)})"]
+    first_col, _ = cursor.parse_sort_term(keyset_terms[0])
+    first_bound = get_first_column_bound(keyset_terms[0], last_row[first_col])
+    if first_bound is not None:
+        seek_conditions.insert(0, first_bound)
+    return add_and_conditions(request_params, seek_conditions)
+
+
+def get_after_conditions(sort_term: str, value) -> list:
+    """Conditions on one sort column that put a row after the value of the last row.
+    After a value come the greater values (lower if descending), then the NULLs if
+    they are sorted last. After a NULL come the other values if NULLs are sorted first,
+    nothing otherwise. `int_id` is the primary key, it is never NULL.
+
+    Args:
+        sort_term (str): PostgREST order term.
+        value (Any): Value of the column in the last row, None if it is NULL.
+
+    Returns:
+        list: PostgREST conditions, any of them puts the row after the last row.
+    """
+    col, descending = cursor.parse_sort_term(sort_term)
+    nulls_first = cursor.is_nulls_first(sort_term)
+    if value is None:
+        return [f"{col}.not.is.null"] if nulls_first else []
+
+    conditions = [f"{col}.{'lt' if descending else 'gt'}.{quote_filter_value(value)}"]
+    if not nulls_first and col != "int_id":
+        conditions.append(f"{col}.is.null")
+    return conditions
+
+
+def get_first_column_bound(sort_term: str, value) -> Optional[str]:
+    """Redundant bound on the first sort column, the rows of the next page and after
+    are all within it.
+
+    Args:
+        sort_term (str): PostgREST order term of the first column.
+        value (Any): Value of the column in the last row, None if it is NULL.
+
+    Returns:
+        Optional[str]: PostgREST condition, None if every row can come next.
+    """
+    col, descending = cursor.parse_sort_term(sort_term)
+    nulls_first = cursor.is_nulls_first(sort_term)
+    if value is None:
+        return None if nulls_first else f"{col}.is.null"
+
+    bound = f"{col}.{'lte' if descending else 'gte'}.{quote_filter_value(value)}"
+    if nulls_first or col == "int_id":
+        return bound
+    return f"or({bound},{col}.is.null)"
+
+
+def quote_filter_value(value) -> str:
+    """Format a value for a PostgREST logic tree, text is double quoted
+    so commas, periods and parentheses in it are not parsed.
+
+    Args:
+        value (Any): Value.
+
+    Returns:
+        str: Filter value.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    text = json.dumps(value) if isinstance(value, bool) else str(value)
+    escaped = text.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def add_and_conditions(request_params: dict, conditions: list) -> dict:
+    """Add conditions to the `and` logic tree of the request params, keeping any
+    conditions the client already sent in it.
 
-    return request_params
+    Args:
+        request_params (dict): Request params.
+        conditions (list): PostgREST conditions, such as `int_id.gt.10`.
 
+    Returns:
+        dict: Request params with the conditions added.
+    """
+    client_trees = request_params.get("and", [])
+    if isinstance(client_trees, str):
+        client_trees = [client_trees]
+    # `(a,b)` -> `a,b`
+    client_conditions = [tree[1:-1] if tree.startswith("(") and tree.endswith(")") else tree
+                         for tree in client_trees]
+    return {**request_params, "and": f"({','.join([*client_conditions, *conditions])})"}
 
-def create_headers(resp: requests.Response, request_params: dict, status_code: int) -> dict:
+
+def flatten_headers(headers) -> list:
+    """Turn headers into (name, value) pairs, repeated headers are given as lists.
+
+    Args:
+        headers (Union[dict, list]): Headers.
+
+    Returns:
+        list: Header pairs.
+    """
+    items = headers.items() if isinstance(headers, dict) else headers
+    pairs = []
+    for name, val in items:
+        values = val if isinstance(val, list) else [val]
+        pairs.extend((name, str(item)) for item in values)
+    return pairs
+
+
+def create_headers(resp: requests.Response, request_params: dict, status_code: int,
+                   get_last_row: Callable[[], Optional[dict]] = None,
+                   link_context: LinkContext = None) -> dict:
     """Create various custom headers that need to be added to a PostgREST response.
 
     Args:
         resp (requests.Response): PostgREST response.
         request_params (dict): Request params.
         status_code (int): Status code of the PostgREST response.
+        get_last_row (Callable[[], Optional[dict]], optional): Returns the last row of the
+            response. Defaults to a tail scan of the buffered response body.
+        link_context (LinkContext, optional): Incoming request the links are created for.
+            Defaults to the current Flask request.
 
     Returns:
         dict: Headers.
     """
     # Remove excluded headers
     excluded_headers = ['content-encoding', 'transfer-encoding']
-    headers = {name: val for name, val in resp.raw.headers.items(
+    if 'content-encoding' in resp.headers:
+        # `requests` decodes the body, so the upstream length no longer matches.
+        excluded_headers.append('content-length')
+    headers = {name: val for name, val in resp.headers.items(
     ) if name.lower() not in excluded_headers}
 
     if status_code >= 300:
         return headers
 
-    assert "Content-Range" in headers, "Content-Range is missing from header?"
-    content_range_header = headers['Content-Range']
+    assert "Content-Range" in resp.headers, "Content-Range is missing from header?"
+    content_range_header = resp.headers['Content-Range']
 
-    link_header = create_link_header(resp,
-                                     request_params,
-                                     content_range_header)
+    if get_last_row is None:
+        get_last_row = lambda: find_last_row(resp.content)
+
+    with timing.span("link_header"):
+        link_header = create_link_header(get_last_row,
+                                         request_params,
+                                         content_range_header,
+                                         link_context)
 
     return {
         **headers,
@@ -138,26 +437,57 @@ def create_headers(resp: requests.Response, request_params: dict, status_code: i
     }
 
 
-def create_link_header(resp: requests.Response, request_params: dict,
-                       content_range_header: str) -> dict:
+def create_link_header(get_last_row: Callable[[], Optional[dict]], request_params: dict,
+                       content_range_header: str, link_context: LinkContext = None) -> dict:
     """Create the link header that will provide pagination for the client.
 
     Args:
-        resp (requests.Response): PostgREST response.
+        get_last_row (Callable[[], Optional[dict]]): Returns the last row of the response,
+            only called when a next link is needed.
         request_params (dict): Request params.
         content_range_header (dict): Content-Range header from postgREST.
+        link_context (LinkContext, optional): Incoming request the links are created for.
+            Defaults to the current Flask request.
 
     Returns:
         dict: Link header.
     """
     link_header = []
 
+    if is_full_page(request_params, content_range_header):
+        # When do we create a next link header?
+        #   1. If results has data
+        #   2. If the Content-Range is equal to the limit in the query
+        #       ex. Content-Range=0-9/* and limit=10
+        last_item = get_last_row() or {}
+        last_id = last_item.get("int_id", None)
+        if last_id:
+            next_link = create_next_link_header(last_item, request_params, link_context)
+            link_header.append(next_link)
+
+    if link_header:
+        " ".join(link_header)
+        return {"Link": link_header}
+
+    return {}
+
+
+def is_full_page(request_params: dict, content_range_header: str) -> bool:
+    """Check if a page holds as many rows as the limit, meaning there could be a next page.
+
+    Args:
+        request_params (dict): Request params.
+        content_range_header (str): Content-Range header from postgREST.
+
+    Returns:
+        bool: True if the page is full.
+    """
     limit_q = request_params.get("limit", None)
     try:
         limit = int(limit_q)
     except (TypeError, ValueError):
-        # No limit found, just return
-        return {}
+        # No limit found
+        return False
 
     try:
         # if _ is assigned, it will be the total length of the response
@@ -167,44 +497,127 @@ def create_link_header(resp: requests.Response, request_params: dict,
         total_range = (response_range_int[1] - response_range_int[0]) + 1
     except IndexError:
         # This will happen if we can't find a number value in the Content-Range header
-        return {}
+        return False
 
-    results = resp.json()
-    if results and total_range == limit:
-        # When do we create a next link header?
-        #   1. If results has data
-        #   2. If the Content-Range is equal to the limit in the query
-        #       ex. Content-Range=0-9/* and limit=10
-        last_item = results[-1]
-        last_id = last_item.get("int_id", None)
-        if last_id:
-            last_id = results[-1]["int_id"]
-            next_link = create_next_link_header(last_id, request_params)
-            link_header.append(next_link)
-
-    if link_header:
-        " ".join(link_header)
-        return {"Link": link_header}
-
-    return {}
+    return total_range == limit
 
 
-def create_next_link_header(last_id: int, request_params: dict) -> str:
+def create_next_link_header(last_item: dict, request_params: dict,
+                            link_context: LinkContext = None) -> str:
     """Create the next link header.
+    Pages get a signed cursor holding the sort values of their last row, so the next page
+    does not have to look up the pivot values again.
 
     Args:
-        last_id (int): `int_id` of the last item returned in the current request.
+        last_item (dict): Last item returned in the current request.
         request_params (dict): Request params.
+        link_context (LinkContext, optional): Incoming request the link is created for.
+            Defaults to the current Flask request.
 
     Returns:
         str: Next link.
     """
-    next_page_params = {**request_params, "int_id": f"gt.{last_id}"}
-
-    next_request_url = toolz.pipe(request.url,
+    if link_context is None:
+        link_context = get_flask_link_context()
+
+    sort_terms = get_sort_columns(request_params.get("order", "int_id"))
+
+    if cursor.can_encode(sort_terms, last_item):
+        page_cursor = cursor.encode_cursor(sort_terms, last_item, link_context.secret)
+        # The cursor replaces the seek filters, so start from what the client sent.
+        client_params = toolz.dissoc(link_context.client_params, "int_id", "cursor")
+        next_page_params = {**client_params, "cursor": page_cursor}
+    else:
+        # Sort columns were not selected, their pivot values are looked up from the
+        # `int_id`, see `get_pivot_lookup`. Pages sorted by `int_id` need none.
+        first_sort_col, first_descending = cursor.parse_sort_term(sort_terms[0])
+        seek_operator = "lt" if first_sort_col == "int_id" and first_descending else "gt"
+        next_page_params = {**request_params,
+                            "int_id": f"{seek_operator}.{last_item['int_id']}"}
+
+    next_request_url = toolz.pipe(link_context.url,
                                   urlparse,
                                   lambda req_url: req_url._replace(
-                                      query=urlencode(next_page_params)),
+                                      query=urlencode(next_page_params, doseq=True)),
                                   urlunparse)
 
     return f'<{next_request_url}>; rel="next"'
+
+
+def get_flask_link_context() -> LinkContext:
+    """Link context of the current Flask request.
+
+    Returns:
+        LinkContext: Link context.
+    """
+    client_params = utils.replace_single_len_lists(request.args.to_dict(flat=False))
+    return LinkContext(request.url, client_params, current_app.secret_key)
+
+
+JSON_TOKENS_RE = re.compile(rb'[\[\]{}"]')
+
+
+def find_last_row(body: bytes, window: int = 16384) -> Optional[dict]:
+    """Decode only the last row of a JSON array response body.
+    The body is scanned backwards from the closing bracket to find where the last object
+    starts, so the cost depends on the size of the last row and not the whole response.
+
+    Args:
+        body (bytes): JSON array response body.
+        window (int, optional): Initial number of bytes to scan. Defaults to 16384.
+
+    Returns:
+        Optional[dict]: Last row, None if the body is not a non-empty array of objects.
+    """
+    body = body.rstrip()
+    if not body.endswith(b"]"):
+        return None
+
+    row_end = len(body) - 1
+    while row_end > 0 and body[row_end - 1:row_end].isspace():
+        row_end -= 1
+    if body[row_end - 1:row_end] != b"}":
+        return None
+
+    while True:
+        window_start = max(0, row_end - window)
+        row_start = _find_object_start(body, window_start, row_end)
+        if row_start is not None:
+            return json.loads(body[row_start:row_end])
+        if window_start == 0:
+            return None
+        window *= 2
+
+
+def _find_object_start(body: bytes, window_start: int, row_end: int) -> Optional[int]:
+    """Walk backwards from the closing brace of an object to its opening brace.
+
+    Args:
+        body (bytes): JSON body.
+        window_start (int): Do not look before this index.
+        row_end (int): Index right after the closing brace.
+
+    Returns:
+        Optional[int]: Index of the opening brace, None if it is outside of the window.
+    """
+    depth = 0
+    in_string = False
+    tokens = [match.start() for match in JSON_TOKENS_RE.finditer(body, window_start, row_end)]
+    for index in reversed(tokens):
+        char = body[index:index + 1]
+        if char == b'"':
+            # A quote is escaped if it is preceded by an odd number of backslashes.
+            backslashes = 0
+            while body[index - backslashes - 1:index - backslashes] == b"\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                in_string = not in_string
+        elif in_string:
+            continue
+        elif char in (b"}", b"]"):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
@@ -0,0 +1,113 @@
+"""Concurrent execution of the sub-requests of /batch.
+
+Sub-requests run on a thread pool shared by every batch, so the number of PostgREST
+queries sent for batches is bounded per process. A batch runs at most `max_concurrency`
+of its sub-requests at the same time, so one large batch can not take the whole pool.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+DEFAULT_SETTINGS = {
+    # Max number of sub-requests in one batch.
+    "max_requests": 20,
+    # Max number of sub-requests of one batch running at the same time.
+    "max_concurrency": 4,
+    # Threads shared by every batch.
+    "workers": 16,
+}
+
+
+class BatchExecutor:
+    """Thread pool running the sub-requests of every batch."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        """Get the thread pool, creating it on first use.
+
+        Returns:
+            ThreadPoolExecutor: Thread pool.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.settings["workers"],
+                                                        thread_name_prefix="batch")
+        return self._executor
+
+    def map(self, func: Callable, items: list) -> list:
+        """Call a function on every item, at most `max_concurrency` at the same time.
+        Every call runs in a copy of the caller's context, so context variables such as
+        the request id are seen by the sub-requests.
+
+        Args:
+            func (Callable): Function of one item, must not raise.
+            items (list): Items.
+
+        Returns:
+            list: Results, in the order of the items.
+        """
+        executor = self.get_executor()
+        width = threading.BoundedSemaphore(self.settings["max_concurrency"])
+        futures = []
+        for item in items:
+            width.acquire()  # pylint: disable=consider-using-with
+            try:
+                future = executor.submit(contextvars.copy_context().run, func, item)
+            except Exception:
+                width.release()
+                raise
+            future.add_done_callback(lambda _: width.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        """Stop the threads once the sub-requests already submitted are done."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+_settings = dict(DEFAULT_SETTINGS)
+batch_executor = BatchExecutor(_settings)
+
+
+def configure(settings: dict) -> None:
+    """Set the batch settings, usually from the `batch` key of the config.
+
+    Args:
+        settings (dict): Batch settings, missing keys fall back to the defaults.
+    """
+    global batch_executor  # pylint: disable=global-statement
+    batch_executor.shutdown()
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    batch_executor = BatchExecutor(_settings)
+
+
+def get_settings() -> dict:
+    """Current batch settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def run(func: Callable, items: List) -> list:
+    """Run the sub-requests of a batch concurrently, see `BatchExecutor.map`.
+
+    Args:
+        func (Callable): Function of one sub-request, must not raise.
+        items (List): Sub-requests.
+
+    Returns:
+        list: Results, in the order of the sub-requests.
+    """
+    return batch_executor.map(func, items)
@@ -0,0 +1,371 @@
+"""Caches of PostgREST responses for read-only routes and of seek pagination pivot values.
+
+Entries expire after their TTL or when the catalog version changes. Where they are
+stored is up to the configured backend, see `app.api.cache_backends`.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+from app.api import metrics
+from app.api.cache_backends import CacheBackend, MemoryBackend, create_backend
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Where entries are stored, see `cache_backends.create_backend`.
+    "backend": {"type": "memory", "max_bytes": 64 * 1024 * 1024},
+    # Routes that are not listed here are never cached.
+    "route_ttls": {},
+    # Request headers that change the PostgREST response.
+    "vary_headers": ["Accept", "Prefer", "Range"],
+}
+
+DEFAULT_PIVOT_SETTINGS = {
+    "enabled": False,
+    "backend": {"type": "memory", "max_bytes": 4 * 1024 * 1024},
+    # Pivot values only change when the catalog is reloaded.
+    "ttl": 3600,
+}
+
+# Length of the JSON metadata that comes before the body of a serialized entry.
+META_LENGTH = struct.Struct("<I")
+
+
+class CachedResponse(NamedTuple):
+    """A PostgREST response that can be replayed to clients."""
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    stored_at: float
+    ttl: float
+
+    def age(self, now: float = None) -> float:
+        """Number of seconds since the entry was stored."""
+        return (now or time.time()) - self.stored_at
+
+    def to_bytes(self) -> bytes:
+        """Serialize the entry so it can be stored in any backend."""
+        meta = json.dumps({
+            "status": self.status,
+            "headers": self.headers,
+            "stored_at": self.stored_at,
+            "ttl": self.ttl,
+        }).encode()
+        return META_LENGTH.pack(len(meta)) + meta + self.body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CachedResponse":
+        """Deserialize an entry created by `to_bytes`."""
+        (meta_length,) = META_LENGTH.unpack_from(data)
+        meta_end = META_LENGTH.size + meta_length
+        meta = json.loads(data[META_LENGTH.size:meta_end])
+        return cls(status=meta["status"],
+                   headers=[tuple(header) for header in meta["headers"]],
+                   body=data[meta_end:],
+                   stored_at=meta["stored_at"],
+                   ttl=meta["ttl"])
+
+
+class ResponseCache:
+    """Stores responses in a cache backend and keeps hit/miss statistics."""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+        }
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Get a fresh entry.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[CachedResponse]: Cached response, None on a miss.
+        """
+        data = self.backend.get(key)
+        with self._lock:
+            self._stats["hits" if data is not None else "misses"] += 1
+        metrics.CACHE_LOOKUPS.labels("responses", "hit" if data is not None else "miss").inc()
+        if data is None:
+            return None
+        return CachedResponse.from_bytes(data)
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        """Store an entry for its TTL.
+
+        Args:
+            key (str): Cache key.
+            entry (CachedResponse): Response to cache.
+        """
+        self.backend.set(key, entry.to_bytes(), entry.ttl)
+
+    def record_bypass(self) -> None:
+        """Count a request that was not allowed to use the cache."""
+        with self._lock:
+            self._stats["bypasses"] += 1
+        metrics.CACHE_LOOKUPS.labels("responses", "bypass").inc()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss statistics and backend usage.
+        NOTE: Hits and misses are counted per process, even when the backend is shared.
+
+        Returns:
+            dict: Statistics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+class CatalogVersion:
+    """Version of the catalog data, used to invalidate cached entries when it is reloaded.
+
+    The catalog loader signals a new version by touching a file, every worker on the host
+    sees the new modification time. The file is checked at most once per `check_interval`.
+    """
+
+    def __init__(self, path: str = None, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._version = "0"
+        self._checked_at = 0.0
+
+    def current(self) -> str:
+        """Current catalog version.
+
+        Returns:
+            str: Version, "0" if there is no version file.
+        """
+        if self.path is None:
+            return self._version
+
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            try:
+                self._version = str(os.stat(self.path).st_mtime_ns)
+            except FileNotFoundError:
+                self._version = "0"
+            self._checked_at = now
+        return self._version
+
+
+class PivotValueCache:
+    """Memoizes the value of a sort column for a given relation and `int_id`."""
+
+    def __init__(self, backend: CacheBackend, ttl: float, enabled: bool = True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+        }
+
+    @staticmethod
+    def make_key(relation: str, int_id: int, col: str) -> str:
+        """Create the cache key of a pivot value, scoped to the current catalog version.
+
+        Args:
+            relation (str): PostgREST relation of the row.
+            int_id (int): `int_id` of the row.
+            col (str): Sort column.
+
+        Returns:
+            str: Cache key.
+        """
+        return f"{catalog_version.current()}:{relation}:{col}:{int_id}"
+
+    def get(self, relation: str, int_id: int, col: str):
+        """Get a memoized pivot value.
+
+        Args:
+            relation (str): PostgREST relation of the row.
+            int_id (int): `int_id` of the row.
+            col (str): Sort column.
+
+        Returns:
+            Any: Pivot value, None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        data = self.backend.get(self.make_key(relation, int_id, col))
+        with self._lock:
+            self._stats["hits" if data is not None else "misses"] += 1
+        metrics.CACHE_LOOKUPS.labels("pivot_values", "hit" if data is not None else "miss").inc()
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def set(self, relation: str, int_id: int, col: str, value) -> None:
+        """Memoize a pivot value.
+
+        Args:
+            relation (str): PostgREST relation of the row.
+            int_id (int): `int_id` of the row.
+            col (str): Sort column.
+            value (Any): JSON serializable pivot value.
+        """
+        if self.enabled and value is not None:
+            self.backend.set(self.make_key(relation, int_id, col), json.dumps(value).encode(),
+                             self.ttl)
+
+    def stats(self) -> dict:
+        """Hit/miss statistics, counted per process.
+
+        Returns:
+            dict: Statistics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+_settings = dict(DEFAULT_SETTINGS)
+response_cache = ResponseCache(MemoryBackend())
+pivot_value_cache = PivotValueCache(MemoryBackend(), DEFAULT_PIVOT_SETTINGS["ttl"], enabled=False)
+catalog_version = CatalogVersion()
+
+
+def configure(settings: dict) -> None:
+    """Set the cache settings, usually from the `response_cache` key of the config.
+
+    Args:
+        settings (dict): Cache settings, missing keys fall back to the defaults.
+    """
+    global response_cache  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    response_cache = ResponseCache(create_backend(_settings["backend"], "responses"))
+
+
+def configure_pivot_values(settings: dict) -> None:
+    """Set the pivot value cache settings, usually from the `pivot_cache` key of the config.
+
+    Args:
+        settings (dict): Pivot value cache settings, missing keys fall back to the defaults.
+    """
+    global pivot_value_cache  # pylint: disable=global-statement
+    pivot_settings = {**DEFAULT_PIVOT_SETTINGS, **(settings or {})}
+    pivot_value_cache = PivotValueCache(create_backend(pivot_settings["backend"], "pivot_values"),
+                                        pivot_settings["ttl"],
+                                        enabled=pivot_settings["enabled"])
+
+
+def configure_catalog_version(path: str) -> None:
+    """Set the file used to signal that the catalog was reloaded.
+
+    Args:
+        path (str): Version file, touch it after every catalog load.
+    """
+    global catalog_version  # pylint: disable=global-statement
+    catalog_version = CatalogVersion(path)
+
+
+def get_settings() -> dict:
+    """Current cache settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def route_ttl(path: str) -> Optional[float]:
+    """TTL of a route.
+
+    Args:
+        path (str): PostgREST route.
+
+    Returns:
+        Optional[float]: TTL in seconds, None if the route should not be cached.
+    """
+    if not _settings["enabled"]:
+        return None
+    return _settings["route_ttls"].get(path, None)
+
+
+def normalize_params(query_params) -> list:
+    """Turn query params into a sorted list of (key, value) pairs, so that the same query
+    always produces the same cache key no matter the order of the params.
+    The order of repeated values is kept since it matters for params like `order`.
+
+    Args:
+        query_params (Union[dict, MultiDict]): Query params.
+
+    Returns:
+        list: Sorted (key, value) pairs.
+    """
+    try:
+        params = query_params.to_dict(flat=False)
+    except AttributeError:
+        params = query_params
+
+    pairs = []
+    for key in sorted(params):
+        val = params[key]
+        values = val if isinstance(val, (list, tuple)) else [val]
+        pairs.extend((key, str(item)) for item in values)
+    return pairs
+
+
+def make_key(url_root: str, path: str, query_params, request_headers,
+             encoding: str = None) -> str:
+    """Create the cache key of a request.
+
+    Args:
+        url_root (str): Root URL the request was sent to, such as `https://host/`.
+            Cached Link headers point to it, so every host is cached separately.
+        path (str): PostgREST route.
+        query_params (Union[dict, MultiDict]): Query params sent to PostgREST.
+        request_headers (Mapping): Incoming request headers.
+        encoding (str, optional): Negotiated content encoding, every encoding is cached
+            separately. Defaults to None, uncompressed.
+
+    Returns:
+        str: Cache key.
+    """
+    vary = [(name.lower(), request_headers.get(name, "")) for name in _settings["vary_headers"]]
+    vary.append(("content-encoding", encoding or "identity"))
+    return (f"{catalog_version.current()}:{url_root}{path}?"
+            f"{urlencode(normalize_params(query_params))}#{urlencode(vary)}")
+
+
+def cache_headers(entry: CachedResponse, now: float = None) -> dict:
+    """HTTP caching headers of a cached response.
+
+    Args:
+        entry (CachedResponse): Cached response.
+        now (float, optional): Current time. Defaults to `time.time()`.
+
+    Returns:
+        dict: Cache-Control and Age headers.
+    """
+    return {
+        "Cache-Control": f"public, max-age={int(entry.ttl)}",
+        "Age": str(int(entry.age(now))),
+    }
@@ -0,0 +1,330 @@
+"""Storage backends used by the caches of the API.
+
+Every backend stores bytes under string keys with a TTL. The memory backend is private
+to each process, the redis and mmap backends are shared by every worker on the host.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.logger import logger
+
+
+class CacheBackend:
+    """Interface of a cache backend.
+    Use this when creating any new types of cache backends.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a value that has not expired.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[bytes]: Value, None if it is missing or expired.
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store a value.
+
+        Args:
+            key (str): Cache key.
+            value (bytes): Value.
+            ttl (float): Seconds the value is valid for.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove a value if it exists.
+
+        Args:
+            key (str): Cache key.
+        """
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Remove every value of this backend."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Backend specific statistics.
+
+        Returns:
+            dict: Statistics.
+        """
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """Process local LRU backend with a memory budget."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # key -> (expires_at, value)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        # Entries larger than the whole budget are not stored.
+        if len(key) + len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value)
+            self._bytes += len(key) + len(value)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+    def _remove(self, key: str) -> None:
+        """Remove an entry. Must be called while holding the lock."""
+        _, value = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+
+class RedisBackend(CacheBackend):
+    """Backend for a local Redis compatible server (redis, KeyDB, Dragonfly...).
+    Prefer a unix socket, it avoids the TCP stack for every lookup.
+    """
+
+    def __init__(self, namespace: str, unix_socket_path: str = None, host: str = "localhost",
+                 port: int = 6379, db: int = 0, key_prefix: str = "justlooks",
+                 socket_timeout: float = 0.1):
+        try:
+            import redis  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ImportError("The redis cache backend needs the `redis` package.") from err
+
+        self.prefix = f"{key_prefix}:{namespace}:"
+        self.client = redis.Redis(unix_socket_path=unix_socket_path,
+                                  host=host,
+                                  port=port,
+                                  db=db,
+                                  socket_timeout=socket_timeout,
+                                  socket_connect_timeout=socket_timeout)
+        self._redis_error = redis.RedisError
+        self._errors = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get(self.prefix + key)
+        except self._redis_error as err:
+            # The cache must never take the API down, treat it as a miss.
+            self._errors += 1
+            logger.error(f"[Cache] Redis get failed: {err}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1))
+        except self._redis_error as err:
+            self._errors += 1
+            logger.error(f"[Cache] Redis set failed: {err}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(self.prefix + key)
+        except self._redis_error as err:
+            self._errors += 1
+            logger.error(f"[Cache] Redis delete failed: {err}")
+
+    def clear(self) -> None:
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + "*", count=1000))
+            if keys:
+                self.client.delete(*keys)
+        except self._redis_error as err:
+            # Entries of older catalog versions are never read again, they expire.
+            self._errors += 1
+            logger.error(f"[Cache] Redis clear failed: {err}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "prefix": self.prefix,
+            "errors": self._errors,
+        }
+
+
+class MmapBackend(CacheBackend):
+    """Shared backend stored in a memory mapped file, usually on a tmpfs like /dev/shm.
+
+    The file is a direct mapped table of fixed size slots, a key always goes to the same
+    slot and replaces whatever was stored there. Values that do not fit in a slot are
+    not cached. Slots are protected by byte range locks so workers can share the file.
+    """
+    # digest, expires_at, value length
+    SLOT_HEADER = struct.Struct("<16sdI")
+
+    def __init__(self, namespace: str, directory: str = "/dev/shm/justlooks-cache",
+                 slots: int = 4096, slot_size: int = 65536):
+        if slot_size <= self.SLOT_HEADER.size:
+            raise ValueError(f"slot_size must be larger than {self.SLOT_HEADER.size} bytes.")
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self.path = os.path.join(directory, f"{namespace}.cache")
+        os.makedirs(directory, exist_ok=True)
+
+        size = slots * slot_size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        # Byte range locks are per process, threads need their own lock.
+        self._lock = threading.Lock()
+        self._oversized = 0
+
+    def _slot(self, key: str) -> tuple:
+        """Find the slot of a key.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            tuple: Key digest and slot offset in the file.
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        index = int.from_bytes(digest[:8], "little") % self.slots
+        return digest, index * self.slot_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        digest, offset = self._slot(key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH, self.slot_size, offset)
+            try:
+                slot_digest, expires_at, length = self.SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_digest != digest or expires_at <= time.time():
+                    return None
+                start = offset + self.SLOT_HEADER.size
+                return self._map[start:start + length]
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.slot_size - self.SLOT_HEADER.size:
+            self._oversized += 1
+            return
+
+        digest, offset = self._slot(key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slot_size, offset)
+            try:
+                start = offset + self.SLOT_HEADER.size
+                self._map[start:start + len(value)] = value
+                self.SLOT_HEADER.pack_into(self._map, offset, digest, time.time() + ttl, len(value))
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def delete(self, key: str) -> None:
+        digest, offset = self._slot(key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.slot_size, offset)
+            try:
+                slot_digest, _, _ = self.SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_digest == digest:
+                    self.SLOT_HEADER.pack_into(self._map, offset, bytes(16), 0.0, 0)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def clear(self) -> None:
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                for index in range(self.slots):
+                    self.SLOT_HEADER.pack_into(self._map, index * self.slot_size,
+                                               bytes(16), 0.0, 0)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "mmap",
+            "path": self.path,
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "oversized": self._oversized,
+        }
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "redis": RedisBackend,
+    "mmap": MmapBackend,
+}
+
+
+def create_backend(settings: dict, namespace: str) -> CacheBackend:
+    """Create a cache backend from its config.
+
+    Args:
+        settings (dict): Backend config, `type` is one of `BACKENDS`, every other key is
+            passed to the backend.
+        namespace (str): Separates the values of different caches sharing a backend.
+
+    Raises:
+        ValueError: If the backend type is unknown.
+
+    Returns:
+        CacheBackend: Cache backend.
+    """
+    backend_settings = dict(settings or {})
+    backend_type = backend_settings.pop("type", "memory")
+    try:
+        backend_class = BACKENDS[backend_type]
+    except KeyError as err:
+        raise ValueError(f"Unknown cache backend {backend_type}.") from err
+
+    if backend_class is MemoryBackend:
+        return MemoryBackend(**backend_settings)
+    return backend_class(namespace=namespace, **backend_settings)
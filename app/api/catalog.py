@@ -0,0 +1,62 @@
+"""PostgREST relations queried for the catalog routes.
+
+In the default `views` mode every route is proxied to the PostgREST relation of the
+same name. In `materialized` mode the catalog routes go to the materialized relations
+of sql/catalog_materialized.sql instead, which have seek pagination indexes on the
+sortable columns. Clients keep using the same routes in both modes.
+"""
+DEFAULT_SETTINGS = {
+    # "views" or "materialized"
+    "mode": "views",
+    # Route -> relation in `materialized` mode, other routes are not changed.
+    "materialized_relations": {
+        "products": "catalog_products",
+        "outfits": "catalog_outfits",
+    },
+}
+
+MODES = ("views", "materialized")
+
+_settings = dict(DEFAULT_SETTINGS)
+_relations = {}
+
+
+def configure(settings: dict) -> None:
+    """Set the catalog settings, usually from the `catalog` key of the config.
+
+    Args:
+        settings (dict): Catalog settings, missing keys fall back to the defaults.
+
+    Raises:
+        ValueError: If the mode is unknown.
+    """
+    new_settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if new_settings["mode"] not in MODES:
+        raise ValueError(f"Unknown catalog mode {new_settings['mode']}, expected one of {MODES}")
+
+    _settings.clear()
+    _settings.update(new_settings)
+    _relations.clear()
+    if _settings["mode"] == "materialized":
+        _relations.update(_settings["materialized_relations"])
+
+
+def get_settings() -> dict:
+    """Current catalog settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def get_relation(path: str) -> str:
+    """PostgREST relation to query for a route.
+
+    Args:
+        path (str): URL path that corresponds to a PostgREST route.
+
+    Returns:
+        str: PostgREST path.
+    """
+    return _relations.get(path, path)
@@ -0,0 +1,166 @@
+"""Negotiated response compression (gzip, and brotli when the `brotli` package is installed).
+
+PostgREST responses are decompressed by the upstream client, so the proxy compresses
+them again for clients that accept it. Cached responses are stored compressed, see
+`cache.make_key`, so a hit is sent as is.
+"""
+import gzip
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Smaller bodies are sent uncompressed, the savings do not pay for the CPU time.
+    "min_size": 1024,
+    "gzip_level": 6,
+    "brotli_level": 5,
+    # Preferred encoding first, used when the client accepts several with the same q-value.
+    "encodings": ["br", "gzip"],
+    "mime_types": [
+        "application/json",
+        "application/vnd.pgrst.object+json",
+        "application/geo+json",
+        "text/csv",
+        "text/plain",
+    ],
+}
+
+_settings = dict(DEFAULT_SETTINGS)
+
+
+def configure(settings: dict) -> None:
+    """Set the compression settings, usually from the `compression` key of the config.
+
+    Args:
+        settings (dict): Compression settings, missing keys fall back to the defaults.
+    """
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+
+
+def available_encodings() -> List[str]:
+    """Configured encodings that can be used in this process.
+
+    Returns:
+        List[str]: Encodings, preferred first.
+    """
+    return [encoding for encoding in _settings["encodings"]
+            if encoding == "gzip" or (encoding == "br" and brotli is not None)]
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Choose the encoding of a response from the Accept-Encoding request header.
+
+    Args:
+        accept_encoding (Optional[str]): Accept-Encoding request header.
+
+    Returns:
+        Optional[str]: Encoding, None if the response should not be compressed.
+    """
+    if not _settings["enabled"] or not accept_encoding:
+        return None
+
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        qvalue = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                qvalue = float(params[2:])
+            except ValueError:
+                qvalue = 0.0
+        qvalues[coding.strip().lower()] = qvalue
+
+    encodings = available_encodings()
+    ranked = [(qvalues.get(encoding, qvalues.get("*", 0.0)), -position, encoding)
+              for position, encoding in enumerate(encodings)]
+    qvalue, _, encoding = max(ranked, default=(0.0, 0, None))
+    return encoding if qvalue > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a body.
+
+    Args:
+        body (bytes): Body.
+        encoding (str): "gzip" or "br".
+
+    Raises:
+        ValueError: If the encoding is not supported.
+
+    Returns:
+        bytes: Compressed body.
+    """
+    if encoding == "gzip":
+        # mtime=0 so the same body always gives the same bytes.
+        return gzip.compress(body, compresslevel=_settings["gzip_level"], mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=_settings["brotli_level"])
+    raise ValueError(f"Unsupported encoding {encoding}.")
+
+
+def is_compressible(headers: list, body: bytes) -> bool:
+    """Check if a response is worth compressing.
+
+    Args:
+        headers (list): Response header pairs.
+        body (bytes): Response body.
+
+    Returns:
+        bool: True if the response can be compressed.
+    """
+    if not _settings["enabled"] or len(body) < _settings["min_size"]:
+        return False
+
+    content_type = ""
+    for name, val in headers:
+        name = name.lower()
+        if name == "content-encoding":
+            return False
+        if name == "content-type":
+            content_type = val.split(";")[0].strip().lower()
+    return content_type in _settings["mime_types"]
+
+
+def encode_response(headers: list, body: bytes,
+                    encoding: Optional[str]) -> Tuple[list, bytes]:
+    """Compress a response body and update its headers.
+    Vary: Accept-Encoding is set on every compressible response, even when it is sent
+    uncompressed, so shared caches keep the variants apart.
+
+    Args:
+        headers (list): Response header pairs.
+        body (bytes): Response body.
+        encoding (Optional[str]): Negotiated encoding, see `negotiate`.
+
+    Returns:
+        Tuple[list, bytes]: Header pairs and body.
+    """
+    if not is_compressible(headers, body):
+        return headers, body
+
+    vary = [val for name, val in headers if name.lower() == "vary"]
+    if not any("accept-encoding" in val.lower() or val.strip() == "*" for val in vary):
+        vary.append("Accept-Encoding")
+    headers = [(name, val) for name, val in headers
+               if name.lower() not in ("vary", "content-length")]
+    headers.append(("Vary", ", ".join(vary)))
+
+    if encoding is None:
+        return headers + [("Content-Length", str(len(body)))], body
+
+    body = compress(body, encoding)
+    encoded_headers = []
+    for name, val in headers:
+        # Strong ETags must differ between encodings of the same body.
+        if name.lower() == "etag" and val.endswith('"'):
+            val = f'{val[:-1]}-{encoding}"'
+        encoded_headers.append((name, val))
+    encoded_headers.append(("Content-Encoding", encoding))
+    encoded_headers.append(("Content-Length", str(len(body))))
+    return encoded_headers, body
@@ -0,0 +1,100 @@
+"""Conditional requests: ETags and 304 Not Modified responses.
+"""
+import hashlib
+from typing import Optional
+
+# Headers that are kept on a 304 response, see RFC 7232 section 4.1
+NOT_MODIFIED_HEADERS = {
+    "cache-control",
+    "content-location",
+    "date",
+    "etag",
+    "expires",
+    "vary",
+    "age",
+    "link",
+    "content-range",
+    "access-control-allow-origin",
+    "access-control-expose-headers",
+}
+
+
+def create_etag(body: bytes) -> str:
+    """Create a strong ETag from a response body.
+
+    Args:
+        body (bytes): Response body.
+
+    Returns:
+        str: Quoted ETag.
+    """
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def get_header(headers, name: str) -> Optional[str]:
+    """Case insensitive header lookup that works for dicts and lists of pairs.
+
+    Args:
+        headers (Union[dict, list]): Headers.
+        name (str): Header name.
+
+    Returns:
+        Optional[str]: Header value, None if it is missing.
+    """
+    items = headers.items() if isinstance(headers, dict) else headers
+    for key, val in items:
+        if key.lower() == name.lower():
+            return val
+    return None
+
+
+def add_etag(headers: dict, body: bytes) -> dict:
+    """Add an ETag to the response headers, unless PostgREST already sent one.
+
+    Args:
+        headers (dict): Response headers.
+        body (bytes): Response body.
+
+    Returns:
+        dict: Headers with an ETag.
+    """
+    if get_header(headers, "ETag") is not None:
+        return headers
+    return {**headers, "ETag": create_etag(body)}
+
+
+def is_not_modified(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check if the client already holds the current version of the response.
+    If-None-Match uses the weak comparison, so W/"x" matches "x".
+
+    Args:
+        if_none_match (Optional[str]): If-None-Match request header.
+        etag (Optional[str]): ETag of the response.
+
+    Returns:
+        bool: True if a 304 should be sent.
+    """
+    if not if_none_match or not etag:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque_tag(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return opaque_tag(etag) in {opaque_tag(tag) for tag in if_none_match.split(",")}
+
+
+def not_modified_headers(headers) -> list:
+    """Headers of the 304 response that replaces a response.
+
+    Args:
+        headers (Union[dict, list]): Headers of the full response.
+
+    Returns:
+        list: Header pairs.
+    """
+    items = headers.items() if isinstance(headers, dict) else headers
+    return [(key, val) for key, val in items if key.lower() in NOT_MODIFIED_HEADERS]
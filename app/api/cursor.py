@@ -0,0 +1,99 @@
+"""Opaque keyset pagination cursors.
+
+A cursor holds the sort columns of a page, their values in the last row of the page
+and the `int_id` of that row. It is signed so clients can not forge the seek filters
+that the proxy builds from it.
+"""
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from app.api.error_handlers import ServerError
+
+CURSOR_SALT = "keyset-cursor"
+
+
+def encode_cursor(sort_terms: list, last_row: dict, secret: str) -> str:
+    """Create the cursor of the page after `last_row`.
+
+    Args:
+        sort_terms (list): PostgREST order terms, ex. ["base_color.desc", "int_id"].
+        last_row (dict): Last row of the current page.
+        secret (str): Signing secret.
+
+    Returns:
+        str: Cursor.
+    """
+    sort_columns = [parse_sort_term(term)[0] for term in sort_terms]
+    payload = {
+        "order": sort_terms,
+        "values": [last_row[col] for col in sort_columns],
+        "int_id": last_row["int_id"],
+    }
+    return URLSafeSerializer(secret, salt=CURSOR_SALT).dumps(payload)
+
+
+def decode_cursor(cursor: str, secret: str) -> dict:
+    """Verify and decode a cursor created by `encode_cursor`.
+
+    Args:
+        cursor (str): Cursor.
+        secret (str): Signing secret.
+
+    Raises:
+        ServerError: If the cursor was not created by us.
+
+    Returns:
+        dict: Cursor payload with `order`, `values` and `int_id`.
+    """
+    try:
+        return URLSafeSerializer(secret, salt=CURSOR_SALT).loads(cursor)
+    except BadSignature as err:
+        raise ServerError(400, hint="Invalid cursor.") from err
+
+
+def parse_sort_term(sort_term: str) -> tuple:
+    """Split a PostgREST order term into its column and direction.
+    ex. "base_color.desc.nullslast" -> ("base_color", True)
+
+    Args:
+        sort_term (str): Order term.
+
+    Returns:
+        tuple: Column and True if the order is descending.
+    """
+    col, *modifiers = sort_term.split(".")
+    return col, "desc" in modifiers
+
+
+def is_nulls_first(sort_term: str) -> bool:
+    """Check if NULLs come first in a PostgREST order term.
+    Like in Postgres, they come last in ascending orders and first in descending ones
+    unless `nullsfirst` or `nullslast` is given.
+
+    Args:
+        sort_term (str): Order term.
+
+    Returns:
+        bool: True if NULLs are sorted before the other values.
+    """
+    _, *modifiers = sort_term.split(".")
+    if "nullsfirst" in modifiers:
+        return True
+    if "nullslast" in modifiers:
+        return False
+    return "desc" in modifiers
+
+
+def can_encode(sort_terms: list, last_row: dict) -> bool:
+    """Check if the last row holds every value a cursor needs.
+    Sort columns can be NULL, but they must have been selected.
+
+    Args:
+        sort_terms (list): PostgREST order terms.
+        last_row (dict): Last row of the current page.
+
+    Returns:
+        bool: True if a cursor can be created.
+    """
+    sort_columns = [parse_sort_term(term)[0] for term in sort_terms]
+    return all(col in last_row for col in sort_columns) \
+        and last_row.get("int_id", None) is not None
@@ -7,7 +7,7 @@ import toolz
 from flask import Response, abort
 from werkzeug.exceptions import HTTPException
 
-from app.api import api_bp, api_utils
+from app.api import api_bp, api_utils, metrics
 from app.logger import logger
 
 
@@ -97,6 +97,22 @@ class ServerError(Exception):
         }
 
 
+class RejectedError(ServerError):
+    """Used when a request is refused by the admission control (see `app.api.admission`),
+    the client is told when to retry with a Retry-After header.
+    """
+
+    def __init__(self, code: int, retry_after: int, hint: str = None):
+        super().__init__(code, hint)
+        self.retry_after = retry_after
+
+
+class UpstreamError(ServerError):
+    """Used when PostgREST can not be reached or is too slow to respond.
+    Counted as an upstream error where it is raised, not as an error of the API.
+    """
+
+
 class PostgrestHTTPException(ServerError):
     """Used to handle any PostgREST error responses.
     This class will be sent to a Flask error handler that will provide a clean JSON error
@@ -161,6 +177,8 @@ def handle_server_error_httpexception(err: ServerError) -> Response:
     """
     content = json.dumps(err.error_body)
     status_code = err.code
+    if status_code >= 500 and not isinstance(err, UpstreamError):
+        metrics.record_server_error(status_code)
 
     headers = {
         "Content-Type": "application/json"
@@ -168,6 +186,25 @@ def handle_server_error_httpexception(err: ServerError) -> Response:
     return Response(content, status_code, headers)
 
 
+@api_bp.errorhandler(RejectedError)
+def handle_rejected_error(err: RejectedError) -> Response:
+    """Catches RejectedError when it is raised and
+    creates a JSON response to send to the client.
+    These are not PostgREST errors, they are counted by the admission metrics instead.
+
+    Args:
+        err (RejectedError): Rejected request error.
+
+    Returns:
+        Response: Flask response.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Retry-After": str(err.retry_after),
+    }
+    return Response(json.dumps(err.error_body), err.code, headers)
+
+
 @api_bp.errorhandler(PostgrestHTTPException)
 def handle_postgrest_httpexception(err: PostgrestHTTPException) -> Response:
     """Catches PostgrestHTTPException when it is raised and
@@ -181,6 +218,7 @@ def handle_postgrest_httpexception(err: PostgrestHTTPException) -> Response:
     """
     error_resp = err.response
     status_code = error_resp.status_code
+    metrics.record_upstream_error("postgrest_http", status_code)
     content = json.dumps(err.error_body)
     headers = api_utils.create_headers(error_resp, {}, status_code)
 
@@ -0,0 +1,216 @@
+"""In-process index of the facet counts shown in the filter dropdowns.
+
+The counts are precomputed by the `data.outfit_facet_counts` materialized view
+(sql/facets.sql) and read from PostgREST in a single query, then kept in memory with
+their JSON bodies and ETags already encoded. The index is reloaded every
+`refresh_interval` seconds and when the catalog version changes. Stale counts keep
+being served while a background thread reloads them, so only the very first request
+of a process waits for PostgREST.
+"""
+import json
+import threading
+import time
+import traceback
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urljoin
+
+import requests
+
+from app.api import cache, conditional, metrics, upstream
+from app.api.error_handlers import PostgrestHTTPException, UpstreamError
+from app.logger import logger
+
+DEFAULT_SETTINGS = {
+    # PostgREST relation with the precomputed (facet, value, count) rows.
+    "relation": "facet_counts",
+    # Facet name -> column of data.outfits, the column must be in data.facet_columns.
+    "facets": {
+        "seasons": "season",
+        "stylists": "stylist",
+    },
+    # Seconds between two reloads of the counts.
+    "refresh_interval": 300,
+    # Seconds before a failed reload is tried again.
+    "retry_interval": 10,
+    # Seconds clients may cache the counts for.
+    "max_age": 3600,
+}
+
+
+class FacetBody(NamedTuple):
+    """Encoded counts of one facet, or of every facet."""
+    body: bytes
+    etag: str
+
+
+class FacetSnapshot(NamedTuple):
+    """Counts loaded from PostgREST."""
+    bodies: Dict[Optional[str], FacetBody]
+    catalog_version: str
+    loaded_at: float
+
+
+class FacetIndex:
+    """Facet counts of one process."""
+
+    def __init__(self, settings: dict, postgrest_host: str = None):
+        self.settings = settings
+        self.postgrest_host = postgrest_host
+        self._lock = threading.Lock()
+        self._snapshot: Optional[FacetSnapshot] = None
+        self._next_refresh_at = 0.0
+        self._refreshing = False
+        self._stats = {"loads": 0, "errors": 0}
+
+    def get(self, name: str = None) -> Optional[FacetBody]:
+        """Get the encoded counts of a facet.
+
+        Args:
+            name (str, optional): Facet name, None for every facet. Defaults to None.
+
+        Raises:
+            UpstreamError: If the counts were never loaded and PostgREST can not be reached.
+            PostgrestHTTPException: If the counts were never loaded and PostgREST
+                returns an error.
+
+        Returns:
+            Optional[FacetBody]: Counts, None if the facet does not exist.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                # Another thread may have loaded it while this one was waiting.
+                if self._snapshot is None:
+                    self._snapshot = self.load()
+                snapshot = self._snapshot
+        elif self._is_stale(snapshot):
+            self._refresh_in_background()
+        return snapshot.bodies.get(name, None)
+
+    def _is_stale(self, snapshot: FacetSnapshot) -> bool:
+        """Check if the counts must be reloaded."""
+        return time.monotonic() >= self._next_refresh_at or \
+            snapshot.catalog_version != cache.catalog_version.current()
+
+    def _refresh_in_background(self) -> None:
+        """Reload the counts from a background thread, unless one already is."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="facet-refresh", daemon=True).start()
+
+    def _refresh(self) -> None:
+        """Reload the counts, the current ones are kept if it fails."""
+        try:
+            self._snapshot = self.load()
+        except Exception:  # pylint: disable=broad-except
+            logger.error(traceback.format_exc())
+            self._next_refresh_at = time.monotonic() + self.settings["retry_interval"]
+        finally:
+            self._refreshing = False
+
+    def load(self) -> FacetSnapshot:
+        """Query the counts of every facet from PostgREST and encode them.
+
+        Raises:
+            UpstreamError: If PostgREST can not be reached.
+            PostgrestHTTPException: If PostgREST returns an error.
+
+        Returns:
+            FacetSnapshot: Counts.
+        """
+        catalog_version = cache.catalog_version.current()
+        facets = self.settings["facets"]
+        columns = ",".join(sorted(set(facets.values())))
+        try:
+            resp = upstream.request(
+                method="GET",
+                url=urljoin(self.postgrest_host, self.settings["relation"]),
+                headers={"Accept": "application/json"},
+                params={"facet": f"in.({columns})", "order": "facet,value"},
+            )
+        except requests.exceptions.RequestException as err:
+            self._stats["errors"] += 1
+            metrics.record_upstream_error("server_error", 503)
+            raise UpstreamError(503, hint="Could not load the facet counts.") from err
+        if resp.status_code >= 300:
+            self._stats["errors"] += 1
+            raise PostgrestHTTPException(resp)
+
+        counts = {name: [] for name in facets}
+        for row in resp.json():
+            for name, column in facets.items():
+                if row["facet"] == column:
+                    counts[name].append({column: row["value"], "count": row["count"]})
+
+        bodies = {name: encode(rows) for name, rows in counts.items()}
+        bodies[None] = encode(counts)
+        self._stats["loads"] += 1
+        self._next_refresh_at = time.monotonic() + self.settings["refresh_interval"]
+        return FacetSnapshot(bodies=bodies,
+                             catalog_version=catalog_version,
+                             loaded_at=time.time())
+
+    def stats(self) -> dict:
+        """Loads and age of the counts.
+
+        Returns:
+            dict: Statistics.
+        """
+        snapshot = self._snapshot
+        return {
+            **self._stats,
+            "age": None if snapshot is None else round(time.time() - snapshot.loaded_at, 3),
+            "catalog_version": None if snapshot is None else snapshot.catalog_version,
+        }
+
+
+def encode(counts) -> FacetBody:
+    """Encode counts as JSON, with their ETag.
+
+    Args:
+        counts (Any): Counts of one facet or of every facet.
+
+    Returns:
+        FacetBody: Encoded counts.
+    """
+    body = json.dumps(counts, separators=(",", ":")).encode()
+    return FacetBody(body=body, etag=conditional.create_etag(body))
+
+
+_settings = dict(DEFAULT_SETTINGS)
+facet_index = FacetIndex(_settings)
+
+
+def configure(settings: dict, postgrest_host: str = None) -> None:
+    """Set the facet settings, usually from the `facets` key of the config.
+    The counts are reloaded on next use.
+
+    Args:
+        settings (dict): Facet settings, missing keys fall back to the defaults.
+        postgrest_host (str, optional): PostgREST URL. Defaults to None.
+    """
+    global facet_index  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    facet_index = FacetIndex(_settings, postgrest_host)
+
+
+def get_settings() -> dict:
+    """Current facet settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def cache_control() -> str:
+    """Cache-Control header of the counts.
+
+    Returns:
+        str: Header value.
+    """
+    max_age = _settings["max_age"]
+    return f"public, max-age={max_age}, stale-while-revalidate={max_age}"
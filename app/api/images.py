@@ -0,0 +1,449 @@
+"""Resized and recompressed variants (derivatives) of the uploaded images.
+
+The apps ask for an image at the width they display it, in a format they support, instead
+of the full resolution upload. A derivative is rendered once with Pillow in a process pool,
+so decoding and encoding never hold the GIL of the request threads, then stored in an
+on-disk cache shared by the workers of the host.
+
+Cache entries are addressed by the sha256 of the source key, the source version
+(S3 ETag or file size and mtime) and the derivative parameters, so replacing a source
+never serves stale derivatives from the cache. The least recently used entries are
+deleted when the cache grows past `cache_size` bytes.
+
+Sources are pluggable, see `SOURCES`: `s3` reads the uploads bucket of the `s3` settings
+(an S3 stand-in such as MinIO through its `endpoint_url`), `local` reads a directory.
+"""
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import io
+import os
+import threading
+
+import botocore.exceptions
+from PIL import Image, ImageOps
+
+from app.api import s3
+from app.api.single_flight import SingleFlight
+
+DEFAULT_SETTINGS = {
+    # "s3" or "local"
+    "source": "s3",
+    # Directory of the `local` source.
+    "local_dir": None,
+    "cache_dir": "/tmp/justlooks-image-cache",
+    # Max size of the cache, in bytes.
+    "cache_size": 1024 ** 3,
+    # Number of encoding processes.
+    "workers": 2,
+    # Seconds to wait for an encoding.
+    "timeout": 30,
+    # Widths that can be requested, a small set keeps the cache hit rate high.
+    "widths": [160, 320, 640, 1080],
+    "default_quality": 80,
+    # Larger sources are refused instead of decoded.
+    "max_source_bytes": 20 * 1024 ** 2,
+    "max_age": 31536000,
+}
+
+# Format -> (Pillow format, Content-Type)
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+class SourceError(Exception):
+    """Used when the source store can not be read, such as S3 being unreachable."""
+
+
+class LocalSource:
+    """Images stored in a directory."""
+
+    def __init__(self, settings: dict):
+        self.directory = os.path.realpath(settings["local_dir"])
+
+    def get_path(self, key: str) -> str:
+        """Path of a key, keys can not point outside of the directory.
+
+        Raises:
+            KeyError: If the key is outside of the directory.
+        """
+        path = os.path.realpath(os.path.join(self.directory, key))
+        if os.path.commonpath([path, self.directory]) != self.directory:
+            raise KeyError(key)
+        return path
+
+    def stat(self, key: str) -> tuple:
+        """Version of an image, it changes when the file is replaced, and its size.
+
+        Raises:
+            KeyError: If the image does not exist.
+        """
+        try:
+            stat = os.stat(self.get_path(key))
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError) as err:
+            raise KeyError(key) from err
+        return f"{stat.st_size}-{stat.st_mtime_ns}", stat.st_size
+
+    def fetch(self, key: str, max_bytes: int) -> bytes:
+        """Content of an image, at most `max_bytes + 1` bytes are read.
+
+        Raises:
+            KeyError: If the image does not exist.
+        """
+        try:
+            with open(self.get_path(key), "rb") as file:
+                return file.read(max_bytes + 1)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError) as err:
+            raise KeyError(key) from err
+
+
+class S3Source:
+    """Images uploaded with the presigned POSTs, read with the shared S3 client."""
+
+    def __init__(self, settings: dict):  # pylint: disable=unused-argument
+        self.s3_settings = s3.get_settings()
+
+    def _call(self, method: str, key: str, **kwargs) -> dict:
+        """Call a client method on the object of a key.
+
+        Raises:
+            KeyError: If the object does not exist.
+            SourceError: If S3 can not be reached or refuses the call.
+        """
+        try:
+            return getattr(s3.presign_client.get(), method)(
+                Bucket=self.s3_settings["bucket"], Key=f"{self.s3_settings['key_prefix']}{key}",
+                **kwargs)
+        except botocore.exceptions.ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise KeyError(key) from err
+            raise SourceError(f"S3 {method} of {key} failed: {err}") from err
+        except botocore.exceptions.BotoCoreError as err:
+            raise SourceError(f"S3 {method} of {key} failed: {err}") from err
+
+    def stat(self, key: str) -> tuple:
+        """ETag and size of an object."""
+        head = self._call("head_object", key)
+        return head["ETag"].strip('"'), head["ContentLength"]
+
+    def fetch(self, key: str, max_bytes: int) -> bytes:
+        """Content of an object, at most `max_bytes + 1` bytes are read."""
+        body = self._call("get_object", key)["Body"]
+        try:
+            return body.read(max_bytes + 1)
+        except botocore.exceptions.BotoCoreError as err:
+            raise SourceError(f"S3 read of {key} failed: {err}") from err
+        finally:
+            body.close()
+
+
+SOURCES = {
+    "local": LocalSource,
+    "s3": S3Source,
+}
+
+
+def render(data: bytes, width: int, image_format: str, quality: int) -> bytes:
+    """Decode an image, shrink it to a width and encode it. Runs in the process pool.
+    Images are never enlarged, and are rotated according to their EXIF orientation.
+
+    Args:
+        data (bytes): Source image.
+        width (int): Max width.
+        image_format (str): Format, a key of `FORMATS`.
+        quality (int): Encoding quality, 1 to 100.
+
+    Raises:
+        OSError: If the source is not an image Pillow can decode.
+        ValueError: If the source has too many pixels to be decoded safely.
+
+    Returns:
+        bytes: Encoded derivative.
+    """
+    pil_format = FORMATS[image_format][0]
+    try:
+        source_image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as err:
+        raise ValueError(str(err)) from err
+    with source_image as source:
+        image = ImageOps.exif_transpose(source)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha channel, transparent areas become white.
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+
+        output = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(output, pil_format, optimize=True)
+        else:
+            image.save(output, pil_format, quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class DiskCache:
+    """Content addressed files, the least recently used are deleted past `max_bytes`.
+    Reads bump the file mtime, which orders the eviction. Every worker process keeps its
+    own estimate of the size, eviction lists the directory so the estimates self-correct.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_path(self, digest: str) -> str:
+        """Path of an entry, entries are spread over 256 sub directories."""
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, digest: str) -> bytes:
+        """Read an entry.
+
+        Args:
+            digest (str): Entry digest.
+
+        Returns:
+            bytes: Content, None if the entry is not cached.
+        """
+        path = self.get_path(digest)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return data
+
+    def set(self, digest: str, data: bytes) -> None:
+        """Write an entry, then evict the oldest entries if the cache is too large.
+
+        Args:
+            digest (str): Entry digest.
+            data (bytes): Content.
+        """
+        path = self.get_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self.scan()[1]
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def scan(self) -> tuple:
+        """List the entries.
+
+        Returns:
+            tuple: (mtime, size, path) of every entry, and their total size.
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries, sum(entry[1] for entry in entries)
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache is at 90% of its size,
+        so eviction does not run on every write. Must be called with `_lock`."""
+        entries, size = self.scan()
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            self._stats["evictions"] += 1
+        self._size = size
+
+    def stats(self) -> dict:
+        """Hit/miss and eviction counters.
+
+        Returns:
+            dict: Statistics.
+        """
+        return {**self._stats, "size": self._size, "max_size": self.max_bytes}
+
+
+class DerivativeService:
+    """Renders and caches the derivatives of the images of a source."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.cache = DiskCache(settings["cache_dir"], settings["cache_size"])
+        self.flights = SingleFlight()
+        self._source = None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def source(self):
+        """Source store, built on first use."""
+        if self._source is None:
+            self._source = SOURCES[self.settings["source"]](self.settings)
+        return self._source
+
+    def get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Get the process pool of the current process, creating it if needed.
+        A forked worker creates its own instead of using the processes of its parent.
+
+        Returns:
+            concurrent.futures.ProcessPoolExecutor: Pool.
+        """
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.settings["workers"])
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @staticmethod
+    def make_digest(key: str, version: str, width: int, image_format: str,
+                    quality: int) -> str:
+        """Address of a derivative in the cache, also used as its ETag.
+
+        Returns:
+            str: sha256 hex digest.
+        """
+        return hashlib.sha256(
+            f"{key}\0{version}\0{width}\0{image_format}\0{quality}".encode()).hexdigest()
+
+    def get(self, key: str, width: int, image_format: str, quality: int) -> tuple:
+        """Get a derivative from the cache, rendering it on a miss.
+        Concurrent requests of the same derivative share one rendering.
+
+        Args:
+            key (str): Source image key.
+            width (int): Max width.
+            image_format (str): Format, a key of `FORMATS`.
+            quality (int): Encoding quality.
+
+        Raises:
+            KeyError: If the source image does not exist.
+            SourceError: If the source store can not be read.
+            ValueError: If the source image is too large.
+            OSError: If the source is not an image.
+            concurrent.futures.process.BrokenProcessPool: If the encoding processes
+                died twice.
+            concurrent.futures.TimeoutError: If the encoding took longer than `timeout`.
+
+        Returns:
+            tuple: Derivative and its digest.
+        """
+        version, size = self.source.stat(key)
+        digest = self.make_digest(key, version, width, image_format, quality)
+        data = self.cache.get(digest)
+        if data is None:
+            data, _ = self.flights.do(
+                digest, lambda: self._render(key, size, digest, width, image_format, quality))
+        return data, digest
+
+    def _render(self, key: str, size: int, digest: str, width: int, image_format: str,
+                quality: int) -> bytes:
+        """Render a derivative in the process pool and cache it.
+        Large sources are refused before they are downloaded, and the download is capped
+        in case the source was replaced since its size was read."""
+        max_bytes = self.settings["max_source_bytes"]
+        too_large = f"Image {key} is larger than {max_bytes} bytes."
+        if size > max_bytes:
+            raise ValueError(too_large)
+        source = self.source.fetch(key, max_bytes)
+        if len(source) > max_bytes:
+            raise ValueError(too_large)
+        data = self._render_in_pool(source, width, image_format, quality)
+        self.cache.set(digest, data)
+        return data
+
+    def _render_in_pool(self, *args) -> bytes:
+        """Call `render` in the process pool. A pool loses a process when it is killed,
+        by the OOM killer for example, and then refuses every task, so it is replaced
+        and the rendering is retried once."""
+        pool = self.get_pool()
+        try:
+            return pool.submit(render, *args).result(timeout=self.settings["timeout"])
+        except concurrent.futures.process.BrokenProcessPool:
+            self._drop_pool(pool)
+        return self.get_pool().submit(render, *args).result(timeout=self.settings["timeout"])
+
+    def _drop_pool(self, pool: concurrent.futures.ProcessPoolExecutor) -> None:
+        """Forget a broken pool, unless another thread already replaced it."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """Stop the encoding processes."""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+_settings = dict(DEFAULT_SETTINGS)
+derivatives = DerivativeService(_settings)
+
+
+def configure(settings: dict) -> None:
+    """Set the image settings, usually from the `images` key of the config.
+
+    Args:
+        settings (dict): Image settings, missing keys fall back to the defaults.
+
+    Raises:
+        ValueError: If the source is unknown.
+    """
+    global derivatives  # pylint: disable=global-statement
+    new_settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if new_settings["source"] not in SOURCES:
+        raise ValueError(f"Unknown image source {new_settings['source']}, "
+                         f"expected one of {tuple(SOURCES)}")
+    derivatives.shutdown()
+    _settings.clear()
+    _settings.update(new_settings)
+    derivatives = DerivativeService(dict(_settings))
+
+
+def get_settings() -> dict:
+    """Current image settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def cache_control() -> str:
+    """Cache-Control of the derivatives. Uploads are not replaced, a new image gets
+    a new file name, so clients can keep a derivative for `max_age` without revalidating.
+
+    Returns:
+        str: Cache-Control header value.
+    """
+    return f"public, max-age={_settings['max_age']}, immutable"
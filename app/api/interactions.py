@@ -0,0 +1,227 @@
+"""Buffered ingestion of the likes and other interaction events.
+
+Sending every tap to PostgREST would be one round trip and one transaction per event.
+Events are queued in process instead, and a background thread inserts them with one
+multi-row POST to the `interactions` relation (sql/interactions.sql) every `batch_size`
+events or `flush_interval` seconds, whichever comes first.
+
+Events only leave the queue once PostgREST accepted them and failed flushes are retried,
+so an event is stored at least once as long as the process runs. On a graceful exit the
+queue is flushed for at most `shutdown_timeout` seconds, events still queued after that,
+or when the process is killed, are lost. Every event has an `event_id` and the inserts
+ignore the ids already stored, so retries and clients sending an event twice do not
+create duplicates.
+When the queue is full new events are refused, the route answers 503 until the
+flush thread catches up.
+"""
+import atexit
+import collections
+import os
+import threading
+import time
+import traceback
+from typing import List
+
+import requests
+
+from app.api import upstream
+from app.logger import logger
+
+DEFAULT_SETTINGS = {
+    "relation": "interactions",
+    # Max number of events waiting to be inserted, new events are refused past it.
+    "queue_size": 10000,
+    # Events per insert, a flush starts as soon as that many are queued.
+    "batch_size": 500,
+    # Max seconds an event waits in the queue.
+    "flush_interval": 1.0,
+    # Seconds to wait before retrying a failed insert.
+    "retry_interval": 2.0,
+    # Max events per request.
+    "max_request_events": 100,
+    # Max seconds spent flushing the queue when the process exits.
+    "shutdown_timeout": 10.0,
+}
+
+EVENT_TYPES = ("like", "unlike", "view", "click")
+
+
+class InteractionQueue:
+    """Bounded queue of events with its flush thread."""
+
+    def __init__(self, settings: dict, postgrest_host: str = None):
+        self.settings = settings
+        self.postgrest_host = postgrest_host
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closing = False
+        # Set when `close` gave up waiting, the flush thread stops retrying.
+        self._stopped = False
+        # When the oldest queued event was added.
+        self._first_queued_at = 0.0
+        self._stats = {"accepted": 0, "refused": 0, "inserted": 0, "rejected": 0,
+                       "flushes": 0, "flush_errors": 0}
+
+    def add(self, events: List[dict]) -> bool:
+        """Queue events, all of them or none.
+
+        Args:
+            events (List[dict]): Events, in the format of the `interactions` relation.
+
+        Returns:
+            bool: False if the queue does not have room for the events.
+        """
+        with self._condition:
+            if len(self._events) + len(events) > self.settings["queue_size"]:
+                self._stats["refused"] += len(events)
+                return False
+            if not self._events:
+                self._first_queued_at = time.monotonic()
+            self._events.extend(events)
+            self._stats["accepted"] += len(events)
+            self._start()
+            self._condition.notify()
+        return True
+
+    def _start(self) -> None:
+        """Start the flush thread if it is not running. Must be called with `_condition`."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="interactions-flush",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        """Flush thread, inserts a batch whenever it is full or its oldest event is due."""
+        while not self._stopped:
+            with self._condition:
+                while not self._closing and len(self._events) < self.settings["batch_size"]:
+                    if not self._events:
+                        self._condition.wait()
+                        continue
+                    remaining = (self._first_queued_at + self.settings["flush_interval"]
+                                 - time.monotonic())
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closing and not self._events:
+                    return
+
+            if not self.flush_batch():
+                # Still retried while closing, `close` only waits `shutdown_timeout`.
+                time.sleep(self.settings["retry_interval"])
+
+    def flush_batch(self) -> bool:
+        """Insert the oldest events, they are removed from the queue once PostgREST
+        accepted them. Events PostgREST rejects (4xx) are logged and dropped,
+        retrying them would block every event queued after them.
+
+        Returns:
+            bool: False if the insert failed and must be retried.
+        """
+        with self._condition:
+            batch = [self._events[i]
+                     for i in range(min(len(self._events), self.settings["batch_size"]))]
+        if not batch:
+            return True
+
+        url = f"{self.postgrest_host}{self.settings['relation']}?on_conflict=event_id"
+        headers = {"Prefer": "resolution=ignore-duplicates,return=minimal"}
+        self._stats["flushes"] += 1
+        try:
+            response = upstream.request("POST", url, json=batch, headers=headers)
+        except requests.exceptions.RequestException:
+            self._stats["flush_errors"] += 1
+            logger.error(traceback.format_exc())
+            return False
+
+        if response.status_code >= 500:
+            self._stats["flush_errors"] += 1
+            logger.error(f"[Interactions] Insert of {len(batch)} events failed: "
+                         f"{response.status_code} {response.text}")
+            return False
+        if response.status_code >= 400:
+            self._stats["rejected"] += len(batch)
+            logger.error(f"[Interactions] Dropped {len(batch)} events rejected by PostgREST: "
+                         f"{response.status_code} {response.text}")
+        else:
+            self._stats["inserted"] += len(batch)
+
+        with self._condition:
+            for _ in batch:
+                self._events.popleft()
+        return True
+
+    def close(self, timeout: float = None) -> None:
+        """Flush the queued events and stop the flush thread.
+
+        Args:
+            timeout (float, optional): Max seconds to wait, defaults to `shutdown_timeout`.
+        """
+        timeout = self.settings["shutdown_timeout"] if timeout is None else timeout
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._condition:
+            self._stopped = True
+            remaining = len(self._events)
+        if remaining:
+            logger.error(f"[Interactions] {remaining} events were not inserted before exit")
+
+    def stats(self) -> dict:
+        """Queue size and event counters.
+
+        Returns:
+            dict: Statistics.
+        """
+        return {
+            **self._stats,
+            "queued": len(self._events),
+            "queue_size": self.settings["queue_size"],
+        }
+
+
+_settings = dict(DEFAULT_SETTINGS)
+interaction_queue = InteractionQueue(_settings)
+
+
+def configure(settings: dict, postgrest_host: str) -> None:
+    """Set the interaction settings, usually from the `interactions` key of the config.
+
+    Args:
+        settings (dict): Interaction settings, missing keys fall back to the defaults.
+        postgrest_host (str): PostgREST URL, ending with a slash.
+    """
+    global interaction_queue  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    interaction_queue = InteractionQueue(dict(_settings), postgrest_host)
+
+
+def get_settings() -> dict:
+    """Current interaction settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def _close_at_exit() -> None:
+    """Flush the events still queued when the process exits."""
+    interaction_queue.close()
+
+
+def _reset_after_fork() -> None:
+    """A forked worker starts with an empty queue, the parent flushes its own events."""
+    global interaction_queue  # pylint: disable=global-statement
+    interaction_queue = InteractionQueue(interaction_queue.settings,
+                                         interaction_queue.postgrest_host)
+
+
+atexit.register(_close_at_exit)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
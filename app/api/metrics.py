@@ -0,0 +1,116 @@
+"""Prometheus metrics of the API, served at /metrics.
+
+Under gunicorn every worker has its own counters, set the `PROMETHEUS_MULTIPROC_DIR`
+environment variable to an empty directory before the workers start so their values are
+written there and aggregated when /metrics is scraped. Call `mark_process_dead` from the
+gunicorn `child_exit` hook so the gauges of dead workers are dropped.
+"""
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUESTS = Counter("justlooks_api_requests_total",
+                   "Requests by route and status.",
+                   ["route", "method", "status"])
+REQUEST_LATENCY = Histogram("justlooks_api_request_duration_seconds",
+                            "Time spent answering a request, by route and status.",
+                            ["route", "method", "status"],
+                            buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram("justlooks_api_response_size_bytes",
+                          "Size of the response bodies, by route.",
+                          ["route"],
+                          buckets=SIZE_BUCKETS)
+UPSTREAM_ERRORS = Counter("justlooks_api_upstream_errors_total",
+                          "Errors talking to PostgREST, `type` is `postgrest_http` for error "
+                          "responses of PostgREST and `server_error` when it could not be reached.",
+                          ["type", "status"])
+SERVER_ERRORS = Counter("justlooks_api_server_errors_total",
+                        "5xx errors of the API itself, such as a full queue or a model that is "
+                        "not loaded. Errors of PostgREST are in the upstream errors.",
+                        ["status"])
+PIVOT_RPCS = Counter("justlooks_api_pivot_rpc_total",
+                     "Calls to rpc/pivot_values.")
+CACHE_LOOKUPS = Counter("justlooks_api_cache_lookups_total",
+                        "Cache lookups by cache and result (hit, miss or bypass).",
+                        ["cache", "result"])
+ADMISSION_REJECTED = Counter("justlooks_api_admission_rejected_total",
+                             "Requests refused by the admission control, `reason` is "
+                             "`rate_limited`, `queue_full` or `queue_timeout`.",
+                             ["route", "reason"])
+UPSTREAM_IN_FLIGHT = Gauge("justlooks_api_upstream_in_flight",
+                           "Requests to PostgREST waiting for a response.",
+                           multiprocess_mode="livesum")
+UPSTREAM_POOL_SIZE = Gauge("justlooks_api_upstream_pool_size",
+                           "Max number of pooled connections to PostgREST, the saturation of "
+                           "the pools is in_flight / pool_size.",
+                           multiprocess_mode="livesum")
+
+
+def get_multiprocess_dir():
+    """Directory shared by the workers, None when running in a single process."""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR", None) or \
+        os.environ.get("prometheus_multiproc_dir", None)
+
+
+def export() -> tuple:
+    """Render every metric in the Prometheus text format.
+
+    Returns:
+        tuple: Body and content type.
+    """
+    if get_multiprocess_dir() is None:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of a worker that exited.
+
+    Args:
+        pid (int): Process id of the worker.
+    """
+    if get_multiprocess_dir() is not None:
+        multiprocess.mark_process_dead(pid)
+
+
+def record_request(route: str, method: str, status: int, duration: float,
+                   response_size: int = None) -> None:
+    """Count a request.
+
+    Args:
+        route (str): Route, PostgREST route for proxied requests.
+        method (str): HTTP method.
+        status (int): Response status code.
+        duration (float): Seconds spent answering the request.
+        response_size (int, optional): Size of the response body, None if it is streamed.
+    """
+    REQUESTS.labels(route, method, status).inc()
+    REQUEST_LATENCY.labels(route, method, status).observe(duration)
+    if response_size is not None:
+        RESPONSE_SIZE.labels(route).observe(response_size)
+
+
+def record_upstream_error(error_type: str, status: int) -> None:
+    """Count an error talking to PostgREST.
+
+    Args:
+        error_type (str): `postgrest_http` or `server_error`.
+        status (int): Status code sent to the client.
+    """
+    UPSTREAM_ERRORS.labels(error_type, status).inc()
+
+
+def record_server_error(status: int) -> None:
+    """Count a 5xx error of the API that is not an error talking to PostgREST.
+
+    Args:
+        status (int): Status code sent to the client.
+    """
+    SERVER_ERRORS.labels(status).inc()
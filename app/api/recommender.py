@@ -0,0 +1,298 @@
+"""Serving of the recommendation models trained offline with LightFM.
+
+A trained model is exported as plain .npy arrays in its own directory under
+`model_dir`, then published by writing its directory name to the `LATEST` file.
+The arrays are memory-mapped, so loading a model is cheap and every worker on the host
+shares the same pages. `LATEST` is checked at most once per `check_interval`, a new model
+is swapped in without a restart and requests already scoring keep the old one.
+
+Layout of a model directory:
+    user_ids.npy                 Sorted user ids.
+    user_embeddings.npy          (users, dim) float32, in the order of `user_ids`.
+    <kind>_ids.npy               int_id of every item of a kind, `outfits` or `products`.
+    <kind>_embeddings.npy        (items, dim) float32.
+    <kind>_biases.npy            (items,) float32.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_SETTINGS = {
+    # Directory with one sub directory per exported model and the LATEST pointer file.
+    "model_dir": None,
+    # Seconds between two checks of the LATEST pointer file.
+    "check_interval": 5.0,
+    "default_limit": 20,
+    "max_limit": 100,
+}
+
+LATEST_FILE = "LATEST"
+ITEM_KINDS = ("outfits", "products")
+
+
+class ItemEmbeddings(NamedTuple):
+    """Embeddings of the items of one kind."""
+    ids: np.ndarray
+    embeddings: np.ndarray
+    biases: np.ndarray
+
+
+class Recommendation(NamedTuple):
+    """Top items of a user."""
+    ids: List[int]
+    scores: List[float]
+    # False if the user is not in the model and the most popular items were returned.
+    personalized: bool
+
+
+class RecommendationModel:
+    """Memory-mapped embeddings of an exported model."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version = os.path.basename(os.path.normpath(path))
+        self.user_ids = np.load(os.path.join(path, "user_ids.npy"), mmap_mode="r")
+        self.user_embeddings = np.load(os.path.join(path, "user_embeddings.npy"), mmap_mode="r")
+        self.items: Dict[str, ItemEmbeddings] = {}
+        for kind in ITEM_KINDS:
+            ids_path = os.path.join(path, f"{kind}_ids.npy")
+            if os.path.exists(ids_path):
+                self.items[kind] = ItemEmbeddings(
+                    ids=np.load(ids_path, mmap_mode="r"),
+                    embeddings=np.load(os.path.join(path, f"{kind}_embeddings.npy"),
+                                       mmap_mode="r"),
+                    biases=np.load(os.path.join(path, f"{kind}_biases.npy"), mmap_mode="r"))
+
+    def get_user_embedding(self, user_id) -> Optional[np.ndarray]:
+        """Embedding of a user, found with a binary search of the sorted user ids.
+
+        Args:
+            user_id (Any): User id, converted to the type of the exported ids.
+
+        Returns:
+            Optional[np.ndarray]: Embedding, None if the user is not in the model.
+        """
+        if self.user_ids.dtype.kind in "iu":
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                return None
+        else:
+            user_id = str(user_id)
+        index = int(np.searchsorted(self.user_ids, user_id))
+        if index == len(self.user_ids) or self.user_ids[index] != user_id:
+            return None
+        return self.user_embeddings[index]
+
+    def recommend(self, user_id, kind: str, limit: int,
+                  exclude: List[int] = None) -> Recommendation:
+        """Top items of a kind for a user, scored as item embedding . user embedding
+        + item bias. Users missing from the model get the items with the highest bias.
+
+        Args:
+            user_id (Any): User id.
+            kind (str): Item kind, `outfits` or `products`.
+            limit (int): Number of items.
+            exclude (List[int], optional): int_id of items to leave out,
+                such as the ones the user already liked. Defaults to None.
+
+        Raises:
+            KeyError: If the model has no items of that kind.
+
+        Returns:
+            Recommendation: Items sorted by decreasing score.
+        """
+        items = self.items[kind]
+        user_embedding = self.get_user_embedding(user_id)
+        if user_embedding is None:
+            scores = np.array(items.biases, dtype=np.float32)
+        else:
+            scores = items.embeddings @ user_embedding
+            scores += items.biases
+
+        if exclude:
+            scores[np.isin(items.ids, exclude)] = -np.inf
+
+        top = top_k(scores, limit)
+        top = top[np.isfinite(scores[top])]
+        return Recommendation(ids=items.ids[top].tolist(),
+                              scores=scores[top].tolist(),
+                              personalized=user_embedding is not None)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the `k` highest scores, sorted by decreasing score.
+    Partitions first so only `k` scores are sorted.
+
+    Args:
+        scores (np.ndarray): Scores.
+        k (int): Number of indexes.
+
+    Returns:
+        np.ndarray: Indexes.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class ModelStore:
+    """Current model of a model directory, swapped when LATEST changes."""
+
+    def __init__(self, model_dir: str = None, check_interval: float = 5.0):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._model: Optional[RecommendationModel] = None
+        self._checked_at = 0.0
+        self._latest_mtime = None
+        self._stats = {"loads": 0, "errors": 0}
+
+    def get(self) -> Optional[RecommendationModel]:
+        """Get the latest model, loading it if LATEST changed since the last check.
+
+        Returns:
+            Optional[RecommendationModel]: Model, None if no model was published.
+        """
+        if self.model_dir is None:
+            return None
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._model
+
+        with self._lock:
+            # Another thread may have checked while this one was waiting.
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._reload_if_changed()
+                self._checked_at = time.monotonic()
+            return self._model
+
+    def _reload_if_changed(self) -> None:
+        """Load the model LATEST points to if it changed, keep the current one on errors.
+        Must be called while holding `_lock`."""
+        latest_path = os.path.join(self.model_dir, LATEST_FILE)
+        try:
+            mtime = os.stat(latest_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._latest_mtime:
+            return
+
+        try:
+            with open(latest_path, encoding="utf-8") as file:
+                version = file.read().strip()
+            self._model = RecommendationModel(os.path.join(self.model_dir, version))
+            self._stats["loads"] += 1
+        except (OSError, ValueError):
+            # Keep serving the current model, the export may still be in progress.
+            self._stats["errors"] += 1
+            return
+        self._latest_mtime = mtime
+
+    def stats(self) -> dict:
+        """Loaded model and load counters.
+
+        Returns:
+            dict: Statistics.
+        """
+        model = self._model
+        return {
+            **self._stats,
+            "version": None if model is None else model.version,
+            "users": None if model is None else len(model.user_ids),
+            "items": None if model is None else {kind: len(items.ids)
+                                                 for kind, items in model.items.items()},
+        }
+
+
+def export_model(directory: str, version: str, user_ids, user_embeddings,
+                 items: Dict[str, Tuple]) -> str:
+    """Write a model in the layout read by `RecommendationModel` and publish it.
+
+    Args:
+        directory (str): Model directory, `model_dir` of the config.
+        version (str): Name of the model, such as the id of its
+            data.trained_recommendation_models row.
+        user_ids (array_like): Id of every user.
+        user_embeddings (array_like): (users, dim) embeddings, in the order of `user_ids`.
+        items (Dict[str, Tuple]): Kind -> (int_ids, embeddings, biases) of its items.
+
+    Returns:
+        str: Path of the model.
+    """
+    path = os.path.join(directory, version)
+    os.makedirs(path, exist_ok=True)
+
+    user_ids = np.asarray(user_ids)
+    order = np.argsort(user_ids, kind="stable")
+    np.save(os.path.join(path, "user_ids.npy"), user_ids[order])
+    np.save(os.path.join(path, "user_embeddings.npy"),
+            np.asarray(user_embeddings, dtype=np.float32)[order])
+    for kind, (ids, embeddings, biases) in items.items():
+        np.save(os.path.join(path, f"{kind}_ids.npy"), np.asarray(ids, dtype=np.int64))
+        np.save(os.path.join(path, f"{kind}_embeddings.npy"),
+                np.asarray(embeddings, dtype=np.float32))
+        np.save(os.path.join(path, f"{kind}_biases.npy"), np.asarray(biases, dtype=np.float32))
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump({"version": version, "kinds": sorted(items)}, file)
+
+    # Readers only ever see a complete model, LATEST is replaced atomically.
+    tmp_latest = os.path.join(directory, f".{LATEST_FILE}.{os.getpid()}")
+    with open(tmp_latest, "w", encoding="utf-8") as file:
+        file.write(version)
+    os.replace(tmp_latest, os.path.join(directory, LATEST_FILE))
+    return path
+
+
+def export_lightfm_model(directory: str, version: str, model, user_ids,
+                         items: Dict[str, Tuple]) -> str:
+    """Export a trained `lightfm.LightFM` model, see `export_model`.
+
+    Args:
+        directory (str): Model directory.
+        version (str): Name of the model.
+        model (lightfm.LightFM): Trained model.
+        user_ids (array_like): Id of the user of every row of the interaction matrix.
+        items (Dict[str, Tuple]): Kind -> (int_ids, rows) of its items, `rows` are their
+            columns in the interaction matrix.
+
+    Returns:
+        str: Path of the model.
+    """
+    return export_model(directory, version, user_ids, model.user_embeddings, {
+        kind: (ids, model.item_embeddings[rows], model.item_biases[rows])
+        for kind, (ids, rows) in items.items()
+    })
+
+
+_settings = dict(DEFAULT_SETTINGS)
+model_store = ModelStore()
+
+
+def configure(settings: dict) -> None:
+    """Set the recommendation settings, usually from the `recommendations` key of the config.
+
+    Args:
+        settings (dict): Recommendation settings, missing keys fall back to the defaults.
+    """
+    global model_store  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    model_store = ModelStore(_settings["model_dir"], _settings["check_interval"])
+
+
+def get_settings() -> dict:
+    """Current recommendation settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
@@ -0,0 +1,154 @@
+"""Admission control of every request in this Blueprint, see `app.api.admission`.
+"""
+import contextlib
+from typing import List, Optional
+
+from flask import Response, g, request
+from werkzeug.wsgi import ClosingIterator
+
+from app.api import admission, api_bp, metrics
+from app.api.error_handlers import RejectedError
+
+
+@api_bp.before_request
+def admit_request() -> None:
+    """Refuse the request if its client is over its rate, or wait for a slot of its route.
+    This is registered after the other `before_request` handlers, so refused requests
+    still get a request id and are counted in the request metrics.
+
+    Raises:
+        RejectedError: 429 if the client is over its rate, 503 if the route is saturated.
+    """
+    route = None if request.url_rule is None else request.url_rule.rule
+    g.admission_limiter = admit(route, get_request_clients())
+
+
+@api_bp.after_request
+def hold_slot_while_streaming(response: Response) -> Response:
+    """A streamed body is sent after the teardown handlers ran, its slot is only given
+    back once the body is closed, since it still holds a PostgREST connection until then.
+
+    Args:
+        response (Response): Outgoing flask response.
+
+    Returns:
+        Response: Response, its body releases the slot if it is streamed.
+    """
+    if response.is_streamed and g.get("admission_limiter", None) is not None:
+        response.response = ClosingIterator(response.response,
+                                            [g.pop("admission_limiter").release])
+    return response
+
+
+@api_bp.teardown_request
+def release_request_slot(_err=None) -> None:
+    """Give the slot of the route back, whatever happened to the request."""
+    limiter = g.pop("admission_limiter", None)
+    if limiter is not None:
+        limiter.release()
+
+
+def get_request_clients() -> List[str]:
+    """Token bucket keys of the client of the current request.
+
+    Returns:
+        List[str]: Client keys, see `admission.get_client_keys`.
+    """
+    return admission.get_client_keys(request.headers, request.remote_addr,
+                                     admission.controller.settings)
+
+
+def admit(route: Optional[str], clients: List[str]) -> Optional[admission.RouteLimiter]:
+    """Take a token for a client, then a slot of a route.
+
+    Args:
+        route (Optional[str]): URL rule, None if the path matches no route.
+        clients (List[str]): Client keys, see `admission.get_client_keys`.
+
+    Raises:
+        RejectedError: 429 if the client is over its rate, 503 if the route is saturated.
+
+    Returns:
+        Optional[admission.RouteLimiter]: Limiter whose slot was taken, it must be
+            released. None if the request is not limited.
+    """
+    controller = admission.controller
+    if controller.is_exempt(request.path):
+        return None
+
+    take_tokens(controller, "unmatched" if route is None else route, clients)
+    if route is None:
+        return None
+    limiter = controller.get_limiter(route)
+    acquire_slot(controller, route, limiter)
+    return limiter
+
+
+def take_tokens(controller: admission.AdmissionController, route: str,
+                clients: List[str]) -> None:
+    """Take a token for every key of a client.
+
+    Args:
+        controller (admission.AdmissionController): Controller.
+        route (str): URL rule, only used to count refused requests.
+        clients (List[str]): Client keys, see `admission.get_client_keys`.
+
+    Raises:
+        RejectedError: 429 if the client is over its rate.
+    """
+    allowed, wait = controller.take_tokens(clients)
+    if not allowed:
+        reject(controller, route, "rate_limited")
+        raise RejectedError(429, admission.retry_after(wait),
+                            hint="Too many requests, slow down.")
+
+
+def acquire_slot(controller: admission.AdmissionController, route: str,
+                 limiter: admission.RouteLimiter) -> None:
+    """Take a slot of a route, waiting for one at most `queue_timeout` seconds.
+
+    Args:
+        controller (admission.AdmissionController): Controller.
+        route (str): URL rule.
+        limiter (admission.RouteLimiter): Limiter of the route.
+
+    Raises:
+        RejectedError: 503 if the route is saturated.
+    """
+    reason = limiter.acquire(controller.settings["queue_timeout"])
+    if reason is not None:
+        reject(controller, route, reason)
+        raise RejectedError(503, admission.retry_after(controller.settings["queue_timeout"]),
+                            hint="The server is overloaded, retry later.")
+
+
+@contextlib.contextmanager
+def admitted(route: str, clients: List[str]):
+    """Run a block with a token and a slot of a route, like a request of that route.
+    Used by requests that run the views of other routes, such as /batch.
+
+    Args:
+        route (str): URL rule.
+        clients (List[str]): Client keys, see `admission.get_client_keys`.
+
+    Raises:
+        RejectedError: 429 if the client is over its rate, 503 if the route is saturated.
+    """
+    limiter = admit(route, clients)
+    try:
+        yield
+    finally:
+        if limiter is not None:
+            limiter.release()
+
+
+def reject(controller: admission.AdmissionController, route: str, reason: str) -> None:
+    """Count a refused request.
+
+    Args:
+        controller (admission.AdmissionController): Controller.
+        route (str): URL rule.
+        reason (str): `rate_limited`, `queue_full` or `queue_timeout`.
+    """
+    controller.reject(route, reason)
+    metrics.ADMISSION_REJECTED.labels(route, reason).inc()
@@ -1,8 +1,9 @@
 """Functions here will be performed after any request.
 """
-from flask import Response, make_response
+from flask import Response, make_response, request
+from werkzeug.datastructures import Headers
 
-from app.api import api_bp
+from app.api import api_bp, compression
 
 
 @api_bp.after_request
@@ -23,3 +24,27 @@ def add_cors_headers(response: Response) -> Response:
     # If Access-Control-Allow-Origin header is not there, set it.
     modified_response.headers.setdefault("Access-Control-Allow-Origin", "*")
     return modified_response
+
+
+@api_bp.after_request
+def compress_response(response: Response) -> Response:
+    """Compress the responses that were not already compressed, such as
+    JSON error bodies. The proxy compresses its own responses so they can be cached
+    compressed.
+
+    Args:
+        response (Response): Outgoing flask response.
+
+    Returns:
+        Response: Response, compressed if the client accepts it.
+    """
+    if response.is_streamed or response.direct_passthrough:
+        return response
+
+    headers, body = compression.encode_response(list(response.headers.items()),
+                                                response.get_data(),
+                                                compression.negotiate(
+                                                    request.headers.get("Accept-Encoding", None)))
+    response.set_data(body)
+    response.headers = Headers(headers)
+    return response
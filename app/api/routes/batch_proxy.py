@@ -0,0 +1,162 @@
+"""Batch route, answers several proxy queries in one round trip.
+"""
+import json
+import traceback
+
+from flask import current_app, jsonify, request, Response
+from webargs import fields, validate
+from webargs.flaskparser import use_kwargs
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+
+from app.api import api_bp, batch, error_handlers
+from app.api.error_handlers import RejectedError, ServerError, PostgrestHTTPException
+from app.api.routes import admission_control
+from app.api.routes.proxy import PROXY_RULE, get_postgrest_proxy
+from app.logger import logger
+
+# Headers of the batch request that are not sent with the sub-requests.
+# The sub-responses are embedded in a JSON body, so they must not be compressed
+# and can not be answered with a 304.
+EXCLUDED_HEADERS = {"content-type", "content-length", "accept-encoding", "if-none-match"}
+
+# Headers of the sub-responses returned to the client.
+RETURNED_HEADERS = ["Content-Range", "Link", "ETag", "Cache-Control", "Age"]
+
+batch_args = {
+    "requests": fields.List(fields.Nested({
+        "path": fields.Str(required=True, validate=validate.Length(min=1)),
+        "params": fields.Dict(keys=fields.Str()),
+    }), required=True, validate=validate.Length(min=1)),
+}
+
+
+@api_bp.route('/batch', methods=['POST'])
+@use_kwargs(batch_args, location="json")  # Injects keyword arguments
+def post_batch(requests: list) -> Response:  # pylint: disable=redefined-outer-name
+    """Run several proxy queries concurrently and return all of them in one response.
+    Body: {"requests": [{"path": "products", "params": {"limit": 20}}, ...]}
+    Every sub-request goes through the same admission control, query param rewriting,
+    caching and pagination as GET /api/<path>, with the headers of the batch request.
+    Sub-requests refused by the admission control get a 429 or 503 entry.
+
+    Args:
+        requests (list): Path and query params of every sub-request.
+
+    Raises:
+        ServerError: If there are more sub-requests than allowed in one batch.
+
+    Returns:
+        Response: Flask response with the status, headers and body of every sub-request,
+            in the order of the sub-requests.
+    """
+    max_requests = batch.get_settings()["max_requests"]
+    if len(requests) > max_requests:
+        raise ServerError(400, hint=f"At most {max_requests} requests can be sent at once.")
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    base_url = request.url_root
+    headers = [(key, val) for key, val in request.headers.items()
+               if key.lower() not in EXCLUDED_HEADERS]
+    clients = admission_control.get_request_clients()
+
+    def run_sub_request(sub_request: dict) -> dict:
+        path = sub_request["path"].lstrip("/")
+        # A new app context gives the sub-request its own `g`,
+        # its teardown must not touch the state of the batch request.
+        with app.app_context(), \
+                app.test_request_context(f"/api/{path}",
+                                         base_url=base_url,
+                                         query_string=create_query_string(
+                                             sub_request.get("params", {})),
+                                         headers=headers):
+            response, body = dispatch_sub_request(path, clients)
+            return {
+                "path": path,
+                "status": response.status_code,
+                "headers": {key: response.headers[key] for key in RETURNED_HEADERS
+                            if key in response.headers},
+                "body": body,
+            }
+
+    return jsonify({"responses": batch.run(run_sub_request, requests)})
+
+
+def dispatch_sub_request(path: str, clients: list) -> tuple:
+    """Run the proxy for a sub-request with a token of the client and a slot of the
+    proxy route, held until the body is read. Errors are turned into responses
+    like they would be for GET /api/<path>.
+    Must be called in the request context of the sub-request.
+
+    Args:
+        path (str): URL path that corresponds to a PostgREST route.
+        clients (list): Token bucket keys of the client of the batch.
+
+    Returns:
+        tuple: Flask response and its body, see `load_body`.
+    """
+    try:
+        with admission_control.admitted(PROXY_RULE, clients):
+            response = run_proxy(path)
+            return response, load_body(response)
+    except RejectedError as err:
+        response = error_handlers.handle_rejected_error(err)
+        return response, load_body(response)
+
+
+def run_proxy(path: str) -> Response:
+    """Run the proxy for a sub-request, errors are turned into responses
+    like they would be for GET /api/<path>.
+    Must be called in the request context of the sub-request.
+
+    Args:
+        path (str): URL path that corresponds to a PostgREST route.
+
+    Returns:
+        Response: Flask response.
+    """
+    try:
+        return get_postgrest_proxy(path)
+    except PostgrestHTTPException as err:
+        return error_handlers.handle_postgrest_httpexception(err)
+    except ServerError as err:
+        return error_handlers.handle_server_error_httpexception(err)
+    except HTTPException as err:
+        return error_handlers.handle_httpexception(err)
+    except Exception:  # pylint: disable=broad-except
+        # One broken sub-request must not fail the whole batch.
+        logger.error(traceback.format_exc())
+        return error_handlers.handle_server_error_httpexception(ServerError(500))
+
+
+def create_query_string(params: dict) -> MultiDict:
+    """Query params of a sub-request, lists are sent as repeated params.
+
+    Args:
+        params (dict): Query params, values are scalars or lists of scalars.
+
+    Returns:
+        MultiDict: Query params.
+    """
+    query_string = MultiDict()
+    for key, val in params.items():
+        for item in val if isinstance(val, list) else [val]:
+            query_string.add(key, json.dumps(item) if isinstance(item, bool) else str(item))
+    return query_string
+
+
+def load_body(response: Response):
+    """Body of a sub-response, decoded if it is JSON.
+
+    Args:
+        response (Response): Flask response.
+
+    Returns:
+        Any: Decoded JSON, text otherwise, None if the body is empty.
+    """
+    data = response.get_data()
+    if not data:
+        return None
+    if response.mimetype and "json" in response.mimetype:
+        return json.loads(data)
+    return data.decode("utf-8", errors="replace")
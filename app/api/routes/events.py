@@ -0,0 +1,80 @@
+"""Interaction event routes, likes and views sent by the apps
+"""
+import datetime
+import uuid
+
+from flask import jsonify, request, Response
+from webargs import fields, validate
+from webargs.flaskparser import parser
+
+from app.api import api_bp, interactions
+from app.api.error_handlers import ServerError
+from app.api.recommender import ITEM_KINDS
+
+event_args = {
+    # Set by the client to make its retries idempotent, generated otherwise.
+    "event_id": fields.UUID(),
+    "user_id": fields.Str(required=True, validate=validate.Length(min=1)),
+    "kind": fields.Str(required=True, validate=validate.OneOf(ITEM_KINDS)),
+    "int_id": fields.Int(required=True),
+    "event": fields.Str(required=True, validate=validate.OneOf(interactions.EVENT_TYPES)),
+    "occurred_at": fields.DateTime(),
+}
+
+batch_event_args = {
+    "events": fields.List(fields.Nested(event_args), required=True,
+                          validate=validate.Length(min=1)),
+}
+
+
+@api_bp.route('/interactions', methods=['POST'])
+def post_interactions() -> Response:
+    """Queue one event, or several with {"events": [...]}, to be stored in the background.
+    Accepted events are flushed when the process exits gracefully, they are lost if it is
+    killed or if PostgREST is down for longer than `shutdown_timeout` at exit.
+
+    Raises:
+        ServerError: If there are more events than allowed in one request,
+            or the queue is full.
+
+    Returns:
+        Response: Flask response with the number of accepted events.
+    """
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and "events" in body:
+        events = parser.parse(batch_event_args, location="json")["events"]
+    else:
+        events = [parser.parse(event_args, location="json")]
+
+    settings = interactions.get_settings()
+    if len(events) > settings["max_request_events"]:
+        raise ServerError(
+            400, hint=f"At most {settings['max_request_events']} events can be sent at once.")
+
+    received_at = datetime.datetime.now(datetime.timezone.utc)
+    rows = [create_row(event, received_at) for event in events]
+    if not interactions.interaction_queue.add(rows):
+        raise ServerError(503, hint="Too many events are waiting to be stored, retry later.")
+    response = jsonify({"accepted": len(rows)})
+    response.status_code = 202
+    return response
+
+
+def create_row(event: dict, received_at: datetime.datetime) -> dict:
+    """Create the row of an event in the `interactions` relation.
+
+    Args:
+        event (dict): Parsed event.
+        received_at (datetime.datetime): Time of the request, used when the event has none.
+
+    Returns:
+        dict: Row.
+    """
+    return {
+        "event_id": str(event.get("event_id") or uuid.uuid4()),
+        "user_id": event["user_id"],
+        "kind": event["kind"],
+        "int_id": event["int_id"],
+        "event": event["event"],
+        "occurred_at": (event.get("occurred_at") or received_at).isoformat(),
+    }
@@ -0,0 +1,54 @@
+"""Facet count routes, used by the filter dropdowns
+"""
+from flask import request, Response
+
+from app.api import api_bp, conditional, facet_index
+from app.api.error_handlers import ServerError
+
+
+@api_bp.route('/facets', methods=['GET'])
+def get_all_facets() -> Response:
+    """Counts of every facet, by facet name.
+
+    Returns:
+        Response: Flask response with the counts.
+    """
+    return create_facet_response(facet_index.facet_index.get())
+
+
+@api_bp.route('/facets/<name>', methods=['GET'])
+def get_facet(name: str) -> Response:
+    """Counts of the values of one facet, same rows as the `distinct_<name>` PostgREST views.
+
+    Args:
+        name (str): Facet name, as in the `facets` config.
+
+    Raises:
+        ServerError: If the facet does not exist.
+
+    Returns:
+        Response: Flask response with the counts.
+    """
+    counts = facet_index.facet_index.get(name)
+    if counts is None:
+        raise ServerError(404, hint=f"Unknown facet {name}.")
+    return create_facet_response(counts)
+
+
+def create_facet_response(counts: facet_index.FacetBody) -> Response:
+    """Create the response of encoded counts, or a 304 if the client already holds them.
+
+    Args:
+        counts (facet_index.FacetBody): Encoded counts.
+
+    Returns:
+        Response: Flask response.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Cache-Control": facet_index.cache_control(),
+        "ETag": counts.etag,
+    }
+    if conditional.is_not_modified(request.headers.get('If-None-Match', None), counts.etag):
+        return Response(status=304, headers=conditional.not_modified_headers(headers))
+    return Response(counts.body, 200, headers)
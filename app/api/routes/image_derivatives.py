@@ -0,0 +1,69 @@
+"""Image derivative routes, resized variants of the uploaded outfit images
+"""
+import concurrent.futures
+
+from flask import request, Response
+from webargs import fields, validate
+from webargs.flaskparser import use_kwargs
+
+from app.api import api_bp, conditional, images
+from app.api.error_handlers import ServerError
+from app.logger import logger
+
+image_args = {
+    "width": fields.Int(required=True),
+    "image_format": fields.Str(data_key="format",
+                               validate=validate.OneOf(list(images.FORMATS))),
+    "quality": fields.Int(validate=validate.Range(min=1, max=100)),
+}
+
+
+@api_bp.route('/images/<path:key>', methods=['GET'])
+@use_kwargs(image_args, location="querystring")  # Injects keyword arguments
+def get_image(key: str, width: int, image_format: str = None,
+              quality: int = None) -> Response:
+    """Image resized to a width and encoded in a format, the image is never enlarged.
+    Example: /images/look.jpg?width=320&format=webp&quality=75
+
+    Args:
+        key (str): File name the image was uploaded with.
+        width (int): Max width, one of the `widths` of the config.
+        image_format (str, optional): `format` query param, "jpeg", "webp" or "png".
+            Defaults to "jpeg".
+        quality (int, optional): Encoding quality. Defaults to `default_quality`.
+
+    Raises:
+        ServerError: If the parameters are not allowed, the image does not exist,
+            can not be read or can not be rendered.
+
+    Returns:
+        Response: Flask response with the image.
+    """
+    settings = images.get_settings()
+    if width not in settings["widths"]:
+        raise ServerError(400, hint=f"width must be one of {settings['widths']}.")
+    image_format = image_format or "jpeg"
+    quality = quality or settings["default_quality"]
+
+    try:
+        data, digest = images.derivatives.get(key, width, image_format, quality)
+    except KeyError as err:
+        raise ServerError(404, hint=f"Image {key} does not exist.") from err
+    except images.SourceError as err:
+        logger.error(str(err))
+        raise ServerError(502, hint=f"Image {key} could not be read, retry later.") from err
+    except ValueError as err:
+        raise ServerError(413, hint=str(err)) from err
+    except concurrent.futures.TimeoutError as err:
+        raise ServerError(503, hint="The image took too long to render.") from err
+    except OSError as err:
+        raise ServerError(422, hint=f"{key} is not an image that can be resized.") from err
+
+    headers = {
+        "Content-Type": images.FORMATS[image_format][1],
+        "Cache-Control": images.cache_control(),
+        "ETag": f'"{digest}"',
+    }
+    if conditional.is_not_modified(request.headers.get('If-None-Match', None), headers["ETag"]):
+        return Response(status=304, headers=conditional.not_modified_headers(headers))
+    return Response(data, 200, headers)
@@ -1,5 +1,6 @@
 """PostgREST proxy
 """
+import time
 import traceback
 from functools import partial
 from urllib.parse import urljoin
@@ -9,13 +10,20 @@ import toolz
 from flask import current_app, request, Response, after_this_request, make_response
 from werkzeug.datastructures import ImmutableMultiDict
 
-from app.api import api_bp, api_utils
+from app.api import (api_bp, api_utils, cache, catalog, compression, conditional, cursor,
+                     metrics, single_flight, timing, upstream)
 from app.logger import logger
-from app.api.error_handlers import ServerError, PostgrestHTTPException
+from app.api.error_handlers import PostgrestHTTPException, UpstreamError
 from app import utils
 
+# Routes that get default sorting and seek pagination
+ROUTES_TO_MODIFY_QUERY_PARAMS = ["products", "outfits", "outfit_thumbnails"]
 
-@api_bp.route('/api/<path:path>', methods=['GET'])
+# URL rule of the proxy, also the route of its admission control limits.
+PROXY_RULE = '/api/<path:path>'
+
+
+@api_bp.route(PROXY_RULE, methods=['GET'])
 def get_postgrest_proxy(path: str) -> Response:
     """Proxy for PostgREST that modifies various parts of the request,
     such as query params and headers.
@@ -52,54 +60,256 @@ def get_postgrest_proxy(path: str) -> Response:
 
     config = current_app.config['CONFIG']
     postgrest_host = config['postgrest_host']
-    postgrest_url = urljoin(postgrest_host, path)
+    # The route can be served by another relation, see the `catalog` config.
+    relation = catalog.get_relation(path)
+    postgrest_url = urljoin(postgrest_host, relation)
 
-    routes_to_modify_query_params = ["products", "outfits", "outfit_thumbnails"]
-    if path in routes_to_modify_query_params:
-        query_params = modify_query_params(request.args, postgrest_host)
+    if path in ROUTES_TO_MODIFY_QUERY_PARAMS:
+        with timing.span('modify_query_params'):
+            query_params = modify_query_params(request.args, postgrest_host, relation)
     else:
         query_params = request.args
 
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding', None))
+
+    cache_key = None
+    cache_ttl = cache.route_ttl(path)
+    if cache_ttl:
+        if 'Authorization' in request.headers:
+            # Responses can depend on the user, never share them.
+            cache.response_cache.record_bypass()
+        else:
+            with timing.span('cache'):
+                cache_key = cache.make_key(request.url_root, path, query_params,
+                                           request.headers, encoding)
+                cached_response = cache.response_cache.get(cache_key)
+            if cached_response is not None:
+                response = Response(cached_response.body,
+                                    cached_response.status,
+                                    cached_response.headers)
+                response.headers.update(cache.cache_headers(cached_response))
+                # The client can revalidate its copy without PostgREST being queried.
+                return create_conditional_response(response)
+
+    # Cached responses need the whole body, so they are never streamed.
+    streaming = cache_key is None and should_stream(config.get('streaming', {}), query_params)
+
+    # Identical queries in flight at the same time share one PostgREST response.
+    # Streamed bodies can only be read once, so they are never shared.
+    flight_key = None if streaming else single_flight.make_key(request.method, path,
+                                                               query_params, request.headers)
+
     # Send PostgREST the same request we received but with modified query params
+    with timing.span('upstream'):
+        if flight_key is None:
+            postgrest_resp = send_postgrest_request(postgrest_url, query_params,
+                                                    stream=streaming)
+            shared = False
+        else:
+            postgrest_resp, shared = single_flight.upstream_flights.do(
+                flight_key, partial(send_postgrest_request, postgrest_url, query_params))
+
+    postgrest_status_code = postgrest_resp.status_code
+    # Abort if we get an error code.
+    if postgrest_status_code >= 300:
+        raise PostgrestHTTPException(postgrest_resp)
+
+    if not streaming:
+        # Create new headers
+        with timing.span('headers'):
+            headers = api_utils.create_headers(postgrest_resp,
+                                               query_params,
+                                               postgrest_status_code)
+        with timing.span('etag'):
+            headers = conditional.add_etag(headers, postgrest_resp.content)
+        # Compressed once here, cached entries are stored compressed.
+        with timing.span('compress'):
+            headers, body = compression.encode_response(api_utils.flatten_headers(headers),
+                                                        postgrest_resp.content,
+                                                        encoding)
+
+        # Create response to send back to client
+        response = Response(body,
+                            postgrest_status_code,
+                            headers)
+
+        if cache_key is not None:
+            cached_response = cache.CachedResponse(status=postgrest_status_code,
+                                                   headers=list(response.headers.items()),
+                                                   body=body,
+                                                   stored_at=time.time(),
+                                                   ttl=cache_ttl)
+            # Only the request that actually queried PostgREST stores the response.
+            if not shared:
+                cache.response_cache.set(cache_key, cached_response)
+            response.headers.update(cache.cache_headers(cached_response))
+
+        return create_conditional_response(response)
+
+    # The body has not been read yet, so the last row comes from a companion query.
+    try:
+        with timing.span('headers'):
+            headers = api_utils.create_headers(postgrest_resp,
+                                               query_params,
+                                               postgrest_status_code,
+                                               partial(fetch_last_row, postgrest_url,
+                                                       query_params))
+    except Exception:
+        postgrest_resp.close()
+        raise
+
+    # Streamed bodies can not be hashed up front, only an ETag from PostgREST is honoured.
+    if conditional.is_not_modified(request.headers.get('If-None-Match', None),
+                                   conditional.get_header(headers, 'ETag')):
+        postgrest_resp.close()
+        return Response(status=304, headers=conditional.not_modified_headers(headers))
+
+    chunk_size = config['streaming'].get('chunk_size', 65536)
+    return Response(iter_upstream_body(postgrest_resp, chunk_size),
+                    postgrest_status_code,
+                    headers)
+
+
+def create_conditional_response(response: Response) -> Response:
+    """Replace the response with a 304 Not Modified if the client already holds it.
+
+    Args:
+        response (Response): Full response with an ETag.
+
+    Returns:
+        Response: Full response or 304 response.
+    """
+    if conditional.is_not_modified(request.headers.get('If-None-Match', None),
+                                   response.headers.get('ETag', None)):
+        return Response(status=304,
+                        headers=conditional.not_modified_headers(response.headers.items()))
+    return response
+
+
+def send_postgrest_request(postgrest_url: str, query_params: dict,
+                           stream: bool = False) -> requests.Response:
+    """Send PostgREST the request we received, with the given query params.
+
+    Args:
+        postgrest_url (str): PostgREST URL.
+        query_params (dict): Query params to send.
+        stream (bool, optional): Do not download the body right away. Defaults to False.
+
+    Raises:
+        UpstreamError: If PostgREST can not be reached or is too slow to respond.
+
+    Returns:
+        requests.Response: PostgREST response.
+    """
     try:
-        postgrest_resp = requests.request(
+        return upstream.request(
             method=request.method,
             url=postgrest_url,
-            headers={key: value for (key, value)
-                     in request.headers if key != 'Host'},
+            headers=upstream.forwardable_headers(request.headers),
             data=request.get_data(),
             cookies=request.cookies,
             allow_redirects=False,
-            params=query_params
+            params=query_params,
+            stream=stream
         )
+    except requests.exceptions.ReadTimeout as err:
+        logger.error(traceback.format_exc())
+        metrics.record_upstream_error("server_error", 504)
+        raise UpstreamError(504, hint="Postgrest took too long to respond.") from err
     except requests.exceptions.ConnectionError as err:
         logger.error(traceback.format_exc())
-        raise ServerError(503, hint="Could not connect to Postgrest.") from err
+        metrics.record_upstream_error("server_error", 503)
+        raise UpstreamError(503, hint="Could not connect to Postgrest.") from err
 
-    postgrest_status_code = postgrest_resp.status_code
-    # Abort if we get an error code.
-    if postgrest_status_code >= 300:
-        raise PostgrestHTTPException(postgrest_resp)
 
-    # Create new headers
-    headers = api_utils.create_headers(postgrest_resp,
-                                       query_params,
-                                       postgrest_status_code)
+def should_stream(streaming_config: dict, query_params: dict) -> bool:
+    """Check if the PostgREST response should be streamed to the client instead of buffered.
+    Only large (or unlimited) responses are streamed, small pages are cheaper to buffer.
 
-    # Create response to send back to client
-    response = Response(postgrest_resp.content,
-                        postgrest_status_code,
-                        headers)
+    Args:
+        streaming_config (dict): `streaming` section of the config.
+        query_params (dict): Query params sent to PostgREST.
 
-    return response
+    Returns:
+        bool: True if the response should be streamed.
+    """
+    if not streaming_config.get('enabled', False):
+        return False
+
+    try:
+        limit = int(query_params.get('limit', None))
+    except (TypeError, ValueError):
+        # No limit means the response can be as large as the table.
+        return True
+
+    return limit >= streaming_config.get('min_limit', 0)
+
+
+def create_last_row_params(query_params: dict) -> dict:
+    """Query params that select only the last row of the page described by the query params.
+
+    Args:
+        query_params (dict): Query params of the page.
+
+    Returns:
+        dict: Query params of the last row.
+    """
+    offset = int(query_params.get('offset', 0)) + int(query_params['limit']) - 1
+    # The sort columns are needed to create the next page cursor.
+    sort_columns = [cursor.parse_sort_term(term)[0] for term
+                    in api_utils.get_sort_columns(query_params.get('order', 'int_id'))]
+    select = ",".join(toolz.unique(['int_id'] + sort_columns))
+    return {**query_params, 'select': select, 'offset': offset, 'limit': 1}
+
+
+def fetch_last_row(postgrest_url: str, query_params: dict) -> dict:
+    """Ask PostgREST for only the last row of the page described by the query params.
+
+    Args:
+        postgrest_url (str): PostgREST URL.
+        query_params (dict): Query params of the page.
+
+    Raises:
+        PostgrestHTTPException: If PostgREST returns an error.
+
+    Returns:
+        dict: Last row of the page, None if the page is empty.
+    """
+    with timing.span('last_row'):
+        resp = send_postgrest_request(postgrest_url, create_last_row_params(query_params))
+    if resp.status_code >= 300:
+        raise PostgrestHTTPException(resp)
+
+    return api_utils.find_last_row(resp.content)
+
+
+def iter_upstream_body(resp: requests.Response, chunk_size: int):
+    """Forward the body of a streamed PostgREST response as it arrives.
+
+    Args:
+        resp (requests.Response): Streamed PostgREST response.
+        chunk_size (int): Max size of each chunk.
+
+    Yields:
+        bytes: Body chunks.
+    """
+    try:
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        # Give the connection back to the pool.
+        resp.close()
 
 
-def modify_query_params(request_query_params: ImmutableMultiDict, host_url: str) -> dict:
+def modify_query_params(request_query_params: ImmutableMultiDict, host_url: str,
+                        relation: str) -> dict:
     """Enhance the query params that the client provided to us.
 
     Args:
         request_query_params (ImmutableMultiDict): Flask query params.
         host_url (str): Host url that the proxy will be sending all requests too.
+        relation (str): PostgREST relation that is queried, pivot values are looked up in it.
 
     Returns:
         dict: Modified query params.
@@ -109,4 +319,7 @@ def modify_query_params(request_query_params: ImmutableMultiDict, host_url: str)
                       utils.replace_single_len_lists,
                       api_utils.add_default_sorting,
                       partial(api_utils.create_pivot_value_request_param,
-                              postgrest_host=host_url))
+                              postgrest_host=host_url,
+                              relation=relation),
+                      partial(api_utils.create_cursor_request_params,
+                              secret=current_app.secret_key))
@@ -0,0 +1,52 @@
+"""Recommendation routes, scored in process from the latest exported model
+"""
+from flask import jsonify, Response
+from webargs import fields, validate
+from webargs.flaskparser import use_kwargs
+
+from app.api import api_bp, recommender
+from app.api.error_handlers import ServerError
+
+recommendation_args = {
+    "user_id": fields.Str(required=True, validate=validate.Length(min=1)),
+    "limit": fields.Int(validate=validate.Range(min=1)),
+    # int_id of items the client does not want back, such as the ones just shown.
+    "exclude": fields.DelimitedList(fields.Int()),
+}
+
+
+@api_bp.route('/recommendations/<any(outfits, products):kind>', methods=['GET'])
+@use_kwargs(recommendation_args, location="querystring")  # Injects keyword arguments
+def get_recommendations(kind: str, user_id: str, limit: int = None,
+                        exclude: list = None) -> Response:
+    """Top `limit` outfits or products of a user, by decreasing score.
+    Fetch the rows with `/api/<kind>?int_id=in.(<ids>)`.
+
+    Args:
+        kind (str): `outfits` or `products`.
+        user_id (str): User id.
+        limit (int, optional): Number of items, capped to `max_limit`. Defaults to None.
+        exclude (list, optional): int_id of items to leave out. Defaults to None.
+
+    Raises:
+        ServerError: If no model is loaded, or it has no items of that kind.
+
+    Returns:
+        Response: Flask response with the ids.
+    """
+    settings = recommender.get_settings()
+    model = recommender.model_store.get()
+    if model is None:
+        raise ServerError(503, hint="No recommendation model is loaded.")
+    if kind not in model.items:
+        raise ServerError(404, hint=f"The recommendation model has no {kind}.")
+
+    limit = min(limit or settings["default_limit"], settings["max_limit"])
+    recommendation = model.recommend(user_id, kind, limit, exclude)
+    return jsonify({
+        "model": model.version,
+        "user_id": user_id,
+        "personalized": recommendation.personalized,
+        "ids": recommendation.ids,
+        "scores": recommendation.scores,
+    })
@@ -0,0 +1,56 @@
+"""Request ids, added to every log record and sent back in the X-Request-ID header.
+"""
+import uuid
+
+from flask import Response, g, request
+
+from app.api import api_bp
+from app.logger import request_id_var
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+def get_request_id(headers) -> str:
+    """Id of a request, the one set by a load balancer or the client if there is one.
+
+    Args:
+        headers (Mapping): Incoming request headers.
+
+    Returns:
+        str: Request id.
+    """
+    request_id = headers.get(REQUEST_ID_HEADER, None)
+    # Ids are logged, do not trust arbitrary long values.
+    if request_id and len(request_id) <= 128:
+        return request_id
+    return uuid.uuid4().hex
+
+
+@api_bp.before_request
+def set_request_id() -> None:
+    """Set the id of the request before any other handler logs something."""
+    g.request_id = get_request_id(request.headers)
+    g.request_id_token = request_id_var.set(g.request_id)
+
+
+@api_bp.after_request
+def add_request_id_header(response: Response) -> Response:
+    """Send the request id back so clients can quote it.
+
+    Args:
+        response (Response): Outgoing flask response.
+
+    Returns:
+        Response: Response with the X-Request-ID header.
+    """
+    if "request_id" in g:
+        response.headers.setdefault(REQUEST_ID_HEADER, g.request_id)
+    return response
+
+
+@api_bp.teardown_request
+def reset_request_id(_err=None) -> None:
+    """Records logged after the request must not carry its id."""
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        request_id_var.reset(token)
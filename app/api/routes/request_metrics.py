@@ -0,0 +1,68 @@
+"""Prometheus metrics of every request in this Blueprint, see `app.api.metrics`.
+"""
+import time
+
+from flask import Response, g, request
+
+from app.api import api_bp, cache, metrics
+from app.api.routes.proxy import ROUTES_TO_MODIFY_QUERY_PARAMS
+
+PROXY_ENDPOINT = "api.get_postgrest_proxy"
+
+
+@api_bp.before_request
+def start_request_metrics() -> None:
+    """Remember when the request started."""
+    g.request_started_at = time.perf_counter()
+
+
+@api_bp.after_request
+def record_request_metrics(response: Response) -> Response:
+    """Count the request, its latency and the size of its response.
+    This is registered before the other `after_request` handlers, so it runs after them
+    and sees the final response.
+
+    Args:
+        response (Response): Outgoing flask response.
+
+    Returns:
+        Response: Response, unchanged.
+    """
+    started_at = g.pop("request_started_at", None)
+    if started_at is not None:
+        metrics.record_request(get_route_label(),
+                               request.method,
+                               response.status_code,
+                               time.perf_counter() - started_at,
+                               # Measuring a streamed body would read all of it.
+                               None if response.is_streamed
+                               else response.calculate_content_length())
+    return response
+
+
+def get_route_label() -> str:
+    """Route of the request, kept to a small set of values.
+
+    Returns:
+        str: PostgREST route for proxied requests, the URL rule otherwise.
+    """
+    if request.url_rule is None:
+        return "unmatched"
+    if request.endpoint == PROXY_ENDPOINT:
+        return get_proxy_route_label(request.view_args["path"])
+    return request.url_rule.rule
+
+
+def get_proxy_route_label(path: str) -> str:
+    """Route of a proxied request. Any path can be requested, whatever the status code,
+    so only the routes the API knows are kept, the others are all `other`.
+
+    Args:
+        path (str): URL path that corresponds to a PostgREST route.
+
+    Returns:
+        str: PostgREST route, or `other`.
+    """
+    if path in ROUTES_TO_MODIFY_QUERY_PARAMS or path in cache.get_settings()["route_ttls"]:
+        return path
+    return "other"
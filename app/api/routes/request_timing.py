@@ -0,0 +1,30 @@
+"""Timing of every request in this Blueprint, see `app.api.timing`.
+"""
+from flask import Response, g, request
+
+from app.api import api_bp, timing
+
+
+@api_bp.before_request
+def start_request_timing() -> None:
+    """Start timing the request, the view adds its own spans."""
+    g.request_timings = timing.start()
+
+
+@api_bp.after_request
+def add_server_timing_header(response: Response) -> Response:
+    """Record the spans of the request and add the Server-Timing header.
+    This is registered before the other `after_request` handlers, so it runs after them
+    and their work is part of the total.
+
+    Args:
+        response (Response): Outgoing flask response.
+
+    Returns:
+        Response: Response with the Server-Timing header, if it is enabled.
+    """
+    response.headers.extend(timing.finish(g.pop("request_timings", None),
+                                          request.method,
+                                          request.path,
+                                          response.status_code))
+    return response
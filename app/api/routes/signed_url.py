@@ -1,10 +1,11 @@
 """signed url route
 """
-import boto3
+from flask import jsonify, Response
 from webargs.flaskparser import use_kwargs
-from webargs import fields
+from webargs import fields, validate
 
-from app.api import api_bp
+from app.api import api_bp, s3
+from app.api.error_handlers import ServerError
 
 # https://github.com/PostgREST/postgrest/issues/171
 # https://devcenter.heroku.com/articles/s3-upload-python
@@ -21,6 +22,11 @@ file_args = {
     "mime_type": fields.Str(required=True),
 }
 
+batch_file_args = {
+    "files": fields.List(fields.Nested(file_args), required=True,
+                         validate=validate.Length(min=1)),
+}
+
 
 @api_bp.route('/create_signed_s3_url', methods=['GET'])
 @use_kwargs(file_args, location="querystring")  # Injects keyword arguments
@@ -34,27 +40,30 @@ def create_signed_s3_url(file_name: str, mime_type: str):
         file_name (str): Name of file.
         mime_type (str): Mime type of file.
     """
-    s3_bucket = "justlooks-images"
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/credentials.html#shared-credentials-file
-    session = boto3.Session(profile_name="direct-upload-s3")
-    s3_client = session.client("s3")
-
-    presigned_post = s3_client.generate_presigned_post(
-        Bucket=s3_bucket,
-        Key=f"outfits/{file_name}",
-        Fields={
-            "acl": "public-read",
-            "Content-Type": mime_type
-        },
-        # These are the conditions that the client using this URL must meet.
-        # https://docs.aws.amazon.com/AmazonS3/latest/API/sigv4-HTTPPOSTConstructPolicy.html
-        Conditions=[
-            {"acl": "public-read"},
-            {"Content-Type": mime_type}
-        ],
-        ExpiresIn=3600
-    )
     # GOOD EXAMPLE OF AWS PERMISSIONS
     # https://docs.aws.amazon.com/AmazonS3/latest/dev/example-walkthroughs-managing-access-example1.html
     # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-presigned-urls.html#generating-a-presigned-url-to-upload-a-file
-    return presigned_post
+    return s3.create_presigned_post(file_name, mime_type)
+
+
+@api_bp.route('/create_signed_s3_urls', methods=['POST'])
+@use_kwargs(batch_file_args, location="json")  # Injects keyword arguments
+def create_signed_s3_urls(files: list) -> Response:
+    """Create pre-signed s3 urls for a set of files, such as all the images of an outfit.
+    Body: {"files": [{"file_name": "a.jpg", "mime_type": "image/jpeg"}, ...]}
+
+    Args:
+        files (list): Name and mime type of every file.
+
+    Raises:
+        ServerError: If there are more files than allowed in one batch.
+
+    Returns:
+        Response: Flask response with the presigned POSTs, in the order of the files.
+    """
+    max_batch_files = s3.get_settings()["max_batch_files"]
+    if len(files) > max_batch_files:
+        raise ServerError(400, hint=f"At most {max_batch_files} files can be signed at once.")
+
+    return jsonify([s3.create_presigned_post(file["file_name"], file["mime_type"])
+                    for file in files])
@@ -0,0 +1,58 @@
+"""Similar items routes, "more like this" of the product and outfit pages
+"""
+from flask import jsonify, Response
+from webargs import fields, validate
+from webargs.flaskparser import use_kwargs
+
+from app.api import api_bp, recommender, similarity
+from app.api.error_handlers import ServerError
+
+similar_args = {
+    "limit": fields.Int(validate=validate.Range(min=1)),
+    # Partitions scanned, more is a better recall for a higher latency.
+    "n_probe": fields.Int(validate=validate.Range(min=1)),
+}
+
+
+@api_bp.route('/similar/<any(outfits, products):kind>/<int:int_id>', methods=['GET'])
+@use_kwargs(similar_args, location="querystring")  # Injects keyword arguments
+def get_similar(kind: str, int_id: int, limit: int = None, n_probe: int = None) -> Response:
+    """Items most similar to an item, by decreasing cosine similarity of their
+    recommendation model embeddings. Fetch the rows with `/api/<kind>?int_id=in.(<ids>)`.
+
+    Args:
+        kind (str): `outfits` or `products`.
+        int_id (int): int_id of the item.
+        limit (int, optional): Number of items, capped to `max_limit`. Defaults to None.
+        n_probe (int, optional): Number of partitions scanned, capped to `max_n_probe`.
+            Defaults to None.
+
+    Raises:
+        ServerError: If no model is loaded, its index is not built yet,
+            or the item is not in the model.
+
+    Returns:
+        Response: Flask response with the ids.
+    """
+    settings = similarity.get_settings()
+    model = recommender.model_store.get()
+    if model is None:
+        raise ServerError(503, hint="No recommendation model is loaded.")
+    if kind not in model.items:
+        raise ServerError(404, hint=f"The recommendation model has no {kind}.")
+    index = similarity.similarity_indexes.get(model, kind)
+    if index is None:
+        raise ServerError(503, hint=f"The similarity index of the {kind} is being built.")
+
+    limit = min(limit or settings["default_limit"], settings["max_limit"])
+    n_probe = min(n_probe or settings["n_probe"], settings["max_n_probe"])
+    neighbours = index.search(int_id, limit, n_probe)
+    if neighbours is None:
+        raise ServerError(404, hint=f"Item {int_id} is not in the recommendation model.")
+    return jsonify({
+        "model": model.version,
+        "int_id": int_id,
+        "n_probe": min(n_probe, index.n_lists),
+        "ids": neighbours.ids,
+        "scores": neighbours.scores,
+    })
@@ -0,0 +1,97 @@
+"""Operational statistics routes
+"""
+from flask import jsonify, Response
+
+from app.api import (admission, api_bp, cache, facet_index, images, interactions, metrics,
+                     recommender, similarity, single_flight, timing, upstream)
+from app.logger import get_queue_stats, logger
+
+
+@api_bp.route('/stats/upstream', methods=['GET'])
+def get_upstream_stats() -> Response:
+    """Connection pool and request coalescing statistics of the upstream PostgREST client.
+    NOTE: Statistics are per process, each worker reports its own pools.
+
+    Returns:
+        Response: Flask response with the pool statistics.
+    """
+    return jsonify({
+        **upstream.pool_stats(),
+        "single_flight": single_flight.upstream_flights.stats(),
+    })
+
+
+@api_bp.route('/stats/cache', methods=['GET'])
+def get_cache_stats() -> Response:
+    """Hit/miss statistics of the PostgREST response and pivot value caches,
+    age of the facet counts, loaded recommendation model, similarity indexes and
+    image derivative cache.
+    NOTE: Statistics are per process, each worker reports its own hits and misses.
+
+    Returns:
+        Response: Flask response with the cache statistics.
+    """
+    return jsonify({
+        "catalog_version": cache.catalog_version.current(),
+        "responses": cache.response_cache.stats(),
+        "pivot_values": cache.pivot_value_cache.stats(),
+        "facets": facet_index.facet_index.stats(),
+        "recommendation_model": recommender.model_store.stats(),
+        "similarity_indexes": similarity.similarity_indexes.stats(),
+        "image_derivatives": images.derivatives.cache.stats(),
+    })
+
+
+@api_bp.route('/stats/timing', methods=['GET'])
+def get_timing_stats() -> Response:
+    """Latency histograms of every stage of the proxy pipeline, in milliseconds.
+    NOTE: Statistics are per process, each worker reports its own histograms.
+
+    Returns:
+        Response: Flask response with the histograms.
+    """
+    return jsonify(timing.stats())
+
+
+@api_bp.route('/stats/interactions', methods=['GET'])
+def get_interaction_stats() -> Response:
+    """Interaction event queue statistics, including the events refused because it was full.
+    NOTE: Statistics are per process, each worker reports its own queue.
+
+    Returns:
+        Response: Flask response with the queue statistics.
+    """
+    return jsonify(interactions.interaction_queue.stats())
+
+
+@api_bp.route('/stats/admission', methods=['GET'])
+def get_admission_stats() -> Response:
+    """Slots in use and waiting requests of every route, and refused requests.
+    NOTE: Statistics are per process, each worker admits its own requests.
+
+    Returns:
+        Response: Flask response with the admission statistics.
+    """
+    return jsonify(admission.controller.stats())
+
+
+@api_bp.route('/stats/logging', methods=['GET'])
+def get_logging_stats() -> Response:
+    """Log queue statistics, including the records dropped because the queue was full.
+    NOTE: Statistics are per process, each worker reports its own queue.
+
+    Returns:
+        Response: Flask response with the log queue statistics.
+    """
+    return jsonify(get_queue_stats(logger))
+
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics() -> Response:
+    """Prometheus metrics, aggregated over every worker when `PROMETHEUS_MULTIPROC_DIR` is set.
+
+    Returns:
+        Response: Flask response with the metrics in the Prometheus text format.
+    """
+    body, content_type = metrics.export()
+    return Response(body, 200, {"Content-Type": content_type})
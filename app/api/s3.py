@@ -0,0 +1,130 @@
+"""S3 client used to presign uploads.
+
+Building a boto3 session reads the credentials file and building a client loads the
+botocore service model, so a single client is kept per process and shared by every
+request (boto3 clients are thread safe, sessions are not). The client is rebuilt after
+`client_ttl` seconds so rotated credentials are picked up.
+"""
+import threading
+import time
+
+import boto3
+
+DEFAULT_SETTINGS = {
+    "bucket": "justlooks-images",
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/credentials.html#shared-credentials-file
+    "profile_name": "direct-upload-s3",
+    # Explicit credentials take precedence over the profile, mainly for tests.
+    "aws_access_key_id": None,
+    "aws_secret_access_key": None,
+    "region_name": None,
+    # Local S3 stand-in, such as MinIO or moto_server.
+    "endpoint_url": None,
+    "key_prefix": "outfits/",
+    "expires_in": 3600,
+    # Seconds before the client is rebuilt with fresh credentials.
+    "client_ttl": 3000,
+    # Max number of files presigned in one batch request.
+    "max_batch_files": 20,
+}
+
+
+class PresignClient:
+    """Lazily built, process wide S3 client."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._client = None
+        self._created_at = 0.0
+
+    def get(self):
+        """Get the client, building it if it does not exist or is too old.
+
+        Returns:
+            botocore.client.S3: S3 client.
+        """
+        if not self._is_stale():
+            return self._client
+
+        with self._lock:
+            # Another thread may have rebuilt it while this one was waiting.
+            if self._is_stale():
+                self._client = self._create_client()
+                self._created_at = time.monotonic()
+            return self._client
+
+    def _is_stale(self) -> bool:
+        """Check if the client must be (re)built."""
+        return self._client is None or \
+            time.monotonic() - self._created_at >= self.settings["client_ttl"]
+
+    def _create_client(self):
+        """Build a new session and client from the settings.
+
+        Returns:
+            botocore.client.S3: S3 client.
+        """
+        session_kwargs = {"region_name": self.settings["region_name"]}
+        if self.settings["aws_access_key_id"] is not None:
+            session_kwargs["aws_access_key_id"] = self.settings["aws_access_key_id"]
+            session_kwargs["aws_secret_access_key"] = self.settings["aws_secret_access_key"]
+        else:
+            session_kwargs["profile_name"] = self.settings["profile_name"]
+
+        session = boto3.Session(**session_kwargs)
+        return session.client("s3", endpoint_url=self.settings["endpoint_url"])
+
+
+_settings = dict(DEFAULT_SETTINGS)
+presign_client = PresignClient(_settings)
+
+
+def configure(settings: dict) -> None:
+    """Set the S3 settings, usually from the `s3` key of the config.
+    The client is rebuilt on next use.
+
+    Args:
+        settings (dict): S3 settings, missing keys fall back to the defaults.
+    """
+    global presign_client  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    presign_client = PresignClient(_settings)
+
+
+def get_settings() -> dict:
+    """Current S3 settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def create_presigned_post(file_name: str, mime_type: str) -> dict:
+    """Create a presigned POST that lets the client upload a file directly to S3.
+    The object is public-read, and the client must send the same ACL and Content-Type.
+
+    Args:
+        file_name (str): Name of file.
+        mime_type (str): Mime type of file.
+
+    Returns:
+        dict: URL and form fields of the presigned POST.
+    """
+    return presign_client.get().generate_presigned_post(
+        Bucket=_settings["bucket"],
+        Key=f"{_settings['key_prefix']}{file_name}",
+        Fields={
+            "acl": "public-read",
+            "Content-Type": mime_type
+        },
+        # These are the conditions that the client using this URL must meet.
+        # https://docs.aws.amazon.com/AmazonS3/latest/API/sigv4-HTTPPOSTConstructPolicy.html
+        Conditions=[
+            {"acl": "public-read"},
+            {"Content-Type": mime_type}
+        ],
+        ExpiresIn=_settings["expires_in"]
+    )
@@ -0,0 +1,353 @@
+"""Approximate nearest neighbours of the items of the recommendation model.
+
+"More like this" is a cosine similarity search over the item embeddings of the current
+recommendation model (see recommender.py). Scanning every item on each request does not
+scale with the catalog, so the items are partitioned with k-means into an inverted file
+(IVF) index and a search only scans the `n_probe` partitions whose centroids are the
+closest to the query. More probes give a better recall for a higher latency, probing
+every partition is an exact search.
+
+An index is built by a background thread the first time a model is queried, then persisted
+as .npy files next to the model so other workers and restarts memory-map it instead of
+building it again.
+
+Layout of an index directory, `<model>/<kind>_ivf`:
+    centroids.npy       (lists, dim) float32, normalized.
+    offsets.npy         (lists + 1,) start of every list in `vectors` and `ids`.
+    vectors.npy         (items, dim) float32, normalized embeddings grouped by list.
+    ids.npy             (items,) int_id of every row of `vectors`.
+    lookup_ids.npy      Sorted int_ids.
+    lookup_rows.npy     Row in `vectors` of every int_id of `lookup_ids`.
+"""
+import os
+import random
+import shutil
+import threading
+import time
+import traceback
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.api import recommender
+from app.logger import logger
+
+DEFAULT_SETTINGS = {
+    # Number of k-means partitions, 0 for about sqrt(items).
+    "n_lists": 0,
+    # Partitions scanned per search when the client does not ask for a number.
+    "n_probe": 8,
+    "max_n_probe": 64,
+    # Items sampled to train the k-means centroids, and number of iterations.
+    "train_size": 50000,
+    "n_iter": 10,
+    # Seconds before a failed build is tried again.
+    "retry_interval": 60,
+    # Directory of the indexes, None to write them in the model directories.
+    "index_dir": None,
+    "default_limit": 20,
+    "max_limit": 100,
+}
+
+INDEX_FILES = ("centroids", "offsets", "vectors", "ids", "lookup_ids", "lookup_rows")
+# Rows per block when assigning items to centroids, bounds the (rows, lists) score matrix.
+ASSIGN_BLOCK_SIZE = 65536
+
+
+class Neighbours(NamedTuple):
+    """Most similar items of a query item."""
+    ids: List[int]
+    scores: List[float]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to a unit norm, so dot products are cosine similarities.
+
+    Args:
+        vectors (np.ndarray): (rows, dim) vectors.
+
+    Returns:
+        np.ndarray: float32 normalized vectors, zero rows stay zero.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Closest centroid of every vector.
+
+    Args:
+        vectors (np.ndarray): Normalized vectors.
+        centroids (np.ndarray): Normalized centroids.
+
+    Returns:
+        np.ndarray: Centroid index of every vector.
+    """
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors: np.ndarray, n_lists: int, n_iter: int, train_size: int,
+                    seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of a sample of the vectors.
+
+    Args:
+        vectors (np.ndarray): Normalized vectors.
+        n_lists (int): Number of centroids.
+        n_iter (int): Number of iterations.
+        train_size (int): Max number of sampled vectors.
+        seed (int, optional): Seed of the sample. Defaults to 0.
+
+    Returns:
+        np.ndarray: (n_lists, dim) normalized centroids.
+    """
+    rand = random.Random(seed)
+    sample = vectors[np.sort(rand.sample(range(len(vectors)), min(train_size, len(vectors))))]
+    centroids = sample[np.sort(rand.sample(range(len(sample)), n_lists))]
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.stack([np.bincount(labels, weights=sample[:, col], minlength=n_lists)
+                         for col in range(sample.shape[1])], axis=1).astype(np.float32)
+        # Empty partitions keep their centroid.
+        sums[counts == 0] = centroids[counts == 0]
+        centroids = normalize(sums)
+    return centroids
+
+
+def build_index(path: str, ids: np.ndarray, embeddings: np.ndarray, settings: dict) -> None:
+    """Build an index and write it to a directory. The files are written to a temporary
+    directory first and renamed, so readers never see a partial index.
+
+    Args:
+        path (str): Index directory.
+        ids (np.ndarray): int_id of every item.
+        embeddings (np.ndarray): (items, dim) embeddings.
+        settings (dict): Similarity settings.
+    """
+    vectors = normalize(embeddings)
+    n_lists = settings["n_lists"] or int(np.sqrt(len(vectors)))
+    n_lists = max(1, min(n_lists, len(vectors)))
+    centroids = train_centroids(vectors, n_lists, settings["n_iter"], settings["train_size"])
+    labels = assign(vectors, centroids)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists))))
+    ids = np.asarray(ids, dtype=np.int64)[order]
+    lookup_rows = np.argsort(ids, kind="stable")
+
+    arrays = {
+        "centroids": centroids,
+        "offsets": offsets.astype(np.int64),
+        "vectors": vectors[order],
+        "ids": ids,
+        "lookup_ids": ids[lookup_rows],
+        "lookup_rows": lookup_rows.astype(np.int64),
+    }
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another worker published the same index first.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+class IVFIndex:
+    """Memory-mapped inverted file index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                  for name in INDEX_FILES}
+        self.centroids = arrays["centroids"]
+        # Small and read for every list, kept in memory.
+        self.offsets = np.array(arrays["offsets"])
+        self.vectors = arrays["vectors"]
+        self.ids = arrays["ids"]
+        self.lookup_ids = arrays["lookup_ids"]
+        self.lookup_rows = arrays["lookup_rows"]
+
+    @property
+    def n_lists(self) -> int:
+        """Number of partitions."""
+        return len(self.centroids)
+
+    def get_row(self, int_id: int) -> Optional[int]:
+        """Row of an item in `vectors`.
+
+        Args:
+            int_id (int): Item int_id.
+
+        Returns:
+            Optional[int]: Row, None if the item is not in the index.
+        """
+        index = int(np.searchsorted(self.lookup_ids, int_id))
+        if index == len(self.lookup_ids) or self.lookup_ids[index] != int_id:
+            return None
+        return int(self.lookup_rows[index])
+
+    def search(self, int_id: int, limit: int, n_probe: int) -> Optional[Neighbours]:
+        """Most similar items of an item, itself excluded.
+
+        Args:
+            int_id (int): Item int_id.
+            limit (int): Number of items.
+            n_probe (int): Number of partitions scanned, capped to the number of partitions.
+
+        Returns:
+            Optional[Neighbours]: Items sorted by decreasing similarity,
+                None if the item is not in the index.
+        """
+        row = self.get_row(int_id)
+        if row is None:
+            return None
+        query = np.array(self.vectors[row])
+
+        probes = recommender.top_k(self.centroids @ query, min(n_probe, self.n_lists))
+        rows = np.concatenate([np.arange(self.offsets[probe], self.offsets[probe + 1])
+                               for probe in probes])
+        # Partitions are contiguous, the scan reads whole blocks of the mmapped vectors.
+        scores = np.concatenate([
+            self.vectors[self.offsets[probe]:self.offsets[probe + 1]] @ query
+            for probe in probes
+        ])
+        scores[rows == row] = -np.inf
+
+        top = recommender.top_k(scores, limit)
+        top = top[np.isfinite(scores[top])]
+        return Neighbours(ids=self.ids[rows[top]].tolist(), scores=scores[top].tolist())
+
+
+class SimilarityIndexes:
+    """Indexes of the current recommendation model, built in the background."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._indexes: Dict[Tuple[str, str], IVFIndex] = {}
+        self._building: Dict[Tuple[str, str], threading.Thread] = {}
+        self._failed_at: Dict[Tuple[str, str], float] = {}
+        self._stats = {"builds": 0, "build_errors": 0, "last_build_seconds": None}
+
+    def get_path(self, model: recommender.RecommendationModel, kind: str) -> str:
+        """Directory of the index of a model and item kind.
+
+        Args:
+            model (recommender.RecommendationModel): Model.
+            kind (str): Item kind.
+
+        Returns:
+            str: Path.
+        """
+        if self.settings["index_dir"] is None:
+            return os.path.join(model.path, f"{kind}_ivf")
+        return os.path.join(self.settings["index_dir"], model.version, f"{kind}_ivf")
+
+    def get(self, model: recommender.RecommendationModel, kind: str) -> Optional[IVFIndex]:
+        """Get the index of a model, loading it from disk or starting its build.
+
+        Args:
+            model (recommender.RecommendationModel): Model.
+            kind (str): Item kind, must be in `model.items`.
+
+        Returns:
+            Optional[IVFIndex]: Index, None while it is being built or if its build failed.
+        """
+        key = (model.version, kind)
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+
+        with self._lock:
+            if key in self._indexes:
+                return self._indexes[key]
+            path = self.get_path(model, kind)
+            if os.path.isdir(path):
+                index = IVFIndex(path)
+                # Only the indexes of the current model are kept.
+                self._indexes = {k: v for k, v in self._indexes.items() if k[0] == model.version}
+                self._indexes[key] = index
+                return index
+            failed_at = self._failed_at.get(key)
+            if failed_at is not None and (time.monotonic() - failed_at
+                                          < self.settings["retry_interval"]):
+                return None
+            if key not in self._building:
+                thread = threading.Thread(target=self._build, args=(key, path, model.items[kind]),
+                                          name=f"similarity-{kind}", daemon=True)
+                self._building[key] = thread
+                thread.start()
+        return None
+
+    def _build(self, key: Tuple[str, str], path: str,
+               items: recommender.ItemEmbeddings) -> None:
+        """Build and persist an index, run by the background thread."""
+        started_at = time.perf_counter()
+        build_seconds = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            build_index(path, items.ids, items.embeddings, self.settings)
+            build_seconds = round(time.perf_counter() - started_at, 3)
+            logger.info(f"[Similarity] Built {path} in {build_seconds}s")
+        except Exception:  # pylint: disable=broad-except
+            logger.error(traceback.format_exc())
+        finally:
+            # Read by `get` and `stats` under the lock.
+            with self._lock:
+                if build_seconds is None:
+                    self._stats["build_errors"] += 1
+                    self._failed_at[key] = time.monotonic()
+                else:
+                    self._stats["builds"] += 1
+                    self._stats["last_build_seconds"] = build_seconds
+                self._building.pop(key, None)
+
+    def stats(self) -> dict:
+        """Loaded indexes and build counters.
+
+        Returns:
+            dict: Statistics.
+        """
+        # Build threads update these when they finish, read a snapshot.
+        with self._lock:
+            build_stats = dict(self._stats)
+            building = list(self._building)
+            indexes = dict(self._indexes)
+        return {
+            **build_stats,
+            "building": [f"{version}/{kind}" for version, kind in building],
+            "loaded": {f"{version}/{kind}": {"items": len(index.ids), "lists": index.n_lists}
+                       for (version, kind), index in indexes.items()},
+        }
+
+
+_settings = dict(DEFAULT_SETTINGS)
+similarity_indexes = SimilarityIndexes(_settings)
+
+
+def configure(settings: dict) -> None:
+    """Set the similarity settings, usually from the `similarity` key of the config.
+
+    Args:
+        settings (dict): Similarity settings, missing keys fall back to the defaults.
+    """
+    global similarity_indexes  # pylint: disable=global-statement
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    similarity_indexes = SimilarityIndexes(dict(_settings))
+
+
+def get_settings() -> dict:
+    """Current similarity settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
@@ -0,0 +1,163 @@
+"""Request coalescing for identical concurrent PostgREST queries.
+
+While a query is in flight, identical queries wait for it and share its response
+instead of being sent to PostgREST again.
+"""
+import asyncio
+import threading
+from typing import Callable, Optional
+from urllib.parse import urlencode
+
+from app.api import cache
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Request headers that change the PostgREST response.
+    "vary_headers": ["Accept", "Prefer", "Range", "Authorization", "Cookie"],
+}
+
+
+class _Call:
+    """A call in flight and the result its waiters will get."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical calls made from different threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            "leaders": 0,
+            "followers": 0,
+        }
+
+    def do(self, key: str, func: Callable) -> tuple:
+        """Call `func`, unless a call with the same key is in flight, then wait for its result.
+
+        Args:
+            key (str): Key of the call.
+            func (Callable): Function to call.
+
+        Raises:
+            Exception: Whatever `func` raised, followers get the same exception.
+
+        Returns:
+            tuple: Result, and True if it was shared by another call.
+        """
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            self._stats["leaders" if leader else "followers"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        """Number of calls made (leaders) and coalesced (followers), counted per process.
+
+        Returns:
+            dict: Statistics.
+        """
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight(SingleFlight):
+    """Coalesces identical calls made from different asyncio tasks."""
+
+    async def do_async(self, key: str, func: Callable) -> tuple:
+        """Await `func()`, unless a call with the same key is in flight, then wait for its result.
+
+        Args:
+            key (str): Key of the call.
+            func (Callable): Coroutine function to call.
+
+        Raises:
+            Exception: Whatever `func` raised, followers get the same exception.
+
+        Returns:
+            tuple: Result, and True if it was shared by another call.
+        """
+        future = self._calls.get(key, None)
+        if future is not None:
+            self._stats["followers"] += 1
+            return await asyncio.shield(future), True
+
+        self._stats["leaders"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except Exception as err:
+            future.set_exception(err)
+            # Followers may not exist, do not warn about an exception nobody retrieved.
+            future.exception()
+            raise
+        except BaseException:
+            # The leader was cancelled, so are its followers.
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._calls)}
+
+
+_settings = dict(DEFAULT_SETTINGS)
+upstream_flights = SingleFlight()
+
+
+def configure(settings: dict) -> None:
+    """Set the coalescing settings, usually from the `single_flight` key of the config.
+
+    Args:
+        settings (dict): Coalescing settings, missing keys fall back to the defaults.
+    """
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+
+
+def make_key(method: str, path: str, query_params, request_headers) -> Optional[str]:
+    """Create the key of an upstream query.
+
+    Args:
+        method (str): HTTP method.
+        path (str): PostgREST route.
+        query_params (Union[dict, MultiDict]): Query params sent to PostgREST.
+        request_headers (Mapping): Incoming request headers.
+
+    Returns:
+        Optional[str]: Key, None if coalescing is disabled.
+    """
+    if not _settings["enabled"]:
+        return None
+
+    vary = [(name.lower(), request_headers.get(name, "")) for name in _settings["vary_headers"]]
+    return f"{method} {path}?{urlencode(cache.normalize_params(query_params))}#{urlencode(vary)}"
@@ -0,0 +1,229 @@
+"""Per-request timing of the proxy pipeline.
+
+Stages of a request are measured with `span`, the durations are sent back in a
+Server-Timing header, logged for slow requests and added to in-process histograms.
+When timing is disabled `span` returns a shared no-op context manager, so the
+instrumentation costs a context variable lookup per stage.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from app.logger import logger
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    # Send the spans to the client in a Server-Timing header.
+    "server_timing_header": False,
+    # Log the spans of requests slower than this, None to never log them.
+    "log_slower_than_ms": None,
+    # Upper bounds of the histogram buckets.
+    "buckets_ms": [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+}
+
+
+class RequestTimings:
+    """Spans measured during a request."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, duration: float) -> None:
+        """Add a span.
+
+        Args:
+            name (str): Span name.
+            duration (float): Duration in seconds.
+        """
+        self.spans.append((name, duration))
+
+    def elapsed(self) -> float:
+        """Seconds since the request started."""
+        return time.perf_counter() - self.started_at
+
+
+class _Span:
+    """Measures the code in a `with` block."""
+    __slots__ = ("timings", "name", "started_at")
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self.timings = timings
+        self.name = name
+        self.started_at = 0.0
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.started_at)
+        return False
+
+
+class _NoopSpan:
+    """Used instead of `_Span` when timing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Histogram:
+    """Fixed bucket histogram of durations in milliseconds."""
+
+    def __init__(self, buckets_ms: List[float]):
+        self.buckets_ms = sorted(buckets_ms)
+        # The last bucket counts everything above the largest bound.
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> None:
+        """Add a duration.
+
+        Args:
+            value_ms (float): Duration in milliseconds.
+        """
+        index = bisect.bisect_left(self.buckets_ms, value_ms)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value_ms
+
+    def snapshot(self) -> dict:
+        """Cumulative bucket counts, sum and count.
+
+        Returns:
+            dict: Histogram.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, buckets = 0, {}
+        for bound, count in zip([*self.buckets_ms, "+Inf"], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "buckets": buckets,
+            "count": cumulative,
+            "sum_ms": round(total, 3),
+        }
+
+
+_settings = dict(DEFAULT_SETTINGS)
+_current = contextvars.ContextVar("request_timings", default=None)
+_NOOP_SPAN = _NoopSpan()
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def configure(settings: dict) -> None:
+    """Set the timing settings, usually from the `timing` key of the config.
+
+    Args:
+        settings (dict): Timing settings, missing keys fall back to the defaults.
+    """
+    _settings.clear()
+    _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def start() -> Optional[RequestTimings]:
+    """Start timing the current request.
+
+    Returns:
+        Optional[RequestTimings]: Timings of the request, None if timing is disabled.
+    """
+    if not _settings["enabled"]:
+        return None
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def span(name: str):
+    """Measure a stage of the current request.
+
+    Usage:
+        with timing.span("upstream"):
+            resp = upstream.request(...)
+
+    Args:
+        name (str): Span name, must be a valid Server-Timing metric name.
+
+    Returns:
+        ContextManager: Context manager measuring the `with` block.
+    """
+    timings = _current.get()
+    if timings is None:
+        return _NOOP_SPAN
+    return _Span(timings, name)
+
+
+def get_histogram(name: str) -> Histogram:
+    """Get the histogram of a span, creating it if needed.
+
+    Args:
+        name (str): Span name.
+
+    Returns:
+        Histogram: Histogram.
+    """
+    histogram = _histograms.get(name, None)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram(_settings["buckets_ms"]))
+    return histogram
+
+
+def finish(timings: Optional[RequestTimings], method: str, path: str, status: int) -> dict:
+    """Stop timing the current request, record its spans and create its headers.
+
+    Args:
+        timings (Optional[RequestTimings]): Timings returned by `start`.
+        method (str): HTTP method.
+        path (str): Request path.
+        status (int): Response status code.
+
+    Returns:
+        dict: Server-Timing header, empty if it is disabled.
+    """
+    _current.set(None)
+    if timings is None:
+        return {}
+
+    spans = [*timings.spans, ("total", timings.elapsed())]
+    for name, duration in spans:
+        get_histogram(name).observe(duration * 1000)
+
+    threshold = _settings["log_slower_than_ms"]
+    total_ms = spans[-1][1] * 1000
+    if threshold is not None and total_ms >= threshold:
+        fields = {name: round(duration * 1000, 3) for name, duration in spans}
+        logger.info(f"[Timing] {method} {path} {status} in {total_ms:.1f}ms",
+                    extra={"timings": fields, "method": method, "path": path,
+                           "status": status})
+
+    if not _settings["server_timing_header"]:
+        return {}
+    return {
+        "Server-Timing": ", ".join(f"{name};dur={duration * 1000:.2f}"
+                                   for name, duration in spans)
+    }
+
+
+def stats() -> dict:
+    """Histograms of every span, counted per process.
+
+    Returns:
+        dict: Histograms by span name.
+    """
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    return {name: histogram.snapshot() for name, histogram in sorted(histograms.items())}
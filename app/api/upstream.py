@@ -0,0 +1,252 @@
+"""Shared HTTP client used for every request sent to PostgREST.
+
+A single `requests.Session` is kept per process so connections to PostgREST are
+pooled and kept alive instead of being opened for every proxied call.
+The session is rebuilt after a fork so gunicorn workers never share sockets.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.api import metrics
+from app.logger import logger
+
+DEFAULT_SETTINGS = {
+    # Number of distinct hosts to keep a pool for.
+    "pool_connections": 4,
+    # Max number of connections kept alive per host.
+    "pool_maxsize": 32,
+    # Block instead of opening a throwaway connection when the pool is exhausted.
+    "pool_block": False,
+    "keep_alive": True,
+    "connect_timeout": 3.05,
+    "read_timeout": 30,
+    # Retries only apply to idempotent methods.
+    "max_retries": 2,
+    "backoff_factor": 0.1,
+    "retry_statuses": [502, 503, 504],
+}
+
+# Headers that only make sense for a single hop and must not be forwarded.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+# Conditional requests are answered by the proxy, PostgREST must always send the full body.
+CONDITIONAL_HEADERS = {
+    "if-none-match",
+    "if-modified-since",
+}
+
+# The proxy compresses responses itself, the upstream client negotiates what it can decode.
+NEGOTIATED_HEADERS = {
+    "accept-encoding",
+}
+
+_lock = threading.Lock()
+_settings = dict(DEFAULT_SETTINGS)
+_state = {
+    "pid": None,
+    "session": None,
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "requests": 0,
+    "errors": 0,
+}
+
+
+def configure(settings: dict) -> None:
+    """Set the upstream client settings, usually from the `upstream` key of the config.
+    Any existing session is dropped so the next request picks up the new settings.
+
+    Args:
+        settings (dict): Upstream client settings, missing keys fall back to the defaults.
+    """
+    with _lock:
+        _settings.clear()
+        _settings.update({**DEFAULT_SETTINGS, **(settings or {})})
+        _drop_session()
+
+
+def get_settings() -> dict:
+    """Current upstream client settings.
+
+    Returns:
+        dict: Settings.
+    """
+    return dict(_settings)
+
+
+def _create_retry(settings: dict) -> Retry:
+    """Create the retry policy for the connection pool.
+
+    Args:
+        settings (dict): Upstream client settings.
+
+    Returns:
+        Retry: urllib3 retry policy.
+    """
+    retry_kwargs = {
+        "total": settings["max_retries"],
+        "backoff_factor": settings["backoff_factor"],
+        "status_forcelist": settings["retry_statuses"],
+        "raise_on_status": False,
+    }
+    idempotent_methods = frozenset(["GET", "HEAD", "OPTIONS"])
+    try:
+        return Retry(allowed_methods=idempotent_methods, **retry_kwargs)
+    except TypeError:
+        # urllib3 < 1.26 calls it `method_whitelist`
+        return Retry(method_whitelist=idempotent_methods, **retry_kwargs)
+
+
+def _create_session(settings: dict) -> requests.Session:
+    """Create a new session with a pooled adapter mounted for http and https.
+
+    Args:
+        settings (dict): Upstream client settings.
+
+    Returns:
+        requests.Session: Session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=settings["pool_connections"],
+                          pool_maxsize=settings["pool_maxsize"],
+                          pool_block=settings["pool_block"],
+                          max_retries=_create_retry(settings))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not settings["keep_alive"]:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def _drop_session() -> None:
+    """Forget the current session. Must be called while holding `_lock`.
+    The counters are kept, requests sent with the old session still decrement `in_flight`
+    when they finish."""
+    session = _state["session"]
+    # Only close sockets that belong to this process.
+    if session is not None and _state["pid"] == os.getpid():
+        session.close()
+    _state.update(pid=None, session=None)
+
+
+def get_session() -> requests.Session:
+    """Get the session for the current process, creating it if needed.
+
+    Returns:
+        requests.Session: Shared session.
+    """
+    pid = os.getpid()
+    session = _state["session"]
+    if session is not None and _state["pid"] == pid:
+        return session
+
+    with _lock:
+        if _state["session"] is None or _state["pid"] != pid:
+            _drop_session()
+            logger.debug(f"Creating upstream session for process {pid}.")
+            _state.update(pid=pid, session=_create_session(_settings))
+            metrics.UPSTREAM_POOL_SIZE.set(_settings["pool_maxsize"])
+        return _state["session"]
+
+
+def _reset_after_fork() -> None:
+    """Make sure a forked worker does not reuse the sockets of its parent."""
+    global _lock  # pylint: disable=global-statement
+    _lock = threading.Lock()
+    _state.update(pid=None, session=None, in_flight=0, max_in_flight=0, requests=0, errors=0)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def forwardable_headers(headers) -> dict:
+    """Remove hop-by-hop, conditional and negotiated headers from the incoming request headers.
+
+    Args:
+        headers (Iterable): Incoming (key, value) header pairs.
+
+    Returns:
+        dict: Headers that can be sent upstream.
+    """
+    excluded_headers = HOP_BY_HOP_HEADERS | CONDITIONAL_HEADERS | NEGOTIATED_HEADERS
+    return {key: value for (key, value) in headers if key.lower() not in excluded_headers}
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request through the shared session.
+    Connect and read timeouts from the settings are applied unless a `timeout` is passed.
+
+    Args:
+        method (str): HTTP method.
+        url (str): URL.
+        **kwargs: Any other arguments accepted by `requests.Session.request`.
+
+    Returns:
+        requests.Response: Response.
+    """
+    kwargs.setdefault("timeout", (_settings["connect_timeout"], _settings["read_timeout"]))
+    session = get_session()
+
+    with _lock:
+        _state["in_flight"] += 1
+        _state["requests"] += 1
+        _state["max_in_flight"] = max(_state["max_in_flight"], _state["in_flight"])
+    metrics.UPSTREAM_IN_FLIGHT.inc()
+    try:
+        return session.request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        with _lock:
+            _state["errors"] += 1
+        raise
+    finally:
+        with _lock:
+            _state["in_flight"] -= 1
+        metrics.UPSTREAM_IN_FLIGHT.dec()
+
+
+def pool_stats() -> dict:
+    """Statistics about the connection pools of the current process.
+
+    Returns:
+        dict: Pool statistics.
+    """
+    session = _state["session"]
+    pools = []
+    if session is not None and _state["pid"] == os.getpid():
+        adapter = session.get_adapter("http://")
+        pool_container = adapter.poolmanager.pools
+        for key in list(pool_container.keys()):
+            pool = pool_container.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": pool.host,
+                "port": pool.port,
+                "connections_created": pool.num_connections,
+                "requests": pool.num_requests,
+            })
+
+    return {
+        "pid": os.getpid(),
+        "pool_maxsize": _settings["pool_maxsize"],
+        "in_flight": _state["in_flight"],
+        "max_in_flight": _state["max_in_flight"],
+        "requests": _state["requests"],
+        "errors": _state["errors"],
+        "pools": pools,
+    }
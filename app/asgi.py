@@ -0,0 +1,539 @@
+"""Asyncio (ASGI) serving mode.
+
+The PostgREST proxy routes are served by an asyncio handler that talks to PostgREST
+with a non-blocking pooled client, so a single process can hold thousands of in-flight
+requests. Every other route is handed to the Flask app, which runs in a thread pool.
+
+How to run:
+    uvicorn --factory main:main_asgi
+"""
+import asyncio
+import json
+import time
+import traceback
+from functools import partial
+from typing import Optional
+from urllib.parse import parse_qsl, urljoin
+
+import httpx
+import toolz
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask
+from werkzeug.datastructures import Headers, MultiDict
+
+from app import utils
+from app.api import (admission, api_utils, cache, catalog, compression, conditional, metrics,
+                     single_flight, timing, upstream)
+from app.api.cache_backends import MemoryBackend
+from app.api.error_handlers import (PostgrestHTTPException, RejectedError, ServerError,
+                                    UpstreamError)
+from app.api.routes import admission_control
+from app.api.routes.proxy import (PROXY_RULE, ROUTES_TO_MODIFY_QUERY_PARAMS,
+                                  create_last_row_params, should_stream)
+from app.api.routes.request_id import REQUEST_ID_HEADER, get_request_id
+from app.api.routes.request_metrics import get_proxy_route_label
+from app.logger import logger, request_id_var
+
+API_PREFIX = "/api/"
+
+DEFAULT_SETTINGS = {
+    # Max number of concurrent connections to PostgREST.
+    "max_connections": 1000,
+    # Max number of idle connections kept alive.
+    "max_keepalive_connections": 100,
+}
+
+
+class AsyncProxy:
+    """ASGI application serving the PostgREST proxy with asyncio."""
+
+    def __init__(self, flask_app: Flask):
+        self.flask_app = flask_app
+        self.config = flask_app.config['CONFIG']
+        self.settings = {**DEFAULT_SETTINGS, **self.config.get('asgi', {})}
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.client = None
+        self.flights = single_flight.AsyncSingleFlight()
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        path = scope.get("path", "")
+        if (scope["type"] == "http" and scope["method"] == "GET"
+                and path.startswith(API_PREFIX) and len(path) > len(API_PREFIX)):
+            await self.handle_proxy(scope, send)
+            return
+
+        # Everything else, including 404s and 405s, behaves exactly like the Flask app.
+        await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send) -> None:
+        """Open the PostgREST client on startup and close it on shutdown."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.get_client()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.client is not None:
+                    await self.client.aclose()
+                    self.client = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Get the pooled PostgREST client, creating it if needed.
+        Timeouts and retries come from the `upstream` config, like the Flask proxy.
+
+        Returns:
+            httpx.AsyncClient: Client.
+        """
+        if self.client is None:
+            upstream_settings = upstream.get_settings()
+            limits = httpx.Limits(
+                max_connections=self.settings["max_connections"],
+                max_keepalive_connections=self.settings["max_keepalive_connections"])
+            # httpx only retries failed connections, which is safe for any method.
+            transport = httpx.AsyncHTTPTransport(limits=limits,
+                                                 retries=upstream_settings["max_retries"])
+            timeout = httpx.Timeout(upstream_settings["read_timeout"],
+                                    connect=upstream_settings["connect_timeout"])
+            self.client = httpx.AsyncClient(transport=transport, timeout=timeout)
+            metrics.UPSTREAM_POOL_SIZE.set(self.settings["max_connections"])
+        return self.client
+
+    async def handle_proxy(self, scope: dict, send) -> None:
+        """Proxy a request to PostgREST and send the response, or the error, to the client.
+
+        Args:
+            scope (dict): ASGI connection scope.
+            send (Callable): ASGI send callable.
+        """
+        timings = timing.start()
+        started_at = time.perf_counter()
+        path = scope["path"][len(API_PREFIX):]
+        request_headers = Headers([(key.decode("latin-1"), val.decode("latin-1"))
+                                   for key, val in scope["headers"]])
+        request_id = get_request_id(request_headers)
+        # Each request runs in its own task, so the id does not leak into other requests.
+        request_id_var.set(request_id)
+        query_string = scope["query_string"].decode("latin-1")
+        args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+
+        host = request_headers.get("Host", None)
+        if host is None:
+            server_host, server_port = scope.get("server") or ("localhost", 80)
+            host = f"{server_host}:{server_port}"
+        url_root = f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}/"
+        request_url = f"{url_root[:-1]}{scope['path']}" + \
+            (f"?{query_string}" if query_string else "")
+        link_context = api_utils.LinkContext(
+            request_url,
+            utils.replace_single_len_lists(args.to_dict(flat=False)),
+            self.flask_app.secret_key)
+
+        limiter = None
+        try:
+            limiter = await self.admit(scope, request_headers)
+            status, headers, body = await self.proxy(path, args, request_headers, link_context,
+                                                     url_root)
+        except RejectedError as err:
+            status, headers, body = create_error_response(err)
+        except PostgrestHTTPException as err:
+            status = err.response.status_code
+            metrics.record_upstream_error("postgrest_http", status)
+            headers = api_utils.create_headers(err.response, {}, status)
+            body = json.dumps(err.error_body)
+        except ServerError as err:
+            status, headers, body = create_error_response(err)
+        except Exception:  # pylint: disable=broad-except
+            # Answered like the errors above, with the CORS and request id headers.
+            logger.error(traceback.format_exc())
+            status, headers, body = create_error_response(ServerError(500))
+
+        try:
+            headers = api_utils.flatten_headers(headers)
+            if conditional.is_not_modified(request_headers.get("If-None-Match", None),
+                                           conditional.get_header(headers, "ETag")):
+                if not isinstance(body, (bytes, str)):
+                    await body.aclose()
+                status, headers, body = 304, conditional.not_modified_headers(headers), b""
+
+            headers.extend(timing.finish(timings, "GET", scope["path"], status).items())
+            headers.append((REQUEST_ID_HEADER, request_id))
+            metrics.record_request(get_proxy_route_label(path), "GET", status,
+                                   time.perf_counter() - started_at,
+                                   len(body) if isinstance(body, (bytes, str)) else None)
+            await send_response(send, status, add_cors_headers(headers), body)
+        finally:
+            # A streamed body holds its PostgREST connection until it is sent.
+            if limiter is not None:
+                limiter.release()
+
+    async def admit(self, scope: dict, request_headers: Headers) \
+            -> Optional[admission.RouteLimiter]:
+        """Asyncio version of `admission_control.admit_request`, the proxy is limited
+        like the `/api/<path:path>` route of the Flask app.
+        Requests that have to wait for a slot wait in a thread, not on the event loop.
+
+        Args:
+            scope (dict): ASGI connection scope.
+            request_headers (Headers): Headers sent by the client.
+
+        Raises:
+            RejectedError: 429 if the client is over its rate, 503 if the route is saturated.
+
+        Returns:
+            Optional[admission.RouteLimiter]: Limiter whose slot was taken, it must be
+                released. None if the request is not limited.
+        """
+        controller = admission.controller
+        if controller.is_exempt(scope["path"]):
+            return None
+
+        remote_addr = (scope.get("client") or (None,))[0]
+        admission_control.take_tokens(controller, PROXY_RULE, admission.get_client_keys(
+            request_headers, remote_addr, controller.settings))
+        limiter = controller.get_limiter(PROXY_RULE)
+        if limiter.try_acquire():
+            return limiter
+
+        waiting = asyncio.ensure_future(asyncio.to_thread(admission_control.acquire_slot,
+                                                          controller, PROXY_RULE, limiter))
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            def release_if_admitted(done: asyncio.Future) -> None:
+                if done.exception() is None:
+                    limiter.release()
+            # The client is gone, the slot the thread may still get is given back.
+            waiting.add_done_callback(release_if_admitted)
+            raise
+        return limiter
+
+    async def proxy(self, path: str, args: MultiDict, request_headers: Headers,
+                    link_context: api_utils.LinkContext, url_root: str) -> tuple:
+        """Asyncio version of `get_postgrest_proxy`.
+
+        Args:
+            path (str): URL path that corresponds to a PostgREST route.
+            args (MultiDict): Query params sent by the client.
+            request_headers (Headers): Headers sent by the client.
+            link_context (api_utils.LinkContext): Incoming request the links are created for.
+            url_root (str): Root URL the request was sent to, see `cache.make_key`.
+
+        Returns:
+            tuple: Status code, headers and body (bytes or an async iterator of bytes).
+        """
+        postgrest_host = self.config['postgrest_host']
+        relation = catalog.get_relation(path)
+        postgrest_url = urljoin(postgrest_host, relation)
+
+        if path in ROUTES_TO_MODIFY_QUERY_PARAMS:
+            with timing.span("modify_query_params"):
+                query_params = await self.modify_query_params(args, postgrest_host, relation)
+        else:
+            query_params = args.to_dict(flat=False)
+
+        encoding = compression.negotiate(request_headers.get("Accept-Encoding", None))
+
+        cache_key = None
+        cache_ttl = cache.route_ttl(path)
+        if cache_ttl:
+            if 'Authorization' in request_headers:
+                cache.response_cache.record_bypass()
+            else:
+                with timing.span("cache"):
+                    cache_key = cache.make_key(url_root, path, query_params, request_headers,
+                                               encoding)
+                    cached_response = await call_cache(cache.response_cache, "get", cache_key)
+                if cached_response is not None:
+                    headers = [*cached_response.headers,
+                               *cache.cache_headers(cached_response).items()]
+                    return cached_response.status, headers, cached_response.body
+
+        streaming = cache_key is None and should_stream(self.config.get('streaming', {}),
+                                                        query_params)
+        forward_headers = upstream.forwardable_headers(request_headers.items())
+        send_postgrest_request = partial(self.send_upstream, "GET", postgrest_url,
+                                         params=query_params,
+                                         headers=forward_headers,
+                                         stream=streaming)
+
+        flight_key = None if streaming else single_flight.make_key("GET", path, query_params,
+                                                                   request_headers)
+        with timing.span("upstream"):
+            if flight_key is None:
+                postgrest_resp = await send_postgrest_request()
+                shared = False
+            else:
+                postgrest_resp, shared = await self.flights.do_async(flight_key,
+                                                                     send_postgrest_request)
+
+        status = postgrest_resp.status_code
+        if status >= 300:
+            await postgrest_resp.aread()
+            raise PostgrestHTTPException(postgrest_resp)
+
+        if not streaming:
+            with timing.span("headers"):
+                headers = api_utils.create_headers(postgrest_resp, query_params, status,
+                                                   link_context=link_context)
+            with timing.span("etag"):
+                headers = conditional.add_etag(headers, postgrest_resp.content)
+            with timing.span("compress"):
+                headers, body = compression.encode_response(
+                    api_utils.flatten_headers(headers), postgrest_resp.content, encoding)
+            if cache_key is not None:
+                cached_response = cache.CachedResponse(status=status,
+                                                       headers=headers,
+                                                       body=body,
+                                                       stored_at=time.time(),
+                                                       ttl=cache_ttl)
+                # Only the request that actually queried PostgREST stores the response.
+                if not shared:
+                    await call_cache(cache.response_cache, "set", cache_key, cached_response)
+                headers = [*headers, *cache.cache_headers(cached_response).items()]
+            return status, headers, body
+
+        try:
+            last_row = None
+            content_range_header = postgrest_resp.headers.get("Content-Range", "")
+            if api_utils.is_full_page(query_params, content_range_header):
+                with timing.span("last_row"):
+                    last_row = await self.fetch_last_row(postgrest_url, query_params,
+                                                         forward_headers)
+            with timing.span("headers"):
+                headers = api_utils.create_headers(postgrest_resp, query_params, status,
+                                                   get_last_row=lambda: last_row,
+                                                   link_context=link_context)
+        except Exception:
+            await postgrest_resp.aclose()
+            raise
+
+        chunk_size = self.config['streaming'].get('chunk_size', 65536)
+        return status, headers, iter_upstream_body(postgrest_resp, chunk_size)
+
+    async def modify_query_params(self, args: MultiDict, postgrest_host: str,
+                                  relation: str) -> dict:
+        """Asyncio version of `modify_query_params`.
+
+        Args:
+            args (MultiDict): Query params sent by the client.
+            postgrest_host (str): URL to PostgREST.
+            relation (str): PostgREST relation that is queried.
+
+        Returns:
+            dict: Modified query params.
+        """
+        request_params = toolz.pipe(args.to_dict(flat=False),
+                                    utils.replace_single_len_lists,
+                                    api_utils.add_default_sorting)
+        request_params = await self.create_pivot_value_request_param(request_params,
+                                                                      postgrest_host,
+                                                                      relation)
+        return api_utils.create_cursor_request_params(request_params,
+                                                      self.flask_app.secret_key)
+
+    async def create_pivot_value_request_param(self, request_params: dict,
+                                               postgrest_host: str, relation: str) -> dict:
+        """Asyncio version of `api_utils.create_pivot_value_request_param`.
+
+        Args:
+            request_params (dict): Original request params.
+            postgrest_host (str): URL to PostgREST.
+            relation (str): PostgREST relation the page is queried from.
+
+        Returns:
+            dict: Request params with pivot value added.
+        """
+        pivot_lookup = api_utils.get_pivot_lookup(request_params)
+        if pivot_lookup is None:
+            return request_params
+
+        pivot_values = {}
+        for col in pivot_lookup.sort_cols:
+            pivot_values[col] = await call_cache(cache.pivot_value_cache, "get", relation,
+                                                 pivot_lookup.int_id, col)
+        missing_cols = [col for col, value in pivot_values.items() if value is None]
+        if missing_cols:
+            metrics.PIVOT_RPCS.inc()
+            with timing.span("pivot"):
+                resp = await self.send_upstream(
+                    "POST", urljoin(postgrest_host, "rpc/pivot_values"),
+                    json=api_utils.create_pivot_values_payload(relation, pivot_lookup,
+                                                               missing_cols))
+            if resp.status_code >= 300:
+                raise PostgrestHTTPException(resp)
+
+            looked_up_values = api_utils.read_pivot_values(resp.json(), missing_cols)
+            if looked_up_values is None:
+                return api_utils.apply_pivot_values(request_params, pivot_lookup, None)
+            for col, pivot_value in looked_up_values.items():
+                await call_cache(cache.pivot_value_cache, "set", relation, pivot_lookup.int_id,
+                                 col, pivot_value)
+            pivot_values.update(looked_up_values)
+
+        return api_utils.apply_pivot_values(request_params, pivot_lookup, pivot_values)
+
+    async def fetch_last_row(self, postgrest_url: str, query_params: dict,
+                             forward_headers: dict) -> Optional[dict]:
+        """Asyncio version of `fetch_last_row`.
+
+        Args:
+            postgrest_url (str): PostgREST URL.
+            query_params (dict): Query params of the page.
+            forward_headers (dict): Headers sent to PostgREST.
+
+        Returns:
+            Optional[dict]: Last row of the page, None if the page is empty.
+        """
+        resp = await self.send_upstream("GET", postgrest_url,
+                                        params=create_last_row_params(query_params),
+                                        headers=forward_headers)
+        if resp.status_code >= 300:
+            raise PostgrestHTTPException(resp)
+        return api_utils.find_last_row(resp.content)
+
+    async def send_upstream(self, method: str, url: str, stream: bool = False,
+                            **kwargs) -> httpx.Response:
+        """Send a request to PostgREST.
+
+        Args:
+            method (str): HTTP method.
+            url (str): URL.
+            stream (bool, optional): Do not download the body right away. Defaults to False.
+            **kwargs: Any other arguments accepted by `httpx.AsyncClient.build_request`.
+
+        Raises:
+            UpstreamError: If PostgREST can not be reached or is too slow to respond.
+
+        Returns:
+            httpx.Response: Response.
+        """
+        client = self.get_client()
+        metrics.UPSTREAM_IN_FLIGHT.inc()
+        try:
+            return await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.ReadTimeout as err:
+            logger.error(traceback.format_exc())
+            metrics.record_upstream_error("server_error", 504)
+            raise UpstreamError(504, hint="Postgrest took too long to respond.") from err
+        except httpx.TransportError as err:
+            logger.error(traceback.format_exc())
+            metrics.record_upstream_error("server_error", 503)
+            raise UpstreamError(503, hint="Could not connect to Postgrest.") from err
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec()
+
+
+async def call_cache(cache_object, method: str, *args):
+    """Call a method of a cache without blocking the event loop.
+    The memory backend is called right away, the redis and mmap backends do network I/O
+    or wait on file locks, so they are called from a thread.
+
+    Args:
+        cache_object (Union[cache.ResponseCache, cache.PivotValueCache]): Cache.
+        method (str): Name of the method, `get` or `set`.
+        *args: Arguments of the method.
+
+    Returns:
+        Any: What the method returns.
+    """
+    func = getattr(cache_object, method)
+    if isinstance(cache_object.backend, MemoryBackend):
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+def create_error_response(err: ServerError) -> tuple:
+    """Same response as the ServerError and RejectedError handlers of the Flask app.
+
+    Args:
+        err (ServerError): Error.
+
+    Returns:
+        tuple: Status code, headers and body.
+    """
+    if isinstance(err, RejectedError):
+        return err.code, {"Content-Type": "application/json",
+                          "Retry-After": str(err.retry_after)}, json.dumps(err.error_body)
+    if err.code >= 500 and not isinstance(err, UpstreamError):
+        metrics.record_server_error(err.code)
+    return err.code, {"Content-Type": "application/json"}, json.dumps(err.error_body)
+
+
+def add_cors_headers(headers) -> list:
+    """Same CORS headers as the `after_request` handlers of the Flask app.
+
+    Args:
+        headers (Union[dict, list]): Response headers.
+
+    Returns:
+        list: Header pairs with CORS headers added.
+    """
+    pairs = api_utils.flatten_headers(headers)
+    names = [name.lower() for name, _ in pairs]
+    if "access-control-allow-origin" not in names:
+        pairs.append(("Access-Control-Allow-Origin", "*"))
+
+    aceh_vals = [val.lower() for name, val in pairs
+                 if name.lower() == "access-control-expose-headers"]
+    if "link" not in aceh_vals and len(aceh_vals) > 0:
+        pairs.append(("Access-Control-Expose-Headers", "Link"))
+    return pairs
+
+
+async def iter_upstream_body(resp: httpx.Response, chunk_size: int):
+    """Forward the body of a streamed PostgREST response as it arrives.
+
+    Args:
+        resp (httpx.Response): Streamed PostgREST response.
+        chunk_size (int): Max size of each chunk.
+
+    Yields:
+        bytes: Body chunks.
+    """
+    try:
+        async for chunk in resp.aiter_bytes(chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        # Give the connection back to the pool.
+        await resp.aclose()
+
+
+async def send_response(send, status: int, headers: list, body) -> None:
+    """Send a response through ASGI.
+
+    Args:
+        send (Callable): ASGI send callable.
+        status (int): Status code.
+        headers (list): Header pairs.
+        body (Union[bytes, AsyncIterator[bytes]]): Body.
+    """
+    if isinstance(body, (bytes, str)):
+        body = body.encode() if isinstance(body, str) else body
+        headers = [(name, val) for name, val in headers if name.lower() != "content-length"]
+        # A 304 has no body, its Content-Length would be the one of the full response.
+        if status != 304:
+            headers.append(("Content-Length", str(len(body))))
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.encode("latin-1"), val.encode("latin-1")) for name, val in headers],
+    })
+
+    if isinstance(body, bytes):
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    try:
+        async for chunk in body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        await body.aclose()
+    await send({"type": "http.response.body", "body": b""})
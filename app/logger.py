@@ -1,19 +1,30 @@
 #!/usr/bin/env ipython
 __version__ = "0.0.1"
 
+import atexit
+import contextvars
+import copy
+import json
 import logging as lg
 import logging.handlers as handlers
+import queue
+import random
+import threading
 from os import path, makedirs
-from subprocess import getoutput
 from toolz import memoize
 
+# Id of the request being handled, added to every record logged while handling it.
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has, anything else was passed with `extra=`.
+RECORD_ATTRIBUTES = set(vars(lg.LogRecord("", 0, "", 0, "", None, None))) | {"message"}
+
 
 @memoize
 def get_project_dir():
-    """Python makes it difficult to yeld our project root... not sure how this
-    will work as a python site package; it won't work in service fabric where
-    git might not be on the path. For testing only."""
-    return path.abspath(getoutput("git rev-parse --show-toplevel"))
+    """Project root, this file lives in <root>/app/logger.py. Used to be found with
+    `git rev-parse`, which spawned a subprocess at startup and needed git on the path."""
+    return path.dirname(path.dirname(path.abspath(__file__)))
 
 
 def __create_logger(log_level=lg.DEBUG):
@@ -65,3 +76,128 @@ def set_logger_file(a_lg, log_file_dir, log_level=lg.DEBUG):
 
     # Pretty sure I don't have to return it, changes are applied directly
     #return a_lg
+
+
+class RequestIdFilter(lg.Filter):
+    """Adds the id of the current request to the records as `request_id`."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(lg.Filter):
+    """Keeps a fraction of the DEBUG records, every other level is always kept."""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno > lg.DEBUG or self.sample_rate >= 1.0:
+            return True
+        if random.random() < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(handlers.QueueHandler):
+    """QueueHandler that never blocks, records are dropped and counted when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Only merge the message and its arguments, formatting is done by the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = lg.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class JsonFormatter(lg.Formatter):
+    """Formats records as one JSON object per line, fields passed with `extra=` are kept."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        entry.update({key: val for key, val in vars(record).items()
+                      if key not in RECORD_ATTRIBUTES and key not in entry})
+        return json.dumps(entry, default=str)
+
+
+def enable_queue_logging(a_lg, queue_size=10000, json_format=True, debug_sample_rate=1.0):
+    """Moves the handlers of the logger behind a bounded queue, so logging never blocks the
+    caller on console or file I/O (or a midnight rollover). A background thread writes the
+    records. When the queue is full records are dropped and counted instead of waiting.
+    Calling it again returns the listener that is already running."""
+
+    for handler in a_lg.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return handler.listener
+
+    log_handlers = list(a_lg.handlers)
+    for handler in log_handlers:
+        a_lg.removeHandler(handler)
+        if json_format:
+            handler.setFormatter(JsonFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    # Filters run in the thread that logs, where the request id is known.
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+    queue_handler.listener = handlers.QueueListener(queue_handler.queue, *log_handlers,
+                                                    respect_handler_level=True)
+    a_lg.addHandler(queue_handler)
+    queue_handler.listener.start()
+    # Write whatever is still queued when the process exits.
+    atexit.register(stop_queue_logging, queue_handler.listener)
+    return queue_handler.listener
+
+
+def stop_queue_logging(listener):
+    """Writes the queued records and stops the listener thread, if it is still running."""
+
+    # pylint: disable=protected-access
+    if listener._thread is not None:
+        listener.stop()
+
+
+def get_queue_stats(a_lg):
+    """Size of the log queue and number of records dropped or sampled out, per process.
+    Empty if queue logging is not enabled."""
+
+    for handler in a_lg.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            sampling = [log_filter for log_filter in handler.filters
+                        if isinstance(log_filter, DebugSamplingFilter)]
+            return {
+                "queued": handler.queue.qsize(),
+                "queue_size": handler.queue.maxsize,
+                "dropped": handler.dropped,
+                "debug_sampled_out": sum(log_filter.sampled_out for log_filter in sampling),
+            }
+    return {}
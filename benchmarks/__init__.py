@@ -0,0 +1,2 @@
+"""Benchmarks of the API, see README.md.
+"""
@@ -0,0 +1,296 @@
+"""Seek pagination benchmark of the catalog relations, views vs materialized.
+
+Loads a synthetic catalog of the requested sizes into a scratch schema of a real
+Postgres database, creates the aggregating views of sql/postgREST.sql and the indexed
+materialized relations of sql/catalog_materialized.sql on top of it, and times the
+queries PostgREST runs for seek pages of each. The fake PostgREST of the proxy benchmark
+can not be used here, what is measured is the query plan.
+
+How to run (drops and recreates the `catalog_bench` schema):
+    python -m benchmarks.catalog_benchmark --dsn postgresql://postgres@localhost/postgres \
+        --sizes 100000 1000000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import time
+from typing import Dict
+
+import psycopg2
+
+from benchmarks.proxy_benchmark import percentile
+
+SCHEMA = "catalog_bench"
+
+CREATE_TABLES = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+
+CREATE TABLE {schema}.products AS
+SELECT
+    'product-' || n AS product_id,
+    n AS int_id,
+    'Product ' || n AS name,
+    (ARRAY['black', 'blue', 'brown', 'green', 'grey', 'red', 'white'])[1 + n %% 7] AS base_color,
+    round((5 + random() * 495)::numeric, 2) AS price
+FROM generate_series(1, %(products)s) n;
+
+CREATE TABLE {schema}.product_images AS
+SELECT product_id, position, 'https://images.example.com/' || int_id || '-' || position AS url
+FROM {schema}.products, generate_series(1, 2) AS g(position);
+
+CREATE TABLE {schema}.product_variants AS
+SELECT product_id, size
+FROM {schema}.products, unnest(ARRAY['S', 'M']) AS v(size);
+
+CREATE TABLE {schema}.outfits AS
+SELECT
+    'outfit-' || n AS outfit_id,
+    n AS int_id,
+    (ARRAY['fall', 'spring', 'summer', 'winter'])[1 + n %% 4] AS season,
+    (ARRAY['ana', 'bo', 'chris', 'dee'])[1 + n %% 4] AS stylist
+FROM generate_series(1, %(outfits)s) n;
+
+CREATE TABLE {schema}.outfit_images AS
+SELECT outfit_id, position, 'https://images.example.com/' || outfit_id || '-' || position AS url
+FROM {schema}.outfits, generate_series(1, 2) AS g(position);
+
+CREATE TABLE {schema}.outfit_products AS
+SELECT outfit_id, 'product-' || (1 + (int_id * 7919 + k * 104729) %% %(products)s) AS product_id
+FROM {schema}.outfits, generate_series(1, 4) AS g(k);
+
+ALTER TABLE {schema}.products ADD PRIMARY KEY (product_id);
+ALTER TABLE {schema}.outfits ADD PRIMARY KEY (outfit_id);
+CREATE INDEX ON {schema}.product_images (product_id);
+CREATE INDEX ON {schema}.product_variants (product_id);
+CREATE INDEX ON {schema}.outfit_images (outfit_id);
+CREATE INDEX ON {schema}.outfit_products (outfit_id);
+"""
+
+# Same definitions as api.products and api.outfits in sql/postgREST.sql
+CREATE_VIEWS = """
+CREATE VIEW {schema}.view_products AS
+SELECT p.*, i.images, v.variants
+FROM {schema}.products p
+INNER JOIN (
+    SELECT product_id, array_agg(product_images.*) AS images
+    FROM {schema}.product_images GROUP BY product_id
+) i USING (product_id)
+INNER JOIN (
+    SELECT product_id, array_agg(product_variants.*) AS variants
+    FROM {schema}.product_variants GROUP BY product_id
+) v USING (product_id);
+
+CREATE VIEW {schema}.view_outfits AS
+SELECT *
+FROM {schema}.outfits t1
+INNER JOIN (
+    SELECT outfit_id, array_agg(t1.*) AS images
+    FROM {schema}.outfit_images t1 GROUP BY outfit_id
+) t2 USING (outfit_id)
+INNER JOIN (
+    SELECT t1.outfit_id, array_agg(t2.*) AS products
+    FROM {schema}.outfit_products t1
+    INNER JOIN {schema}.view_products t2 USING (product_id)
+    GROUP BY outfit_id
+) t3 USING (outfit_id);
+"""
+
+# Same definitions as sql/catalog_materialized.sql
+CREATE_MATERIALIZED = """
+CREATE MATERIALIZED VIEW {schema}.catalog_products AS
+SELECT p.*, i.images, v.variants
+FROM {schema}.products p
+INNER JOIN (
+    SELECT product_id, jsonb_agg(to_jsonb(product_images.*)) AS images
+    FROM {schema}.product_images GROUP BY product_id
+) i USING (product_id)
+INNER JOIN (
+    SELECT product_id, jsonb_agg(to_jsonb(product_variants.*)) AS variants
+    FROM {schema}.product_variants GROUP BY product_id
+) v USING (product_id);
+
+CREATE MATERIALIZED VIEW {schema}.catalog_outfits AS
+SELECT *
+FROM {schema}.outfits t1
+INNER JOIN (
+    SELECT outfit_id, jsonb_agg(to_jsonb(t1.*)) AS images
+    FROM {schema}.outfit_images t1 GROUP BY outfit_id
+) t2 USING (outfit_id)
+INNER JOIN (
+    SELECT t1.outfit_id, jsonb_agg(to_jsonb(t2.*)) AS products
+    FROM {schema}.outfit_products t1
+    INNER JOIN {schema}.catalog_products t2 USING (product_id)
+    GROUP BY outfit_id
+) t3 USING (outfit_id);
+
+CREATE UNIQUE INDEX ON {schema}.catalog_products (int_id);
+CREATE UNIQUE INDEX ON {schema}.catalog_outfits (int_id);
+CREATE INDEX ON {schema}.catalog_products (base_color, int_id);
+CREATE INDEX ON {schema}.catalog_products (base_color DESC, int_id);
+CREATE INDEX ON {schema}.catalog_products (price, int_id);
+CREATE INDEX ON {schema}.catalog_products (price DESC, int_id);
+CREATE INDEX ON {schema}.catalog_outfits (season, int_id);
+ANALYZE;
+"""
+
+# Relation of every mode, per route.
+RELATIONS = {
+    "views": {"products": "view_products", "outfits": "view_outfits"},
+    "materialized": {"products": "catalog_products", "outfits": "catalog_outfits"},
+}
+
+# Scenario name -> route, sort column and direction of the seek pages.
+# Like the proxy, the filter is the keyset predicate (col, int_id) > (pivot, last id)
+# plus a `col >= pivot` bound (`<` and `<=` for DESC), ordered by the sort column then int_id.
+SCENARIOS = {
+    "products_int_id": ("products", "int_id", False),
+    "products_base_color": ("products", "base_color", False),
+    "products_base_color_desc": ("products", "base_color", True),
+    "products_price": ("products", "price", False),
+    "products_price_desc": ("products", "price", True),
+    "outfits_season": ("outfits", "season", False),
+}
+
+
+def create_catalog(conn, products: int) -> None:
+    """Create the synthetic catalog and its relations, about 5 products per outfit.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection.
+        products (int): Number of products.
+    """
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLES.format(schema=SCHEMA),
+                    {"products": products, "outfits": max(products // 5, 1)})
+        cur.execute(CREATE_VIEWS.format(schema=SCHEMA))
+        cur.execute(CREATE_MATERIALIZED.format(schema=SCHEMA))
+    conn.commit()
+
+
+def create_seek_query(relation: str, sort_col: str, descending: bool, limit: int) -> str:
+    """Query PostgREST runs for a seek page, including the JSON serialization.
+
+    Args:
+        relation (str): Relation.
+        sort_col (str): Sort column.
+        descending (bool): Sort direction of the sort column.
+        limit (int): Page size.
+
+    Returns:
+        str: Query with `pivot` and `last_id` parameters.
+    """
+    if sort_col == "int_id":
+        where, order = "int_id > %(last_id)s", "int_id"
+    else:
+        bound, operator = ("<=", "<") if descending else (">=", ">")
+        where = (f"{sort_col} {bound} %(pivot)s AND ({sort_col} {operator} %(pivot)s "
+                 f"OR ({sort_col} = %(pivot)s AND int_id > %(last_id)s))")
+        order = f"{sort_col} {'DESC' if descending else 'ASC'}, int_id"
+    return (f"SELECT coalesce(json_agg(t), '[]')::text FROM ("
+            f"SELECT * FROM {SCHEMA}.{relation} WHERE {where} ORDER BY {order} LIMIT {limit}"
+            f") t")
+
+
+def run_scenario(conn, mode: str, name: str, rows: int, pages: int, limit: int,
+                 seed: int) -> dict:
+    """Time the seek pages of a scenario.
+
+    Args:
+        conn (psycopg2.extensions.connection): Connection.
+        mode (str): "views" or "materialized".
+        name (str): Scenario name, see `SCENARIOS`.
+        rows (int): Number of rows of the route.
+        pages (int): Number of measured pages.
+        limit (int): Page size.
+        seed (int): Seed of the pivots.
+
+    Returns:
+        dict: Scenario results.
+    """
+    route, sort_col, descending = SCENARIOS[name]
+    relation = RELATIONS[mode][route]
+    query = create_seek_query(relation, sort_col, descending, limit)
+    rand = random.Random(seed)
+    latencies = []
+    with conn.cursor() as cur:
+        for _ in range(pages):
+            last_id = rand.randint(1, rows)
+            cur.execute(f"SELECT {sort_col} FROM {SCHEMA}.{route} WHERE int_id = %s", (last_id,))
+            pivot = cur.fetchone()[0]
+            started_at = time.perf_counter()
+            cur.execute(query, {"pivot": pivot, "last_id": last_id})
+            cur.fetchone()
+            latencies.append((time.perf_counter() - started_at) * 1000)
+    latencies.sort()
+    return {
+        "pages": pages,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+
+def main() -> None:
+    """Run the benchmark and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL",
+                                                        "postgresql://postgres@localhost/postgres"))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100000, 1000000],
+                        help="Number of products, there are 5 times less outfits.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--modes", nargs="+", choices=sorted(RELATIONS), default=list(RELATIONS))
+    parser.add_argument("--pages", type=int, default=50, help="Measured pages per scenario.")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--keep", action="store_true", help="Do not drop the scratch schema.")
+    parser.add_argument("--output", default=None,
+                        help="Defaults to benchmarks/results/catalog-<VERSION>.json")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from app.constants import VERSION
+
+    results: Dict[str, Dict[str, Dict[str, dict]]] = {}
+    conn = psycopg2.connect(args.dsn)
+    try:
+        for size in args.sizes:
+            started_at = time.perf_counter()
+            create_catalog(conn, size)
+            print(f"Loaded {size} products in {time.perf_counter() - started_at:.1f}s")
+            rows = {"products": size, "outfits": max(size // 5, 1)}
+            results[str(size)] = {}
+            for mode in args.modes:
+                results[str(size)][mode] = {}
+                for name in args.scenarios:
+                    result = run_scenario(conn, mode, name, rows[SCENARIOS[name][0]],
+                                          args.pages, args.limit, args.seed)
+                    results[str(size)][mode][name] = result
+                    print(f"{size:>9} {mode:<13} {name:<26} p50 {result['p50_ms']:>9} ms  "
+                          f"p95 {result['p95_ms']:>9} ms")
+    finally:
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+    output = args.output or os.path.join("benchmarks", "results", f"catalog-{VERSION}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "version": VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "limit": args.limit,
+            "sizes": results,
+        }, file, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
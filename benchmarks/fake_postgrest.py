@@ -0,0 +1,377 @@
+"""Deterministic stand-in for PostgREST, used by the benchmarks.
+
+Serves synthetic `products`, `outfits`, `outfit_thumbnails` and `facet_counts` rows with
+the parts of the PostgREST API the proxy relies on: filters (including `or`/`and`),
+`order`, `limit`/`offset`, `select`, `Content-Range`, `rpc/pivot_value` and
+`rpc/pivot_values`.
+Rows POSTed to `interactions` are kept in memory, ignoring the `event_id`s already stored.
+The same seed always produces the same rows.
+
+How to run:
+    python -m benchmarks.fake_postgrest --port 3000 --latency-ms 2
+"""
+import argparse
+import json
+import operator
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_SETTINGS = {
+    "seed": 1234,
+    "products": 5000,
+    "outfits": 1000,
+    # Size of the padding field added to every row, to control the payload size.
+    "row_padding": 200,
+    # Latency added to every response.
+    "latency_ms": 0.0,
+}
+
+COLORS = ["black", "blue", "brown", "green", "grey", "red", "white"]
+SEASONS = ["fall", "spring", "summer", "winter"]
+STYLISTS = ["ana", "bo", "chris", "dee"]
+
+LOGIC_TREE_RE = re.compile(r"^(not\.)?(and|or)\((.*)\)$")
+
+OPERATORS = {
+    "eq": operator.eq,
+    "neq": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+
+def create_rows(settings: dict) -> dict:
+    """Create the synthetic rows of every relation.
+
+    Args:
+        settings (dict): Fake PostgREST settings.
+
+    Returns:
+        dict: Rows per relation.
+    """
+    rand = random.Random(settings["seed"])
+    padding = "x" * settings["row_padding"]
+    products = [{
+        "int_id": int_id,
+        "product_id": f"product-{int_id}",
+        "name": f"Product {int_id}",
+        "base_color": rand.choice(COLORS),
+        "price": round(rand.uniform(5, 500), 2),
+        "images": [{"url": f"https://images.example.com/{int_id}-{n}.jpg"} for n in range(2)],
+        "padding": padding,
+    } for int_id in range(1, settings["products"] + 1)]
+
+    outfits = [{
+        "int_id": int_id,
+        "outfit_id": f"outfit-{int_id}",
+        "season": rand.choice(SEASONS),
+        "stylist": rand.choice(STYLISTS),
+        "products": [product["product_id"] for product in rand.sample(products, 4)],
+        "padding": padding,
+    } for int_id in range(1, settings["outfits"] + 1)]
+
+    thumbnails = [{
+        "int_id": outfit["int_id"],
+        "outfit_id": outfit["outfit_id"],
+        "url": f"https://images.example.com/{outfit['outfit_id']}.jpg",
+    } for outfit in outfits]
+
+    facet_counts = {}
+    for outfit in outfits:
+        for facet in ("season", "stylist"):
+            key = (facet, outfit[facet])
+            facet_counts[key] = facet_counts.get(key, 0) + 1
+
+    return {
+        "products": products,
+        "outfits": outfits,
+        "outfit_thumbnails": thumbnails,
+        "facet_counts": [{"int_id": int_id, "facet": facet, "value": value, "count": count}
+                         for int_id, ((facet, value), count)
+                         in enumerate(sorted(facet_counts.items()), 1)],
+    }
+
+
+def split_top_level(expr: str) -> List[str]:
+    """Split a logic tree on the commas that are not nested in parentheses or quotes.
+
+    Args:
+        expr (str): Comma separated conditions.
+
+    Returns:
+        List[str]: Conditions.
+    """
+    parts, depth, quoted, current = [], 0, False, []
+    for char in expr:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def compile_condition(condition: str) -> Callable[[dict], bool]:
+    """Compile a `col.op.value` condition or a nested `and(...)`/`or(...)` tree.
+
+    Args:
+        condition (str): Condition.
+
+    Returns:
+        Callable[[dict], bool]: Returns True for the rows that match.
+    """
+    logic_tree = LOGIC_TREE_RE.match(condition)
+    if logic_tree:
+        negated, logic_operator, body = logic_tree.groups()
+        predicates = [compile_condition(part) for part in split_top_level(body)]
+        combine = all if logic_operator == "and" else any
+        if negated:
+            return lambda row: not combine(predicate(row) for predicate in predicates)
+        return lambda row: combine(predicate(row) for predicate in predicates)
+
+    column, operator_name, target = condition.split(".", 2)
+    negated = operator_name == "not"
+    if negated:
+        operator_name, target = target.split(".", 1)
+    predicate = compile_comparison(column, operator_name, target)
+    return (lambda row: not predicate(row)) if negated else predicate
+
+
+def compile_comparison(column: str, operator_name: str,
+                       target: str) -> Callable[[dict], bool]:
+    """Compile a PostgREST operator.
+
+    Args:
+        column (str): Column.
+        operator_name (str): PostgREST operator, such as `gte`.
+        target (str): Operand from the query string.
+
+    Returns:
+        Callable[[dict], bool]: Returns True for the rows that match.
+    """
+    if target.startswith('"') and target.endswith('"'):
+        target = target[1:-1]
+    if operator_name == "is":
+        expected = {"null": None, "true": True, "false": False}[target]
+        return lambda row: row.get(column) is expected
+    if operator_name == "in":
+        values = set(split_top_level(target.strip("()")))
+        return lambda row: str(row.get(column)) in values
+
+    compare = OPERATORS[operator_name]
+    try:
+        number = float(target)
+    except ValueError:
+        number = None
+
+    def predicate(row: dict) -> bool:
+        value = row.get(column)
+        if value is None:
+            return False
+        if isinstance(value, (int, float)):
+            return number is not None and compare(value, number)
+        return compare(value, target)
+    return predicate
+
+
+def sort_rows(rows: List[dict], order: str) -> List[dict]:
+    """Sort rows by an `order` query param.
+    NULLs are sorted like in Postgres: last in ascending orders and first in descending
+    ones, unless `nullsfirst` or `nullslast` is given.
+
+    Args:
+        rows (List[dict]): Rows.
+        order (str): PostgREST order terms, empty for the natural order.
+
+    Returns:
+        List[dict]: Sorted rows.
+    """
+    rows = list(rows)
+    for term in reversed([term for term in order.split(",") if term]):
+        column, *modifiers = term.split(".")
+        descending = "desc" in modifiers
+        nulls_first = "nullsfirst" in modifiers or (descending and "nullslast" not in modifiers)
+        rows.sort(key=lambda row, col=column: (row.get(col) is None, row.get(col)),
+                  reverse=descending)
+        # Stable, the values keep their order.
+        rows.sort(key=lambda row, col=column: (row.get(col) is None) != nulls_first)
+    return rows
+
+
+class FakePostgrest(ThreadingHTTPServer):
+    """HTTP server with the synthetic rows and call counters."""
+    daemon_threads = True
+
+    def __init__(self, address: tuple, settings: dict = None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.rows = create_rows(self.settings)
+        self.rows_by_id = {relation: {row["int_id"]: row for row in rows}
+                           for relation, rows in self.rows.items()}
+        self.calls = {"get": 0, "rpc": 0, "insert": 0}
+        self.interactions = {}
+        self.calls_lock = threading.Lock()
+        self._sorted = {}
+        super().__init__(address, FakePostgrestHandler)
+
+    def sorted_rows(self, relation: str, order: str) -> List[dict]:
+        """Rows of a relation sorted by an `order` query param, sorts are memoized.
+
+        Args:
+            relation (str): Relation.
+            order (str): PostgREST order terms, empty for the natural order.
+
+        Returns:
+            List[dict]: Sorted rows, must not be modified.
+        """
+        key = (relation, order)
+        if key not in self._sorted:
+            self._sorted[key] = sort_rows(self.rows[relation], order)
+        return self._sorted[key]
+
+    def count(self, kind: str) -> None:
+        """Count a call."""
+        with self.calls_lock:
+            self.calls[kind] += 1
+
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    """Answers GET queries on the relations, the pivot RPCs and POST interactions."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def send_json(self, status: int, body, headers: dict = None) -> None:
+        """Send a JSON response."""
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, val in (headers or {}).items():
+            self.send_header(name, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def wait(self) -> None:
+        """Add the configured latency."""
+        latency = self.server.settings["latency_ms"]
+        if latency:
+            time.sleep(latency / 1000)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """rpc/pivot_value(int_id, col), rpc/pivot_values(int_id, cols) and inserts of
+        interaction events"""
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length).decode()
+        self.wait()
+        if urlparse(self.path).path == "/interactions":
+            self.server.count("insert")
+            with self.server.calls_lock:
+                for row in json.loads(raw_body):
+                    self.server.interactions.setdefault(row["event_id"], row)
+            return self.send_json(201, None)
+        if urlparse(self.path).path not in ("/rpc/pivot_value", "/rpc/pivot_values"):
+            return self.send_json(404, {"message": "Not found", "details": None, "hint": None})
+
+        self.server.count("rpc")
+        if raw_body.startswith("{"):
+            args = json.loads(raw_body)
+        else:
+            args = {key: vals[0] for key, vals in parse_qs(raw_body).items()}
+        relation = args.get("relation", "products")
+        row = self.server.rows_by_id.get(relation, {}).get(int(args["int_id"]), None)
+        if "cols" in args:
+            if row is None:
+                return self.send_json(200, None)
+            return self.send_json(200, {col: None if row.get(col) is None else str(row[col])
+                                        for col in args["cols"]})
+        value = None if row is None or row.get(args["col"]) is None else str(row[args["col"]])
+        return self.send_json(200, value)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Query a relation."""
+        self.wait()
+        url = urlparse(self.path)
+        relation = url.path.strip("/")
+        if relation not in self.server.rows:
+            return self.send_json(404, {
+                "message": f"relation \"api.{relation}\" does not exist",
+                "details": None,
+                "hint": None,
+            })
+
+        self.server.count("get")
+        query = parse_qs(url.query, keep_blank_values=True)
+        predicates = []
+        for key, values in query.items():
+            if key in ("limit", "offset", "order", "select"):
+                continue
+            for value in values:
+                condition = f"{key}{value}" if key in ("and", "or", "not.and", "not.or") \
+                    else f"{key}.{value}"
+                predicates.append(compile_condition(condition))
+
+        rows = self.server.sorted_rows(relation, query.get("order", [""])[0])
+        if predicates:
+            rows = [row for row in rows if all(predicate(row) for predicate in predicates)]
+
+        total = len(rows)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query["limit"][0]) if "limit" in query else total
+        page = rows[offset:offset + limit]
+        if "select" in query:
+            columns = query["select"][0].split(",")
+            page = [{column: row.get(column) for column in columns} for row in page]
+
+        count = str(total) if "count=exact" in self.headers.get("Prefer", "") else "*"
+        content_range = f"{offset}-{offset + len(page) - 1}/{count}" if page else f"*/{count}"
+        return self.send_json(200, page, {"Content-Range": content_range})
+
+
+def serve(host: str = "127.0.0.1", port: int = 3000, settings: dict = None, ready=None) -> None:
+    """Run the fake PostgREST until the process is stopped.
+
+    Args:
+        host (str, optional): Host. Defaults to "127.0.0.1".
+        port (int, optional): Port, 0 picks a free one. Defaults to 3000.
+        settings (dict, optional): Overrides of `DEFAULT_SETTINGS`. Defaults to None.
+        ready (multiprocessing.Queue, optional): Receives the port once the server listens.
+    """
+    server = FakePostgrest((host, port), settings)
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SETTINGS["seed"])
+    parser.add_argument("--products", type=int, default=DEFAULT_SETTINGS["products"])
+    parser.add_argument("--outfits", type=int, default=DEFAULT_SETTINGS["outfits"])
+    parser.add_argument("--row-padding", type=int, default=DEFAULT_SETTINGS["row_padding"])
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_SETTINGS["latency_ms"])
+    cli_args = parser.parse_args()
+    serve(cli_args.host, cli_args.port, {
+        "seed": cli_args.seed,
+        "products": cli_args.products,
+        "outfits": cli_args.outfits,
+        "row_padding": cli_args.row_padding,
+        "latency_ms": cli_args.latency_ms,
+    })
@@ -0,0 +1,236 @@
+"""Throughput and latency benchmark of the PostgREST proxy.
+
+The Flask app is served by a threaded werkzeug server and talks to the fake PostgREST
+of `benchmarks.fake_postgrest`, which runs in its own process so it does not compete
+with the proxy for the GIL. Every scenario reports req/s and latency percentiles,
+the results are written to a JSON file so runs can be diffed between releases.
+
+How to run:
+    python -m benchmarks.proxy_benchmark --requests 2000 --concurrency 16
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks import fake_postgrest
+
+os.environ.setdefault("JOB_CONFIG", "conf.dev")
+
+# Scenario name -> function of (random generator, fake settings) returning the request path.
+SCENARIOS: Dict[str, Callable[[random.Random, dict], str]] = {
+    "first_page": lambda rand, fake: "/api/products?limit=50",
+    "seek_page": lambda rand, fake: (f"/api/products?order=price&limit=50"
+                                     f"&int_id=gt.{rand.randint(1, fake['products'])}"),
+    "seek_page_desc": lambda rand, fake: (f"/api/products?order=base_color.desc&limit=50"
+                                          f"&int_id=gt.{rand.randint(1, fake['products'])}"),
+    "outfits_first_page": lambda rand, fake: "/api/outfits?limit=20",
+    "not_found": lambda rand, fake: "/api/does_not_exist",
+    "large_limit": lambda rand, fake: "/api/products?limit=1000",
+}
+
+# Responses of these scenarios are expected to be errors.
+EXPECTED_STATUSES = {
+    "not_found": 404,
+}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that does not log every request."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest rank percentile.
+
+    Args:
+        sorted_values (List[float]): Sorted samples.
+        percent (float): Percentile, between 0 and 100.
+
+    Returns:
+        float: Percentile, 0.0 if there are no samples.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def start_fake_postgrest(settings: dict) -> tuple:
+    """Start the fake PostgREST in a child process.
+
+    Args:
+        settings (dict): Fake PostgREST settings.
+
+    Returns:
+        tuple: Process and port.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=fake_postgrest.serve,
+                                      args=("127.0.0.1", 0, settings, ready),
+                                      daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def start_proxy(postgrest_port: int, overrides: dict) -> tuple:
+    """Create the Flask app and serve it from a background thread.
+
+    Args:
+        postgrest_port (int): Port of the fake PostgREST.
+        overrides (dict): Config values replacing the ones of the `JOB_CONFIG` module.
+
+    Returns:
+        tuple: Server and its base URL.
+    """
+    # pylint: disable=import-outside-toplevel
+    import main
+
+    main.config.update({
+        **overrides,
+        "postgrest_host": f"http://127.0.0.1:{postgrest_port}/",
+        "debug": False,
+        # Error paths are benchmarked too, do not log every one of them.
+        "default_log_level": logging.CRITICAL,
+    })
+    server = make_server("127.0.0.1", 0, main.main(), threaded=True,
+                         request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_scenario(base_url: str, name: str, fake_settings: dict, total_requests: int,
+                 concurrency: int, warmup: int, seed: int) -> dict:
+    """Send the requests of a scenario and measure them.
+
+    Args:
+        base_url (str): URL of the proxy.
+        name (str): Scenario name, see `SCENARIOS`.
+        fake_settings (dict): Fake PostgREST settings.
+        total_requests (int): Number of measured requests.
+        concurrency (int): Number of clients sending requests at the same time.
+        warmup (int): Number of requests sent before measuring.
+        seed (int): Seed of the request paths.
+
+    Returns:
+        dict: Scenario results.
+    """
+    rand = random.Random(seed)
+    paths = [SCENARIOS[name](rand, fake_settings) for _ in range(warmup + total_requests)]
+    expected_status = EXPECTED_STATUSES.get(name, 200)
+    local = threading.local()
+
+    def send(path: str) -> tuple:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        resp = local.session.get(base_url + path, headers={"Accept-Encoding": "gzip"})
+        elapsed = time.perf_counter() - start
+        return elapsed, resp.status_code == expected_status, len(resp.content)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, paths[:warmup]))
+        started_at = time.perf_counter()
+        samples = list(executor.map(send, paths[warmup:]))
+        duration = time.perf_counter() - started_at
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for sample in samples if not sample[1]),
+        "duration_s": round(duration, 3),
+        "req_per_s": round(total_requests / duration, 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "mean_response_bytes": round(sum(sample[2] for sample in samples) / len(samples)),
+    }
+
+
+def main() -> None:
+    """Run the benchmark and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="Measured requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=fake_postgrest.DEFAULT_SETTINGS["seed"])
+    parser.add_argument("--products", type=int,
+                        default=fake_postgrest.DEFAULT_SETTINGS["products"])
+    parser.add_argument("--row-padding", type=int,
+                        default=fake_postgrest.DEFAULT_SETTINGS["row_padding"])
+    parser.add_argument("--latency-ms", type=float, default=1.0,
+                        help="Latency added by the fake PostgREST to every response.")
+    parser.add_argument("--config", type=json.loads, default={
+        "response_cache": {"enabled": False},
+        "pivot_cache": {"enabled": False},
+        "admission": {"enabled": False},
+    }, help="JSON object replacing keys of the app config. "
+            "Defaults to disabling the caches so every request reaches PostgREST, and the "
+            "admission control since every request comes from the same IP.")
+    parser.add_argument("--output", default=None,
+                        help="Defaults to benchmarks/results/proxy-<VERSION>.json")
+    args = parser.parse_args()
+
+    fake_settings = {
+        **fake_postgrest.DEFAULT_SETTINGS,
+        "seed": args.seed,
+        "products": args.products,
+        "row_padding": args.row_padding,
+        "latency_ms": args.latency_ms,
+    }
+    fake_process, postgrest_port = start_fake_postgrest(fake_settings)
+    server, base_url = start_proxy(postgrest_port, args.config)
+
+    # pylint: disable=import-outside-toplevel
+    from app.constants import VERSION
+
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = run_scenario(base_url, name, fake_settings, args.requests,
+                                         args.concurrency, args.warmup, args.seed)
+            print(f"{name:<20} {results[name]['req_per_s']:>9} req/s  "
+                  f"p50 {results[name]['p50_ms']:>8} ms  "
+                  f"p95 {results[name]['p95_ms']:>8} ms  "
+                  f"p99 {results[name]['p99_ms']:>8} ms  "
+                  f"errors {results[name]['errors']}")
+    finally:
+        server.shutdown()
+        fake_process.terminate()
+
+    output = args.output or os.path.join("benchmarks", "results", f"proxy-{VERSION}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "version": VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_postgrest": fake_settings,
+            "config": args.config,
+            "scenarios": results,
+        }, file, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Scoring latency benchmark of the recommendation models.
+
+Exports a synthetic model with the requested number of items to a temporary directory,
+loads it memory-mapped like the API does and times `RecommendationModel.recommend`
+for random users, the matrix product, the top-K selection and the id lookup included.
+
+How to run:
+    python -m benchmarks.recommendation_benchmark --items 100000 --dim 64
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app.api import recommender
+from benchmarks.proxy_benchmark import percentile
+
+
+def random_matrix(rand: random.Random, rows: int, cols: int) -> np.ndarray:
+    """Uniform float32 matrix in [-0.5, 0.5).
+    numpy.random is not used, the `secrets` directory of the repository shadows
+    the stdlib module it imports.
+
+    Args:
+        rand (random.Random): Random generator.
+        rows (int): Number of rows.
+        cols (int): Number of columns.
+
+    Returns:
+        np.ndarray: Matrix.
+    """
+    size = rows * cols
+    values = np.frombuffer(rand.getrandbits(size * 32).to_bytes(size * 4, "little"),
+                           dtype=np.uint32)
+    return (values / 2 ** 32 - 0.5).astype(np.float32).reshape(rows, cols)
+
+
+def run(model: recommender.RecommendationModel, users: int, limit: int, requests: int,
+        seed: int) -> dict:
+    """Time the recommendations of random users.
+
+    Args:
+        model (recommender.RecommendationModel): Model.
+        users (int): Number of users of the model.
+        limit (int): Number of recommended items.
+        requests (int): Number of measured requests.
+        seed (int): Seed of the users.
+
+    Returns:
+        dict: Results.
+    """
+    rand = random.Random(seed)
+    # Warm up, the first request pages the embeddings in.
+    model.recommend(0, "outfits", limit)
+    latencies = []
+    for _ in range(requests):
+        user_id = rand.randrange(users)
+        started_at = time.perf_counter()
+        model.recommend(user_id, "outfits", limit)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+
+def main() -> None:
+    """Run the benchmark and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", nargs="+", type=int, default=[100000])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=64, help="Embedding dimension.")
+    parser.add_argument("--limits", nargs="+", type=int, default=[20, 100])
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per run.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None,
+                        help="Defaults to benchmarks/results/recommendations-<VERSION>.json")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from app.constants import VERSION
+
+    rand = random.Random(args.seed)
+    results = {}
+    for items in args.items:
+        with tempfile.TemporaryDirectory() as model_dir:
+            recommender.export_model(
+                model_dir, "benchmark", np.arange(args.users),
+                random_matrix(rand, args.users, args.dim),
+                {"outfits": (np.arange(1, items + 1), random_matrix(rand, items, args.dim),
+                             random_matrix(rand, items, 1)[:, 0])})
+            model = recommender.ModelStore(model_dir, check_interval=0).get()
+            results[str(items)] = {}
+            for limit in args.limits:
+                result = run(model, args.users, limit, args.requests, args.seed)
+                results[str(items)][str(limit)] = result
+                print(f"{items:>9} items  top {limit:<4} p50 {result['p50_ms']:>8} ms  "
+                      f"p95 {result['p95_ms']:>8} ms")
+            del model
+
+    output = args.output or os.path.join("benchmarks", "results",
+                                         f"recommendations-{VERSION}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "version": VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dim": args.dim,
+            "users": args.users,
+            "items": results,
+        }, file, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
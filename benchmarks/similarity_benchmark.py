@@ -0,0 +1,135 @@
+"""Recall and latency benchmark of the similarity index, per number of probes.
+
+Builds an IVF index over synthetic clustered embeddings, then compares the neighbours
+of random items found by `IVFIndex.search` with an exact scan of every item.
+Use it to pick the `n_lists` and `n_probe` settings.
+
+How to run:
+    python -m benchmarks.similarity_benchmark --items 100000 --n-probe 1 4 8 16 32
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app.api import similarity
+from benchmarks.proxy_benchmark import percentile
+from benchmarks.recommendation_benchmark import random_matrix
+
+
+def clustered_embeddings(rand: random.Random, items: int, dim: int, clusters: int) -> np.ndarray:
+    """Embeddings scattered around random cluster centers, like the embeddings of a
+    catalog with styles and categories.
+
+    Args:
+        rand (random.Random): Random generator.
+        items (int): Number of items.
+        dim (int): Embedding dimension.
+        clusters (int): Number of clusters.
+
+    Returns:
+        np.ndarray: (items, dim) embeddings.
+    """
+    centers = random_matrix(rand, clusters, dim)
+    labels = np.array([rand.randrange(clusters) for _ in range(items)])
+    return centers[labels] + 0.5 * random_matrix(rand, items, dim)
+
+
+def run(index: similarity.IVFIndex, vectors: np.ndarray, ids: np.ndarray, n_probe: int,
+        limit: int, queries: list) -> dict:
+    """Time the searches of the query items and compute their recall.
+
+    Args:
+        index (similarity.IVFIndex): Index.
+        vectors (np.ndarray): Normalized embeddings, in the order of `ids`.
+        ids (np.ndarray): int_id of every item.
+        n_probe (int): Number of probes.
+        limit (int): Number of neighbours.
+        queries (list): Rows of the query items.
+
+    Returns:
+        dict: Results.
+    """
+    latencies, recalls = [], []
+    for row in queries:
+        started_at = time.perf_counter()
+        found = index.search(int(ids[row]), limit, n_probe).ids
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+        scores = vectors @ vectors[row]
+        scores[row] = -np.inf
+        exact = ids[np.argpartition(-scores, limit)[:limit]]
+        recalls.append(len(set(found) & set(exact.tolist())) / limit)
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "recall": round(sum(recalls) / len(recalls), 4),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+    }
+
+
+def main() -> None:
+    """Run the benchmark and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=64, help="Embedding dimension.")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--n-lists", type=int, default=0, help="0 for about sqrt(items).")
+    parser.add_argument("--n-probe", nargs="+", type=int, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None,
+                        help="Defaults to benchmarks/results/similarity-<VERSION>.json")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from app.constants import VERSION
+
+    rand = random.Random(args.seed)
+    embeddings = clustered_embeddings(rand, args.items, args.dim, args.clusters)
+    ids = np.arange(1, args.items + 1)
+    settings = {**similarity.DEFAULT_SETTINGS, "n_lists": args.n_lists}
+    queries = [rand.randrange(args.items) for _ in range(args.queries)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as index_dir:
+        started_at = time.perf_counter()
+        similarity.build_index(os.path.join(index_dir, "index"), ids, embeddings, settings)
+        build_seconds = round(time.perf_counter() - started_at, 3)
+        index = similarity.IVFIndex(os.path.join(index_dir, "index"))
+        print(f"Built {index.n_lists} lists over {args.items} items in {build_seconds}s")
+
+        vectors = similarity.normalize(embeddings)
+        for n_probe in args.n_probe:
+            result = run(index, vectors, ids, n_probe, args.limit, queries)
+            results[str(n_probe)] = result
+            print(f"n_probe {n_probe:>4}  recall@{args.limit} {result['recall']:<6}  "
+                  f"p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms")
+        del index
+
+    output = args.output or os.path.join("benchmarks", "results", f"similarity-{VERSION}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "version": VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "items": args.items,
+            "dim": args.dim,
+            "limit": args.limit,
+            "build_seconds": build_seconds,
+            "n_probe": results,
+        }, file, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,4 +12,187 @@ config = {
     "port": 5000,
     "debug": True,
     "postgrest_host": "http://0.0.0.0:3000",
+    # Write logs from a background thread through a bounded queue, records are dropped
+    # (and counted, see /stats/logging) instead of blocking requests when it is full
+    "logging": {
+        "queue": True,
+        "queue_size": 10000,
+        "json": True,
+        # Fraction of the DEBUG records that are kept
+        "debug_sample_rate": 1.0,
+    },
+    # "flask" or "asgi" (asyncio proxy, see app/asgi.py)
+    "engine": "flask",
+    # Connection limits of the asyncio PostgREST client, only used by the asgi engine
+    "asgi": {
+        "max_connections": 1000,
+        "max_keepalive_connections": 100,
+    },
+    # Pooled HTTP client used to talk to PostgREST
+    "upstream": {
+        "pool_connections": 4,
+        "pool_maxsize": 32,
+        "pool_block": False,
+        "keep_alive": True,
+        "connect_timeout": 3.05,
+        "read_timeout": 30,
+        "max_retries": 2,
+        "backoff_factor": 0.1,
+        "retry_statuses": [502, 503, 504],
+    },
+    # "views" proxies the catalog routes to the api.products/api.outfits views,
+    # "materialized" to the indexed relations of sql/catalog_materialized.sql
+    "catalog": {
+        "mode": "views",
+        "materialized_relations": {
+            "products": "catalog_products",
+            "outfits": "catalog_outfits",
+        },
+    },
+    # Forward large PostgREST responses to the client as they arrive
+    "streaming": {
+        "enabled": False,
+        "chunk_size": 65536,
+        # Pages with a smaller limit are buffered
+        "min_limit": 100,
+    },
+    # Cache of read-only PostgREST routes
+    "response_cache": {
+        "enabled": True,
+        # Where cached responses are stored, one of:
+        #   {"type": "memory", "max_bytes": 64 * 1024 * 1024}  (per worker)
+        #   {"type": "redis", "unix_socket_path": "/var/run/redis/redis.sock"}  (per host)
+        #   {"type": "mmap", "directory": "/dev/shm/justlooks-cache",
+        #    "slots": 4096, "slot_size": 65536}  (per host)
+        "backend": {"type": "memory", "max_bytes": 64 * 1024 * 1024},
+        # Seconds a response is cached for, per PostgREST route
+        "route_ttls": {
+            "products": 60,
+            "outfits": 60,
+            "outfit_thumbnails": 60,
+            "distinct_seasons": 300,
+            "distinct_stylists": 300,
+        },
+        "vary_headers": ["Accept", "Prefer", "Range"],
+    },
+    # Memoized seek pagination pivot values, saves the `rpc/pivot_values` round trip
+    "pivot_cache": {
+        "enabled": True,
+        "backend": {"type": "memory", "max_bytes": 4 * 1024 * 1024},
+        "ttl": 3600,
+    },
+    # Identical PostgREST queries in flight at the same time share one response
+    "single_flight": {
+        "enabled": True,
+        "vary_headers": ["Accept", "Prefer", "Range", "Authorization", "Cookie"],
+    },
+    # Negotiated gzip/brotli compression of responses, brotli needs the `brotli` package
+    "compression": {
+        "enabled": True,
+        "min_size": 1024,
+        "gzip_level": 6,
+        "brotli_level": 5,
+        "encodings": ["br", "gzip"],
+    },
+    # Timing of the proxy pipeline, see /stats/timing
+    "timing": {
+        "enabled": True,
+        # Server-Timing response header, exposes internals so keep it off in production
+        "server_timing_header": True,
+        "log_slower_than_ms": 500,
+    },
+    # Presigned S3 uploads, the client is shared and rebuilt every `client_ttl` seconds
+    "s3": {
+        "bucket": "justlooks-images",
+        "profile_name": "direct-upload-s3",
+        "key_prefix": "outfits/",
+        "expires_in": 3600,
+        "client_ttl": 3000,
+        "max_batch_files": 20,
+    },
+    # POST /batch, sub-requests share a pool of `workers` threads and one batch
+    # runs at most `max_concurrency` of them at the same time
+    "batch": {
+        "max_requests": 20,
+        "max_concurrency": 4,
+        "workers": 16,
+    },
+    # Facet counts of the filter dropdowns, read from the `facet_counts` materialized view
+    # (sql/facets.sql) and reloaded every `refresh_interval` seconds and on catalog reloads.
+    # To add a facet, add its column to data.facet_columns and map a name to it here
+    "facets": {
+        "relation": "facet_counts",
+        "facets": {
+            "seasons": "season",
+            "stylists": "stylist",
+        },
+        "refresh_interval": 300,
+        "retry_interval": 10,
+        "max_age": 3600,
+    },
+    # GET /recommendations/<kind>, serves the model named in `<model_dir>/LATEST`
+    # (see recommender.export_model) and checks for a new one every `check_interval` seconds
+    "recommendations": {
+        "model_dir": "/tmp/justlooks-models",
+        "check_interval": 5,
+        "default_limit": 20,
+        "max_limit": 100,
+    },
+    # GET /similar/<kind>/<int_id>, IVF index of the recommendation model item embeddings,
+    # built in the background and saved next to the model. Clients can pass `n_probe`
+    # (capped to `max_n_probe`) to trade latency for recall
+    "similarity": {
+        "n_lists": 0,
+        "n_probe": 8,
+        "max_n_probe": 64,
+        "train_size": 50000,
+        "n_iter": 10,
+        "retry_interval": 60,
+        "index_dir": None,
+    },
+    # POST /interactions, events are queued and inserted into api.interactions
+    # (sql/interactions.sql) every `batch_size` events or `flush_interval` seconds.
+    # The route answers 503 while `queue_size` events are waiting
+    "interactions": {
+        "queue_size": 10000,
+        "batch_size": 500,
+        "flush_interval": 1.0,
+        "retry_interval": 2.0,
+        "max_request_events": 100,
+        "shutdown_timeout": 10.0,
+    },
+    # GET /images/<file name>?width=&format=&quality=, resized uploads rendered by `workers`
+    # processes and kept in an on-disk LRU cache of `cache_size` bytes.
+    # `source` is "s3" (the bucket of the `s3` settings) or "local" (`local_dir`)
+    "images": {
+        "source": "s3",
+        "local_dir": None,
+        "cache_dir": "/tmp/justlooks-image-cache",
+        "cache_size": 1024 ** 3,
+        "workers": 2,
+        "timeout": 30,
+        "widths": [160, 320, 640, 1080],
+        "default_quality": 80,
+    },
+    # Load shedding: 429 past `rate` requests/s (bursts of `burst`) per IP, and per API key
+    # on top of it, 503 when `max_queue` requests already wait for a route or after
+    # `queue_timeout` seconds. Routes are URL rules, the proxy is "/api/<path:path>",
+    # also for /batch sub-requests and the asgi engine.
+    "admission": {
+        "enabled": True,
+        "rate": 50.0,
+        "burst": 100,
+        "client_header": "X-API-Key",
+        "trust_forwarded_for": False,
+        "concurrency": {
+            "/api/<path:path>": 32,
+            "/batch": 4,
+            "/images/<path:key>": 8,
+        },
+        "default_concurrency": 64,
+        "max_queue": 64,
+        "queue_timeout": 1.0,
+    },
+    # Touch this file after loading the catalog to invalidate cached responses and pivots
+    "catalog_version_file": "/tmp/justlooks-catalog-version",
 }
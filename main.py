@@ -5,9 +5,10 @@ from importlib import import_module
 
 from flask import Flask
 
-from app.logger import set_logger_file, logger
+from app.logger import enable_queue_logging, set_logger_file, logger
 from app import constants
-from app.api import api_bp
+from app.api import (admission, api_bp, batch, cache, catalog, compression, facet_index, images,
+                     interactions, recommender, s3, similarity, single_flight, timing, upstream)
 
 try:
     config_file = import_module(os.environ['JOB_CONFIG'])
@@ -29,6 +30,12 @@ def main():
     set_logger_file(a_lg=logger, log_file_dir=config['environment'])
     # Sets both File and Console level
     logger.setLevel(config['default_log_level'])
+    logging_config = config.get('logging', {})
+    if logging_config.get('queue', False):
+        enable_queue_logging(logger,
+                             queue_size=logging_config.get('queue_size', 10000),
+                             json_format=logging_config.get('json', True),
+                             debug_sample_rate=logging_config.get('debug_sample_rate', 1.0))
     logger.info(f"Imported from module: {os.environ['JOB_CONFIG']}")
 
     app = Flask(__name__)
@@ -36,6 +43,23 @@ def main():
     app.config['ROUTE_PATH'] = constants.ROUTE_PATH
     app.config['CONFIG'] = config
 
+    upstream.configure(config.get('upstream', {}))
+    catalog.configure(config.get('catalog', {}))
+    cache.configure_catalog_version(config.get('catalog_version_file', None))
+    cache.configure(config.get('response_cache', {}))
+    cache.configure_pivot_values(config.get('pivot_cache', {}))
+    single_flight.configure(config.get('single_flight', {}))
+    compression.configure(config.get('compression', {}))
+    timing.configure(config.get('timing', {}))
+    s3.configure(config.get('s3', {}))
+    batch.configure(config.get('batch', {}))
+    facet_index.configure(config.get('facets', {}), config['postgrest_host'])
+    recommender.configure(config.get('recommendations', {}))
+    similarity.configure(config.get('similarity', {}))
+    interactions.configure(config.get('interactions', {}), config['postgrest_host'])
+    images.configure(config.get('images', {}))
+    admission.configure(config.get('admission', {}))
+
     app.register_blueprint(api_bp)
 
     app.secret_key = 'justlooks'
@@ -43,10 +67,27 @@ def main():
     return app
 
 
-if __name__ == "__main__":
-    flask_app = main()
+def main_asgi():
+    """Entry point of the asyncio (ASGI) serving mode.
+    The Flask app is still created, it serves every route that is not proxied to PostgREST.
+    How to run:
+        uvicorn --factory main:main_asgi
+    """
+    # pylint: disable=import-outside-toplevel
+    from app.asgi import AsyncProxy
 
+    return AsyncProxy(main())
+
+
+if __name__ == "__main__":
     host = config['host']
     port = config['port']
     debug = config['debug']
-    flask_app.run(debug=debug, host=host, port=port)
+
+    if config.get('engine', 'flask') == 'asgi':
+        # pylint: disable=import-outside-toplevel
+        import uvicorn
+        uvicorn.run(main_asgi(), host=host, port=port)
+    else:
+        flask_app = main()
+        flask_app.run(debug=debug, host=host, port=port)
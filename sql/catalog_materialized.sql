@@ -0,0 +1,129 @@
+-- Materialized catalog, alternate schema mode of the products and outfits routes.
+-- api.products and api.outfits aggregate the images, variants and products of every row
+-- with array_agg on each query, so a seek page (`int_id=gt.N&order=...`) can not use an
+-- index and reads the whole catalog. These relations store the aggregated rows once,
+-- with (sort column, int_id) indexes so seek pages are index range scans.
+-- Set `"catalog": {"mode": "materialized"}` in the config to proxy the routes to them.
+-- Run CALL data.refresh_catalog(); after every catalog load.
+
+-- products, same rows as api.products
+CREATE MATERIALIZED VIEW data.catalog_products AS
+SELECT
+    p.*,
+    i.images,
+    v.variants
+FROM data.products p
+INNER JOIN(
+    SELECT
+        product_id,
+        jsonb_agg(to_jsonb(product_images.*)) AS images
+    FROM data.product_images
+    GROUP BY product_id
+) i USING (product_id)
+INNER JOIN(
+    SELECT
+        product_id,
+        jsonb_agg(to_jsonb(product_variants.*)) AS variants
+    FROM data.product_variants
+    GROUP BY product_id
+) v USING (product_id);
+
+-- outfits, same rows as api.outfits
+CREATE MATERIALIZED VIEW data.catalog_outfits AS
+SELECT
+    *
+FROM data.outfits t1
+INNER JOIN (
+    SELECT
+        outfit_id,
+        jsonb_agg(to_jsonb(t1.*)) as images
+    FROM data.outfit_images t1
+    GROUP BY outfit_id
+) t2 USING (outfit_id)
+INNER JOIN (
+    SELECT
+        t1.outfit_id,
+        jsonb_agg(to_jsonb(t2.*)) as products
+    FROM data.outfit_products t1
+    INNER JOIN data.catalog_products t2 USING (product_id)
+    GROUP BY outfit_id
+) t3 USING (outfit_id);
+
+-- Needed by REFRESH MATERIALIZED VIEW CONCURRENTLY, also serves `order=int_id` pages
+CREATE UNIQUE INDEX catalog_products_int_id_idx
+ON data.catalog_products (int_id);
+
+CREATE UNIQUE INDEX catalog_outfits_int_id_idx
+ON data.catalog_outfits (int_id);
+
+-- Sortable columns, every one gets a (col, int_id) and a (col DESC, int_id) index since
+-- the proxy always adds `int_id` (ascending) after the sort column.
+CREATE TABLE IF NOT EXISTS data.catalog_sort_columns (
+    relation text NOT NULL,
+    col text NOT NULL,
+    PRIMARY KEY (relation, col)
+);
+
+INSERT INTO data.catalog_sort_columns (relation, col)
+VALUES ('catalog_products', 'base_color'),
+       ('catalog_products', 'price'),
+       ('catalog_outfits', 'season'),
+       ('catalog_outfits', 'stylist')
+ON CONFLICT DO NOTHING;
+
+-- Create the missing seek indexes of the sortable columns
+CREATE OR REPLACE FUNCTION data.create_catalog_sort_indexes()
+  RETURNS void AS $body$
+DECLARE
+    sort_column record;
+BEGIN
+    FOR sort_column IN SELECT relation, col FROM data.catalog_sort_columns LOOP
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS %I ON data.%I (%I, int_id)',
+            sort_column.relation || '_' || sort_column.col || '_int_id_idx',
+            sort_column.relation, sort_column.col);
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS %I ON data.%I (%I DESC, int_id)',
+            sort_column.relation || '_' || sort_column.col || '_desc_int_id_idx',
+            sort_column.relation, sort_column.col);
+    END LOOP;
+END;
+$body$ LANGUAGE plpgsql;
+
+SELECT data.create_catalog_sort_indexes();
+
+-- Refresh procedure, products first since outfits embed them.
+-- Readers are not blocked, touch the catalog version file afterwards so the API drops
+-- its cached responses and pivot values.
+CREATE OR REPLACE PROCEDURE data.refresh_catalog()
+  AS $body$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY data.catalog_products;
+    REFRESH MATERIALIZED VIEW CONCURRENTLY data.catalog_outfits;
+    PERFORM data.create_catalog_sort_indexes();
+    ANALYZE data.catalog_products;
+    ANALYZE data.catalog_outfits;
+END;
+$body$ LANGUAGE plpgsql;
+
+REVOKE ALL ON PROCEDURE data.refresh_catalog() FROM PUBLIC;
+
+-- Views for api, simple views are inlined so the indexes above are used
+CREATE VIEW api.catalog_products AS
+SELECT * FROM data.catalog_products;
+
+CREATE VIEW api.catalog_outfits AS
+SELECT * FROM data.catalog_outfits;
+
+grant select on api.catalog_products, api.catalog_outfits to app_user;
+
+CALL data.refresh_catalog();
+
+-- Drop in correct order
+drop view if exists api.catalog_products,
+                    api.catalog_outfits;
+drop materialized view if exists data.catalog_outfits,
+                                 data.catalog_products;
+drop procedure if exists data.refresh_catalog();
+drop function if exists data.create_catalog_sort_indexes();
+drop table if exists data.catalog_sort_columns;
@@ -0,0 +1,75 @@
+-- Precomputed facet counts for the filter dropdowns.
+-- The distinct_* views used to run a GROUP BY over all of data.outfits on every call,
+-- the counts are now kept in a materialized view that is refreshed after every catalog
+-- load and on a schedule. The API reads them through api.facet_counts (see the
+-- `facets` config) and keeps them in memory.
+
+-- Columns of data.outfits that are counted.
+-- To add a facet: insert its column here, refresh, and map a name to it in the config.
+CREATE TABLE IF NOT EXISTS data.facet_columns (
+    col text PRIMARY KEY
+);
+
+INSERT INTO data.facet_columns (col)
+VALUES ('season'), ('stylist')
+ON CONFLICT DO NOTHING;
+
+-- One row per (facet column, value)
+CREATE MATERIALIZED VIEW data.outfit_facet_counts AS
+SELECT
+    f.key AS facet,
+    f.value,
+    count(*) AS count
+FROM data.outfits o
+CROSS JOIN LATERAL jsonb_each_text(to_jsonb(o)) f
+WHERE f.key IN (SELECT col FROM data.facet_columns)
+  AND f.value IS NOT NULL
+GROUP BY f.key, f.value;
+
+-- Needed by REFRESH MATERIALIZED VIEW CONCURRENTLY, which does not block readers
+CREATE UNIQUE INDEX outfit_facet_counts_facet_value_idx
+ON data.outfit_facet_counts (facet, value);
+
+-- facet counts view for api
+CREATE VIEW api.facet_counts AS
+SELECT facet, value, count FROM data.outfit_facet_counts;
+
+grant select on api.facet_counts to app_user;
+
+-- The dropdown views read the precomputed counts
+DROP VIEW IF EXISTS api.distinct_seasons, api.distinct_stylists;
+
+CREATE VIEW api.distinct_seasons AS
+SELECT value AS season, count FROM data.outfit_facet_counts
+WHERE facet = 'season';
+
+CREATE VIEW api.distinct_stylists AS
+SELECT value AS stylist, count FROM data.outfit_facet_counts
+WHERE facet = 'stylist';
+
+grant select on api.distinct_seasons, api.distinct_stylists to app_user;
+
+-- Refresh the counts, call it after loading the catalog (then touch the catalog version
+-- file so the API reloads them). Lives in the data schema so PostgREST does not expose it.
+CREATE OR REPLACE FUNCTION data.refresh_facet_counts()
+  RETURNS void AS $body$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY data.outfit_facet_counts;
+END;
+$body$ LANGUAGE plpgsql;
+
+REVOKE ALL ON FUNCTION data.refresh_facet_counts() FROM PUBLIC;
+
+-- Scheduled refresh, for when outfits are added outside of catalog loads (needs pg_cron)
+-- SELECT cron.schedule('refresh-facet-counts', '*/15 * * * *',
+--                      'SELECT data.refresh_facet_counts()');
+
+SELECT data.refresh_facet_counts();
+
+-- Drop in correct order
+drop view if exists api.facet_counts,
+                    api.distinct_seasons,
+                    api.distinct_stylists;
+drop materialized view if exists data.outfit_facet_counts;
+drop function if exists data.refresh_facet_counts();
+drop table if exists data.facet_columns;
@@ -0,0 +1,48 @@
+-- Interaction events (likes, unlikes, views, clicks) sent through POST /interactions.
+-- The API queues them and inserts them in batches through api.interactions with
+-- `on_conflict=event_id` and `Prefer: resolution=ignore-duplicates`, so an event that is
+-- sent again after a failed or interrupted insert is stored once.
+-- Events are only appended, the current likes and the retraining data are derived from them.
+
+CREATE TABLE IF NOT EXISTS data.interactions (
+    event_id uuid PRIMARY KEY,
+    user_id text NOT NULL,
+    kind text NOT NULL CHECK (kind IN ('outfits', 'products')),
+    int_id bigint NOT NULL,
+    event text NOT NULL CHECK (event IN ('like', 'unlike', 'view', 'click')),
+    occurred_at timestamptz NOT NULL,
+    received_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Retraining reads the events of a time window
+CREATE INDEX IF NOT EXISTS interactions_occurred_at_idx
+ON data.interactions (occurred_at);
+
+-- Latest like or unlike of every (user, item)
+CREATE INDEX IF NOT EXISTS interactions_likes_idx
+ON data.interactions (user_id, kind, int_id, occurred_at DESC)
+WHERE event IN ('like', 'unlike');
+
+-- Items a user currently likes, the last of their like and unlike events is a like
+CREATE VIEW data.current_likes AS
+SELECT user_id, kind, int_id, occurred_at AS liked_at
+FROM (
+    SELECT DISTINCT ON (user_id, kind, int_id)
+        user_id, kind, int_id, event, occurred_at
+    FROM data.interactions
+    WHERE event IN ('like', 'unlike')
+    ORDER BY user_id, kind, int_id, occurred_at DESC
+) latest
+WHERE event = 'like';
+
+-- Insert only view for api, simple views accept INSERT ... ON CONFLICT
+CREATE VIEW api.interactions AS
+SELECT event_id, user_id, kind, int_id, event, occurred_at
+FROM data.interactions;
+
+grant insert on api.interactions to app_user;
+
+-- Drop in correct order
+drop view if exists api.interactions,
+                    data.current_likes;
+drop table if exists data.interactions;
@@ -70,23 +70,109 @@ CREATE VIEW api.distinct_stylists AS
 SELECT stylist, count(stylist) FROM data.outfits
 GROUP BY stylist;
 
+-- Relations whose rows can be pivots of a seek pagination, with the table that holds
+-- their sortable columns. Lookups read that table by its int_id index instead of the
+-- aggregating view. Add a row for every paginated route of the proxy.
+CREATE TABLE data.pivot_relations (
+    relation text PRIMARY KEY,
+    source_table text NOT NULL
+);
+
+INSERT INTO data.pivot_relations (relation, source_table)
+VALUES ('products', 'data.products'),
+       ('outfits', 'data.outfits'),
+       ('outfit_thumbnails', 'data.outfit_images'),
+       -- sql/catalog_materialized.sql
+       ('catalog_products', 'data.catalog_products'),
+       ('catalog_outfits', 'data.catalog_outfits');
+
 -- Get pivot value for seek pagination
-CREATE OR REPLACE FUNCTION api.pivot_value(int_id int, col text)
+-- Only whitelisted relations and their existing columns can be read, other lookups
+-- fail with 22023 (400 from PostgREST).
+CREATE OR REPLACE FUNCTION api.pivot_value(relation text, int_id int, col text)
   RETURNS text AS $body$
 DECLARE
+    source regclass;
     pivot_val text;
 BEGIN
+    SELECT to_regclass(p.source_table) INTO source
+    FROM data.pivot_relations p
+    WHERE p.relation = pivot_value.relation;
+
+    IF source IS NULL THEN
+        RAISE EXCEPTION 'Unknown pivot relation %', pivot_value.relation
+            USING ERRCODE = '22023';
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = source AND attname = col AND attnum > 0 AND NOT attisdropped
+    ) THEN
+        RAISE EXCEPTION 'Unknown pivot column % of %', col, pivot_value.relation
+            USING ERRCODE = '22023';
+    END IF;
+
     EXECUTE format ($$
-        SELECT %I
-        FROM api.products
-        WHERE int_id = %s
-        $$, col, int_id)
-    INTO pivot_val;
+        SELECT %I::text
+        FROM %s
+        WHERE int_id = $1
+        $$, col, source)
+    INTO pivot_val
+    USING pivot_value.int_id;
     RETURN pivot_val;
 END;
-$body$ LANGUAGE plpgsql STABLE;
+$body$ LANGUAGE plpgsql STABLE SECURITY DEFINER SET search_path = data, pg_temp;
+
+-- Get the pivot values of every sort column of a seek pagination in one lookup,
+-- as a json object of column -> text value, null if the row does not exist.
+-- Same whitelisting as api.pivot_value.
+CREATE OR REPLACE FUNCTION api.pivot_values(relation text, int_id int, cols text[])
+  RETURNS json AS $body$
+DECLARE
+    source regclass;
+    col text;
+    pairs text[] := '{}';
+    pivot_vals json;
+BEGIN
+    SELECT to_regclass(p.source_table) INTO source
+    FROM data.pivot_relations p
+    WHERE p.relation = pivot_values.relation;
+
+    IF source IS NULL THEN
+        RAISE EXCEPTION 'Unknown pivot relation %', pivot_values.relation
+            USING ERRCODE = '22023';
+    END IF;
+
+    FOREACH col IN ARRAY cols LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = source AND attname = col AND attnum > 0 AND NOT attisdropped
+        ) THEN
+            RAISE EXCEPTION 'Unknown pivot column % of %', col, pivot_values.relation
+                USING ERRCODE = '22023';
+        END IF;
+        pairs := pairs || format('%L, %I::text', col, col);
+    END LOOP;
+
+    EXECUTE format ($$
+        SELECT json_build_object(%s)
+        FROM %s
+        WHERE int_id = $1
+        $$, array_to_string(pairs, ', '), source)
+    INTO pivot_vals
+    USING pivot_values.int_id;
+    RETURN pivot_vals;
+END;
+$body$ LANGUAGE plpgsql STABLE SECURITY DEFINER SET search_path = data, pg_temp;
+
+-- Lookups of proxies that do not send the relation yet
+CREATE OR REPLACE FUNCTION api.pivot_value(int_id int, col text)
+  RETURNS text AS $body$
+    SELECT api.pivot_value('products', int_id, col);
+$body$ LANGUAGE sql STABLE;
 
-SELECT pivot_value(10, 'base_color');
+SELECT pivot_value('products', 10, 'base_color');
+SELECT pivot_values('products', 10, ARRAY['base_color', 'price']);
 
 -- Drop or truncate all tables and views in correct order
 drop view if exists api.products,
@@ -101,7 +187,8 @@ drop table if exists data.products,
                      data.outfit_products,
                      data.liked_entity,
                      data.users,
-                     data.trained_recommendation_models;
+                     data.trained_recommendation_models,
+                     data.pivot_relations;
 
 -- Indexes
 -- Index naming conventions: https://gist.github.com/popravich/d6816ef1653329fb1745
@@ -110,3 +197,13 @@ ON data.product_images (product_id);
 
 CREATE INDEX product_variants_product_id_idx
 ON data.product_variants (product_id);
+
+-- Pivot lookups read a single row by int_id
+CREATE UNIQUE INDEX IF NOT EXISTS products_int_id_idx
+ON data.products (int_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS outfits_int_id_idx
+ON data.outfits (int_id);
+
+CREATE INDEX IF NOT EXISTS outfit_images_int_id_idx
+ON data.outfit_images (int_id);
@@ -1,7 +1,16 @@
 """We can define the fixture functions in this
 file to make them accessible across multiple test files.
 """
+import os
+import random
+import threading
+
+import numpy as np
 import pytest
+from flask import Flask
+
+from app.api import admission, api_bp, cache, recommender
+from benchmarks import fake_postgrest
 
 
 @pytest.fixture
@@ -9,3 +18,67 @@ def api_endpoint():
     """Api endpoint that can be passed as a parameter to any test
     """
     return "http://localhost:5000/api/"
+
+
+@pytest.fixture
+def postgrest():
+    """Fake PostgREST of the benchmarks, served from a background thread.
+    Its URL is in `host`, ending with a slash.
+    """
+    server = fake_postgrest.FakePostgrest(("127.0.0.1", 0), {"products": 50, "outfits": 20})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.host = f"http://127.0.0.1:{server.server_port}/"
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def app(postgrest):
+    """Flask app with the API blueprint, proxying to the fake PostgREST.
+    Admission control is off, tests of it configure it themselves.
+    """
+    admission.configure({"enabled": False})
+    cache.configure({})
+    cache.configure_pivot_values({})
+
+    flask_app = Flask(__name__)
+    flask_app.config['CONFIG'] = {
+        "postgrest_host": postgrest.host,
+        "streaming": {"enabled": False},
+    }
+    flask_app.register_blueprint(api_bp)
+    flask_app.secret_key = "justlooks-tests"
+    yield flask_app
+
+    admission.configure({})
+    cache.configure({})
+    cache.configure_pivot_values({})
+
+
+@pytest.fixture
+def random_array():
+    """Function creating an array of normally distributed values from a `random.Random`.
+    numpy.random can not be imported from the repository root, `secrets/` shadows the stdlib.
+    """
+    def create(rand: random.Random, *shape) -> np.ndarray:
+        return np.array([rand.gauss(0, 1) for _ in range(int(np.prod(shape)))]).reshape(shape)
+    return create
+
+
+@pytest.fixture
+def export_random_model(random_array):  # pylint: disable=redefined-outer-name
+    """Function exporting a recommendation model with random embeddings, see
+    `recommender.export_model`. It returns the directory of the model.
+    """
+    def export(model_dir, version="1", seed=0, users=50, kind="outfits", items=200, dim=8,
+               id_step=1) -> str:
+        rand = random.Random(seed)
+        user_ids = [f"user-{n}" for n in rand.sample(range(users), users)]
+        recommender.export_model(str(model_dir), version, user_ids,
+                                 random_array(rand, users, dim), {
+                                     kind: (np.arange(1, items + 1) * id_step,
+                                            random_array(rand, items, dim),
+                                            random_array(rand, items)),
+                                 })
+        return os.path.join(model_dir, version)
+    return export
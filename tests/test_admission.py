@@ -0,0 +1,144 @@
+"""
+Admission control tests, these use the fake PostgREST of the benchmarks and do not need
+PostgREST to be running.
+"""
+import threading
+import time
+
+import pytest
+
+from app.api import admission, batch
+
+
+def test_clients_are_limited_to_their_rate():
+    buckets = admission.TokenBuckets(rate=10, burst=2, max_clients=2)
+    assert buckets.take("ip:1")[0]
+    assert buckets.take("ip:1")[0]
+    allowed, wait = buckets.take("ip:1")
+    assert not allowed
+    assert 0 < wait <= 0.1
+    # Other clients have their own bucket, the least recently seen is forgotten
+    assert buckets.take("ip:2")[0]
+    assert buckets.take("ip:3")[0]
+    assert len(buckets) == 2
+    assert buckets.take("ip:1")[0]
+
+
+def test_waiting_requests_are_bounded():
+    limiter = admission.RouteLimiter(limit=1, max_queue=1)
+    assert limiter.acquire(timeout=1) is None
+    assert limiter.acquire(timeout=0.01) == "queue_timeout"
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(timeout=5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    assert limiter.acquire(timeout=5) == "queue_full"
+
+    limiter.release()
+    waiter.join()
+    assert results == [None]
+    assert limiter.stats() == {"limit": 1, "active": 1, "waiting": 0}
+
+
+def test_clients_are_identified_by_ip_then_api_key():
+    settings = admission.DEFAULT_SETTINGS
+    assert admission.get_client_keys({"X-API-Key": "abc"}, "10.0.0.1", settings) == \
+        ["ip:10.0.0.1", "key:abc"]
+    headers = {"X-Forwarded-For": "1.2.3.4, 5.6.7.8"}
+    assert admission.get_client_keys(headers, "10.0.0.1", settings) == ["ip:10.0.0.1"]
+    assert admission.get_client_keys(headers, "10.0.0.1", {**settings,
+                                                           "trust_forwarded_for": True}) \
+        == ["ip:5.6.7.8"]
+
+
+@pytest.fixture
+def configure_admission():
+    """Function enabling the admission control with some settings for a test."""
+    def configure(settings: dict) -> admission.AdmissionController:
+        admission.configure({"queue_timeout": 0.01, **settings})
+        return admission.controller
+    return configure
+
+
+def test_rejected_requests_get_retry_after(app, configure_admission):
+    configure_admission({"rate": 0.5, "burst": 1})
+    client = app.test_client()
+    assert client.get("/api/products?limit=1").status_code == 200
+    response = client.get("/api/products?limit=1")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.get_json()["code"] == 429
+    # Observability routes are never limited
+    assert client.get("/stats/admission").get_json()["rejected"] == {
+        "/api/<path:path> rate_limited": 1}
+
+
+def test_rotating_api_keys_do_not_get_more_tokens(app, configure_admission):
+    configure_admission({"rate": 0.001, "burst": 2})
+    client = app.test_client()
+    statuses = [client.get("/api/products?limit=1", headers={"X-API-Key": f"key-{n}"})
+                .status_code for n in range(10)]
+    assert statuses == [200] * 2 + [429] * 8
+
+
+def test_streamed_responses_hold_their_slot_until_closed(app, configure_admission):
+    app.config["CONFIG"]["streaming"] = {"enabled": True, "min_limit": 0, "chunk_size": 64}
+    controller = configure_admission({"concurrency": {"/api/<path:path>": 1}, "max_queue": 0})
+    client = app.test_client()
+    streamed = client.get("/api/products?limit=20", buffered=False)
+    assert streamed.status_code == 200
+    limiter = controller.get_limiter("/api/<path:path>")
+    assert limiter.active == 1
+
+    response = client.get("/api/products?limit=1")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    assert len(b"".join(streamed.response)) > 0
+    streamed.close()
+    assert limiter.active == 0
+    # Like a WSGI server, the test client closes the body once it is sent.
+    with client.get("/api/products?limit=1") as response:
+        assert response.status_code == 200
+        assert response.get_data()
+    assert limiter.active == 0
+
+
+@pytest.fixture
+def sequential_batches():
+    """Sub-requests of a batch run one after the other."""
+    batch.configure({"max_concurrency": 1})
+    yield
+    batch.configure({})
+
+
+@pytest.mark.usefixtures("sequential_batches")
+def test_batch_sub_requests_are_admitted(app, postgrest, configure_admission):
+    controller = configure_admission({"rate": 0.001, "burst": 3,
+                                      "concurrency": {"/api/<path:path>": 1}})
+    response = app.test_client().post("/batch", json={
+        "requests": [{"path": "products", "params": {"limit": 1}}] * 5})
+    assert response.status_code == 200
+    responses = response.get_json()["responses"]
+    # The batch itself takes one of the 3 tokens
+    assert [item["status"] for item in responses] == [200, 200, 429, 429, 429]
+    assert responses[2]["body"]["code"] == 429
+    assert postgrest.calls["get"] == 2
+    assert controller.stats()["routes"]["/api/<path:path>"] == {"limit": 1, "active": 0,
+                                                                "waiting": 0}
+
+
+@pytest.mark.usefixtures("sequential_batches")
+def test_batch_sub_requests_of_saturated_routes(app, postgrest, configure_admission):
+    controller = configure_admission({"concurrency": {"/api/<path:path>": 1},
+                                      "max_queue": 0})
+    limiter = controller.get_limiter("/api/<path:path>")
+    assert limiter.try_acquire()
+    response = app.test_client().post("/batch", json={
+        "requests": [{"path": "products", "params": {"limit": 1}}] * 2})
+    limiter.release()
+    assert [item["status"] for item in response.get_json()["responses"]] == [503, 503]
+    assert postgrest.calls["get"] == 0
+    assert controller.stats()["rejected"] == {"/api/<path:path> queue_full": 2}
@@ -0,0 +1,173 @@
+"""
+Tests for api_utils functions that do not need PostgREST to be running.
+"""
+import json
+import threading
+
+import pytest
+
+from app.api import api_utils, cache, cursor
+from app.api.error_handlers import ServerError
+from benchmarks import fake_postgrest
+
+
+@pytest.mark.parametrize("body, expected", [
+    (b'[]', None),
+    (b'{"int_id": 1}', None),
+    (b'[{"int_id": 1}]', {"int_id": 1}),
+    (b'[{"int_id": 1}, {"int_id": 2, "images": [{"int_id": 9}]}]\n',
+     {"int_id": 2, "images": [{"int_id": 9}]}),
+    (b'[{"int_id": 1}, {"int_id": 2, "name": "a \\"}{\\" b\\\\"}]',
+     {"int_id": 2, "name": 'a "}{" b\\'}),
+])
+def test_find_last_row(body: bytes, expected: dict):
+    assert api_utils.find_last_row(body) == expected
+
+
+def test_find_last_row_larger_than_window():
+    rows = [{"int_id": i, "description": "x" * 1000} for i in range(5)]
+    body = json.dumps(rows).encode()
+    assert api_utils.find_last_row(body, window=64) == rows[-1]
+
+
+def test_cursor_request_params_round_trip():
+    sort_terms = ["base_color.desc", "int_id"]
+    last_row = {"int_id": 42, "base_color": "blue", "price": 10}
+    page_cursor = cursor.encode_cursor(sort_terms, last_row, "secret")
+
+    request_params = {"limit": "10", "order": "base_color.desc,int_id", "cursor": page_cursor}
+    assert api_utils.create_cursor_request_params(request_params, "secret") == {
+        "limit": "10",
+        "order": "base_color.desc,int_id",
+        "and": '(base_color.lte."blue",'
+               'or(base_color.lt."blue",and(base_color.eq."blue",int_id.gt.42)))',
+    }
+
+
+def test_seek_params_keep_client_and_filters():
+    request_params = {"and": "(price.gt.10,price.lt.50)", "order": "int_id"}
+    assert api_utils.create_seek_params(request_params, ["int_id"], {"int_id": 7}) == {
+        "and": "(price.gt.10,price.lt.50,int_id.gte.7,int_id.gt.7)",
+        "order": "int_id",
+    }
+
+
+def test_seek_params_quote_reserved_characters():
+    assert api_utils.quote_filter_value('a,b.c("d")') == '"a,b.c(\\"d\\")"'
+    assert api_utils.quote_filter_value(12.5) == "12.5"
+
+
+@pytest.mark.parametrize("order", [
+    "base_color,int_id",
+    "base_color.desc,int_id",
+    "base_color,price.desc,int_id",
+    "base_color.desc,int_id.desc",
+    "int_id.desc",
+    "price,base_color,int_id",
+    "price.desc,int_id",
+    "price.nullsfirst,int_id.desc",
+    "price.desc.nullslast,base_color.desc,int_id",
+    "base_color,price.desc.nullslast,int_id",
+])
+def test_keyset_pages_visit_every_row_once(order: str):
+    colors, prices = ["black", "blue", "red"], [5, 10, None]
+    rows = fake_postgrest.sort_rows([{"int_id": int_id,
+                                      "base_color": colors[int_id % 3],
+                                      "price": prices[int_id % 5 % 3]}
+                                     for int_id in range(1, 31)], order)
+    sort_terms = order.split(",")
+
+    seen, request_params = [], {"order": order}
+    while True:
+        predicates = [fake_postgrest.compile_condition(f"and{request_params['and']}")] \
+            if "and" in request_params else []
+        page = [row for row in rows if all(predicate(row) for predicate in predicates)][:7]
+        if not page:
+            break
+        seen.extend(page)
+        request_params = api_utils.create_seek_params({"order": order}, sort_terms, page[-1])
+    assert seen == rows
+
+
+@pytest.mark.parametrize("secret, order", [
+    ("other secret", "base_color,int_id"),
+    ("secret", "price,int_id"),
+])
+def test_cursor_request_params_rejects_invalid_cursor(secret: str, order: str):
+    page_cursor = cursor.encode_cursor(["base_color", "int_id"],
+                                       {"int_id": 42, "base_color": "blue"},
+                                       "secret")
+    request_params = {"order": order, "cursor": page_cursor}
+    with pytest.raises(ServerError) as err:
+        api_utils.create_cursor_request_params(request_params, secret)
+    assert err.value.code == 400
+
+
+def test_pivot_values_are_looked_up_in_the_queried_relation():
+    server = fake_postgrest.FakePostgrest(("127.0.0.1", 0), {"products": 10, "outfits": 10})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request_params = {"order": "season,int_id", "int_id": "gt.3"}
+        seek_params = api_utils.create_pivot_value_request_param(
+            request_params, f"http://127.0.0.1:{server.server_port}/", "outfits")
+    finally:
+        server.shutdown()
+
+    season = server.rows_by_id["outfits"][3]["season"]
+    assert "int_id" not in seek_params
+    assert seek_params["and"].startswith(f'(or(season.gte."{season}",season.is.null),')
+
+
+def test_pivot_values_of_every_sort_column_are_looked_up_at_once(postgrest):
+    cache.configure_pivot_values({"enabled": True})
+    try:
+        request_params = {"order": "season,stylist.desc,int_id", "int_id": "gt.3"}
+        seek_params = api_utils.create_pivot_value_request_param(request_params,
+                                                                 postgrest.host, "outfits")
+        assert postgrest.calls["rpc"] == 1
+        assert api_utils.create_pivot_value_request_param(
+            request_params, postgrest.host, "outfits") == seek_params
+        assert postgrest.calls["rpc"] == 1
+    finally:
+        cache.configure_pivot_values({})
+
+    row = postgrest.rows_by_id["outfits"][3]
+    assert seek_params["and"] == (
+        f'(or(season.gte."{row["season"]}",season.is.null),'
+        f'or(season.gt."{row["season"]}",season.is.null,'
+        f'and(season.eq."{row["season"]}",stylist.lt."{row["stylist"]}"),'
+        f'and(season.eq."{row["season"]}",stylist.eq."{row["stylist"]}",int_id.gt.3)))')
+
+
+@pytest.mark.parametrize("pivot_values, expected", [
+    ({"season": ""}, '(or(season.gte."",season.is.null),'
+                     'or(season.gt."",season.is.null,and(season.eq."",int_id.gt.3)))'),
+    ({"season": None}, '(season.is.null,and(season.is.null,int_id.gt.3))'),
+])
+def test_empty_and_null_pivot_values_are_sought_from(pivot_values: dict, expected: str):
+    request_params = {"order": "season,int_id", "int_id": "gt.3"}
+    pivot_lookup = api_utils.get_pivot_lookup(request_params)
+    assert api_utils.apply_pivot_values(request_params, pivot_lookup, pivot_values) == {
+        "order": "season,int_id",
+        "and": expected,
+    }
+    # The pivot row is gone
+    assert api_utils.apply_pivot_values(request_params, pivot_lookup, None) == request_params
+
+
+@pytest.mark.parametrize("order", ["int_id", "int_id.desc", "base_color.desc,int_id",
+                                   "price,int_id.desc"])
+# Without the sort columns, the next links seek from the pivot row instead of a cursor.
+@pytest.mark.parametrize("select", ["", "&select=int_id,name"])
+def test_next_links_visit_every_row_once(app, postgrest, order: str, select: str):
+    client = app.test_client()
+    url, seen = f"/api/products?order={order}&limit=7{select}", []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen.extend(row["int_id"] for row in response.get_json())
+        link = response.headers.get("Link", None)
+        url = link[link.index("<") + 1:link.index(">")] if link else None
+
+    expected = fake_postgrest.sort_rows(postgrest.rows["products"], order)
+    assert seen == [row["int_id"] for row in expected]
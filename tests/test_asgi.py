@@ -0,0 +1,113 @@
+"""
+Asyncio serving mode tests, these use the fake PostgREST of the benchmarks and do not need
+PostgREST to be running.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app import asgi
+from app.api import admission, api_utils, cache
+
+
+def get(flask_app, *paths, headers=None):
+    """Send GET requests to the ASGI app, one after the other.
+
+    Returns:
+        list: Responses.
+    """
+    async def send_all():
+        proxy = asgi.AsyncProxy(flask_app)
+        transport = httpx.ASGITransport(app=proxy)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return [await client.get(path, headers=headers) for path in paths]
+        finally:
+            if proxy.client is not None:
+                await proxy.client.aclose()
+    return asyncio.run(send_all())
+
+
+def test_page_with_link_header(app):
+    response, = get(app, "/api/products?limit=5")
+    assert response.status_code == 200
+    assert [row["int_id"] for row in response.json()] == [1, 2, 3, 4, 5]
+    assert 'rel="next"' in response.headers["Link"]
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.headers["X-Request-ID"]
+
+    next_url = response.headers["Link"].split(">")[0].lstrip("<")
+    next_page, = get(app, next_url.replace("http://test", ""))
+    assert [row["int_id"] for row in next_page.json()] == [6, 7, 8, 9, 10]
+
+
+def test_not_modified(app):
+    response, = get(app, "/api/products?limit=5")
+    not_modified, = get(app, "/api/products?limit=5",
+                        headers={"If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == response.headers["ETag"]
+
+
+def test_postgrest_error(app):
+    response, = get(app, "/api/missing")
+    assert response.status_code == 404
+    assert response.json()["message"] == 'relation "api.missing" does not exist'
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_unexpected_errors_are_server_errors(app, monkeypatch):
+    def broken_headers(*args, **kwargs):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(api_utils, "create_headers", broken_headers)
+    response, = get(app, "/api/products?limit=5")
+    assert response.status_code == 500
+    assert response.json()["code"] == 500
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.headers["X-Request-ID"]
+
+
+@pytest.mark.parametrize("backend", ["memory", "mmap"])
+def test_cached_responses(app, postgrest, tmp_path, backend):
+    backend_settings = {"type": "memory"} if backend == "memory" else \
+        {"type": "mmap", "directory": str(tmp_path), "slots": 16, "slot_size": 65536}
+    cache.configure({"enabled": True, "backend": backend_settings,
+                     "route_ttls": {"products": 60}})
+
+    first, second = get(app, "/api/products?limit=5", "/api/products?limit=5")
+    assert first.content == second.content
+    assert postgrest.calls["get"] == 1
+    assert cache.response_cache.stats()["hits"] == 1
+
+
+def test_pivot_values_are_looked_up_at_once(app, postgrest):
+    response, = get(app, "/api/outfits?order=season,stylist,int_id&int_id=gt.3&limit=5")
+    assert response.status_code == 200
+    assert postgrest.calls["rpc"] == 1
+    pivot = postgrest.rows_by_id["outfits"][3]
+    assert response.json()
+    assert all((row["season"], row["stylist"], row["int_id"])
+               > (pivot["season"], pivot["stylist"], 3) for row in response.json())
+
+
+def test_admission_control(app):
+    admission.configure({"rate": 0.001, "burst": 2, "max_queue": 0,
+                         "concurrency": {"/api/<path:path>": 1}})
+    limiter = admission.controller.get_limiter("/api/<path:path>")
+    assert limiter.try_acquire()
+    saturated, = get(app, "/api/products?limit=5")
+    limiter.release()
+    admitted, limited = get(app, "/api/products?limit=5", "/api/products?limit=5")
+
+    assert saturated.status_code == 503
+    assert saturated.headers["Retry-After"] == "1"
+    assert saturated.json()["code"] == 503
+    assert admitted.status_code == 200
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "1000"
+    assert limiter.stats() == {"limit": 1, "active": 0, "waiting": 0}
+    assert admission.controller.stats()["rejected"] == {"/api/<path:path> queue_full": 1,
+                                                        "/api/<path:path> rate_limited": 1}
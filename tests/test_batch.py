@@ -0,0 +1,72 @@
+"""
+Batch tests, these use the fake PostgREST of the benchmarks and do not need PostgREST
+to be running.
+"""
+import threading
+import time
+
+from app.api import batch
+from app.api.routes.batch_proxy import create_query_string
+
+
+def test_query_string_repeats_list_params():
+    query_string = create_query_string({"limit": 20, "price": ["gt.5", "lt.50"],
+                                        "featured": True})
+    assert query_string.getlist("price") == ["gt.5", "lt.50"]
+    assert query_string["limit"] == "20"
+    assert query_string["featured"] == "true"
+
+
+def test_results_keep_the_order_and_width_is_capped():
+    executor = batch.BatchExecutor({**batch.DEFAULT_SETTINGS, "max_concurrency": 2,
+                                    "workers": 8})
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def work(item: int) -> int:
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+        return item * 2
+
+    try:
+        assert executor.map(work, list(range(10))) == [item * 2 for item in range(10)]
+    finally:
+        executor.shutdown()
+    assert running["max"] <= 2
+
+
+def test_sub_requests_are_answered_in_order(app, postgrest):
+    response = app.test_client().post("/batch", json={"requests": [
+        {"path": "products", "params": {"limit": 2}},
+        {"path": "missing"},
+        {"path": "/outfits", "params": {"limit": 3, "season": "eq.fall"}},
+    ]})
+    assert response.status_code == 200
+    products, missing, outfits = response.get_json()["responses"]
+
+    assert products["path"] == "products"
+    assert products["status"] == 200
+    assert [row["int_id"] for row in products["body"]] == [1, 2]
+    assert products["headers"]["Content-Range"] == "0-1/*"
+    assert 'rel="next"' in products["headers"]["Link"]
+
+    # One failing sub-request does not fail the others
+    assert missing["status"] == 404
+    assert missing["body"]["message"] == 'relation "api.missing" does not exist'
+
+    assert outfits["path"] == "outfits"
+    assert outfits["status"] == 200
+    assert [row["season"] for row in outfits["body"]] == ["fall"] * 3
+    assert postgrest.calls["get"] >= 2
+
+
+def test_batches_are_limited_to_max_requests(app):
+    max_requests = batch.get_settings()["max_requests"]
+    response = app.test_client().post("/batch", json={
+        "requests": [{"path": "products"}] * (max_requests + 1)})
+    assert response.status_code == 400
+    assert str(max_requests) in response.get_json()["hint"]
@@ -0,0 +1,105 @@
+"""
+Response cache tests, these do not need PostgREST to be running.
+"""
+import time
+
+import pytest
+from werkzeug.datastructures import ImmutableMultiDict
+
+from app.api import cache, cache_backends
+
+
+def make_entry(body: bytes, ttl: float = 60) -> cache.CachedResponse:
+    return cache.CachedResponse(status=200,
+                                headers=[("Content-Type", "application/json")],
+                                body=body,
+                                stored_at=time.time(),
+                                ttl=ttl)
+
+
+def test_least_recently_used_entry_is_evicted():
+    backend = cache_backends.MemoryBackend(max_bytes=22)
+    backend.set("a", b"a" * 10, 60)
+    backend.set("b", b"b" * 10, 60)
+    assert backend.get("a") is not None
+
+    backend.set("c", b"c" * 10, 60)
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    assert backend.get("c") is not None
+    assert backend.stats()["evictions"] == 1
+
+
+@pytest.mark.parametrize("backend_settings", [
+    {"type": "memory"},
+    {"type": "mmap", "slots": 16, "slot_size": 1024},
+])
+def test_backend_round_trip_and_expiry(tmp_path, backend_settings: dict):
+    if backend_settings["type"] == "mmap":
+        backend_settings = {**backend_settings, "directory": str(tmp_path)}
+    backend = cache_backends.create_backend(backend_settings, "responses")
+
+    backend.set("a", b"value", 60)
+    backend.set("expired", b"value", -1)
+    assert backend.get("a") == b"value"
+    assert backend.get("expired") is None
+    assert backend.get("missing") is None
+
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_mmap_backend_is_shared_between_instances(tmp_path):
+    first = cache_backends.MmapBackend("responses", str(tmp_path), slots=16, slot_size=1024)
+    second = cache_backends.MmapBackend("responses", str(tmp_path), slots=16, slot_size=1024)
+    first.set("a", b"value", 60)
+    assert second.get("a") == b"value"
+
+
+def test_cached_response_serialization():
+    entry = make_entry(b'[{"int_id": 1}]')
+    response_cache = cache.ResponseCache(cache_backends.MemoryBackend())
+    response_cache.set("a", entry)
+    assert response_cache.get("a") == entry
+    assert response_cache.get("b") is None
+    assert response_cache.stats()["hit_ratio"] == 0.5
+
+
+def test_key_does_not_depend_on_param_order():
+    first = cache.make_key("http://localhost/", "products",
+                           ImmutableMultiDict([("limit", "10"), ("int_id", "gt.0")]),
+                           {})
+    second = cache.make_key("http://localhost/", "products", {"int_id": "gt.0", "limit": 10},
+                            {})
+    other_accept = cache.make_key("http://localhost/", "products",
+                                  {"int_id": "gt.0", "limit": 10}, {"Accept": "text/csv"})
+    other_host = cache.make_key("https://api.example.com/", "products",
+                                {"int_id": "gt.0", "limit": 10}, {})
+    assert first == second
+    assert first != other_accept
+    assert first != other_host
+
+
+def test_cached_links_point_to_the_host_of_the_request(app):
+    cache.configure({"enabled": True, "route_ttls": {"products": 60}})
+    client = app.test_client()
+    internal = client.get("/api/products?limit=5", base_url="http://10.0.0.1:5000")
+    public = client.get("/api/products?limit=5", base_url="https://api.example.com")
+    assert internal.headers["Link"].startswith("<http://10.0.0.1:5000/api/products?")
+    assert public.headers["Link"].startswith("<https://api.example.com/api/products?")
+    assert cache.response_cache.stats()["misses"] == 2
+
+
+def test_pivot_values_are_invalidated_by_catalog_version(tmp_path):
+    version_file = tmp_path / "catalog-version"
+    cache.configure_catalog_version(str(version_file))
+    cache.catalog_version.check_interval = 0
+    pivot_value_cache = cache.PivotValueCache(cache_backends.MemoryBackend(), ttl=60)
+
+    pivot_value_cache.set("products", 10, "base_color", "blue")
+    assert pivot_value_cache.get("products", 10, "base_color") == "blue"
+    assert pivot_value_cache.get("outfits", 10, "base_color") is None
+
+    version_file.touch()
+    assert pivot_value_cache.get("products", 10, "base_color") is None
+    cache.configure_catalog_version(None)
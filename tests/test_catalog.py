@@ -0,0 +1,24 @@
+"""
+Catalog relation tests, these do not need PostgREST to be running.
+"""
+import pytest
+
+from app.api import catalog
+
+
+def test_routes_are_mapped_only_in_materialized_mode():
+    try:
+        catalog.configure({})
+        assert catalog.get_relation("products") == "products"
+
+        catalog.configure({"mode": "materialized"})
+        assert catalog.get_relation("products") == "catalog_products"
+        assert catalog.get_relation("outfit_thumbnails") == "outfit_thumbnails"
+    finally:
+        catalog.configure({})
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        catalog.configure({"mode": "tables"})
+    assert catalog.get_settings()["mode"] == "views"
@@ -0,0 +1,47 @@
+"""
+Compression tests, these do not need PostgREST to be running.
+"""
+import gzip
+
+import pytest
+
+from app.api import compression
+
+
+@pytest.fixture(autouse=True)
+def enable_compression():
+    compression.configure({"enabled": True, "min_size": 10, "encodings": ["gzip"]})
+    yield
+    compression.configure({})
+
+
+def test_negotiate():
+    assert compression.negotiate("gzip, deflate") == "gzip"
+    assert compression.negotiate("gzip;q=0, identity") is None
+    assert compression.negotiate("*") == "gzip"
+    assert compression.negotiate("deflate") is None
+    assert compression.negotiate(None) is None
+
+
+def test_encode_response():
+    body = b'[{"int_id": 1}, {"int_id": 2}]'
+    headers = [("Content-Type", "application/json; charset=utf-8"), ("ETag", '"abc"')]
+    encoded_headers, encoded_body = compression.encode_response(headers, body, "gzip")
+
+    assert gzip.decompress(encoded_body) == body
+    assert dict(encoded_headers) == {
+        "Content-Type": "application/json; charset=utf-8",
+        "ETag": '"abc-gzip"',
+        "Vary": "Accept-Encoding",
+        "Content-Encoding": "gzip",
+        "Content-Length": str(len(encoded_body)),
+    }
+
+
+def test_small_and_binary_responses_are_not_compressed():
+    headers = [("Content-Type", "application/json")]
+    assert compression.encode_response(headers, b"[]", "gzip") == (headers, b"[]")
+
+    headers = [("Content-Type", "image/png")]
+    body = b"\x89PNG" * 10
+    assert compression.encode_response(headers, body, "gzip") == (headers, body)
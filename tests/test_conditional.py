@@ -0,0 +1,31 @@
+"""
+Conditional request tests, these do not need PostgREST to be running.
+"""
+from app.api import conditional
+
+
+def test_etag_only_changes_with_the_body():
+    assert conditional.create_etag(b'[{"int_id": 1}]') == conditional.create_etag(b'[{"int_id": 1}]')
+    assert conditional.create_etag(b'[{"int_id": 1}]') != conditional.create_etag(b'[{"int_id": 2}]')
+
+
+def test_upstream_etag_is_kept():
+    headers = conditional.add_etag({"etag": '"upstream"'}, b"[]")
+    assert headers == {"etag": '"upstream"'}
+
+
+def test_is_not_modified():
+    etag = conditional.create_etag(b"[]")
+    assert conditional.is_not_modified(etag, etag)
+    assert conditional.is_not_modified(f'"other", W/{etag}', etag)
+    assert conditional.is_not_modified("*", etag)
+    assert not conditional.is_not_modified('"other"', etag)
+    assert not conditional.is_not_modified(None, etag)
+    assert not conditional.is_not_modified(etag, None)
+
+
+def test_not_modified_headers_drop_representation_headers():
+    headers = [("Content-Type", "application/json"), ("Content-Length", "2"),
+               ("ETag", '"x"'), ("Link", "<next>; rel=\"next\"")]
+    assert conditional.not_modified_headers(headers) == [("ETag", '"x"'),
+                                                         ("Link", "<next>; rel=\"next\"")]
@@ -0,0 +1,37 @@
+"""
+Facet index tests, these use the fake PostgREST of the benchmarks and do not need
+PostgREST to be running.
+"""
+import json
+import threading
+
+import pytest
+
+from app.api import facet_index
+from benchmarks import fake_postgrest
+
+
+@pytest.fixture(scope="module")
+def postgrest_host():
+    server = fake_postgrest.FakePostgrest(("127.0.0.1", 0), {"products": 10, "outfits": 40})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+def test_counts_are_grouped_by_facet(postgrest_host):
+    index = facet_index.FacetIndex(facet_index.DEFAULT_SETTINGS, postgrest_host)
+    seasons = json.loads(index.get("seasons").body)
+    assert {row["season"] for row in seasons} <= set(fake_postgrest.SEASONS)
+    assert sum(row["count"] for row in seasons) == 40
+
+    every_facet = json.loads(index.get().body)
+    assert every_facet["seasons"] == seasons
+    assert set(every_facet) == {"seasons", "stylists"}
+    assert index.get("colors") is None
+
+
+def test_etag_only_changes_with_the_counts(postgrest_host):
+    index = facet_index.FacetIndex(facet_index.DEFAULT_SETTINGS, postgrest_host)
+    assert index.load().bodies["seasons"] == index.load().bodies["seasons"]
+    assert index.get("seasons").etag != index.get("stylists").etag
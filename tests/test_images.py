@@ -0,0 +1,118 @@
+"""
+Image derivative tests, these read a local directory or a stubbed S3 client and do not
+need S3.
+"""
+import concurrent.futures.process
+import io
+import os
+
+import botocore.exceptions
+import pytest
+from botocore.stub import Stubber
+from PIL import Image
+
+from app.api import images, s3
+
+
+@pytest.fixture
+def derivatives(tmp_path):
+    source_dir = tmp_path / "uploads"
+    source_dir.mkdir()
+    Image.new("RGBA", (800, 400), (200, 10, 10, 128)).save(source_dir / "look.png")
+    (source_dir / "notes.txt").write_text("not an image")
+    service = images.DerivativeService({**images.DEFAULT_SETTINGS, "source": "local",
+                                        "local_dir": str(source_dir),
+                                        "cache_dir": str(tmp_path / "cache"), "workers": 1})
+    yield service
+    service.shutdown()
+
+
+def test_derivatives_are_resized_and_cached(derivatives):
+    data, digest = derivatives.get("look.png", 320, "jpeg", 70)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (320, 160)
+
+    assert derivatives.get("look.png", 320, "jpeg", 70) == (data, digest)
+    assert derivatives.cache.stats()["hits"] == 1
+    assert derivatives.get("look.png", 320, "webp", 70)[1] != digest
+
+    # Images are never enlarged
+    with Image.open(io.BytesIO(derivatives.get("look.png", 1080, "png", 70)[0])) as image:
+        assert image.size == (800, 400)
+
+
+def test_missing_and_invalid_sources(derivatives):
+    with pytest.raises(KeyError):
+        derivatives.get("missing.png", 320, "jpeg", 70)
+    with pytest.raises(KeyError):
+        derivatives.get("../uploads/../../etc/passwd", 320, "jpeg", 70)
+    with pytest.raises(OSError):
+        derivatives.get("notes.txt", 320, "jpeg", 70)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = images.DiskCache(str(tmp_path), max_bytes=250)
+    for number in range(3):
+        cache.set(f"{number:02d}", b"x" * 100)
+        os.utime(cache.get_path(f"{number:02d}"), (number, number))
+    assert cache.get("00") is None
+    assert cache.get("02") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_broken_pool_is_replaced(derivatives):
+    broken_pool = derivatives.get_pool()
+    # A killed encoding process breaks its pool
+    with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+        broken_pool.submit(os._exit, 1).result(timeout=10)
+
+    data, _ = derivatives.get("look.png", 160, "jpeg", 70)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (160, 80)
+    assert derivatives.get_pool() is not broken_pool
+
+
+def test_decompression_bombs_are_refused(monkeypatch):
+    output = io.BytesIO()
+    Image.new("RGB", (100, 100)).save(output, "PNG")
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ValueError):
+        images.render(output.getvalue(), 160, "jpeg", 70)
+
+
+@pytest.fixture
+def s3_derivatives(app, tmp_path):
+    """Images read from S3, with a botocore Stubber on the shared client."""
+    s3.configure({"aws_access_key_id": "AKIAEXAMPLE", "aws_secret_access_key": "secret",
+                  "region_name": "us-east-1"})
+    images.configure({"source": "s3", "cache_dir": str(tmp_path / "cache"), "workers": 1,
+                      "max_source_bytes": 1024})
+    with Stubber(s3.presign_client.get()) as stubber:
+        yield stubber
+    images.configure({})
+    s3.configure({})
+
+
+def test_large_s3_sources_are_refused_before_download(app, s3_derivatives):
+    s3_derivatives.add_response("head_object", {"ETag": '"abc"', "ContentLength": 4096},
+                                {"Bucket": "justlooks-images", "Key": "outfits/look.png"})
+    # No get_object response is stubbed, downloading would fail the test
+    response = app.test_client().get("/images/look.png?width=320")
+    assert response.status_code == 413
+    s3_derivatives.assert_no_pending_responses()
+
+
+def test_unreadable_s3_sources(app, s3_derivatives, monkeypatch):
+    client = app.test_client()
+    s3_derivatives.add_client_error("head_object", service_error_code="AccessDenied",
+                                    http_status_code=403)
+    assert client.get("/images/look.png?width=320").status_code == 502
+
+    def unreachable(**kwargs):
+        raise botocore.exceptions.EndpointConnectionError(endpoint_url="https://s3")
+
+    monkeypatch.setattr(s3.presign_client.get(), "head_object", unreachable)
+    response = client.get("/images/look.png?width=320")
+    assert response.status_code == 502
+    assert response.get_json()["code"] == 502
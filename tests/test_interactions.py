@@ -0,0 +1,123 @@
+"""
+Interaction queue tests, these use the fake PostgREST of the benchmarks and do not need
+PostgREST to be running.
+"""
+import time
+import uuid
+
+import pytest
+
+from app.api import interactions
+
+
+@pytest.fixture
+def configure_queue(postgrest):
+    """Function replacing the queue of the route, the queue is closed after the test."""
+    def configure(settings: dict) -> interactions.InteractionQueue:
+        interactions.configure(settings, postgrest.host)
+        return interactions.interaction_queue
+    yield configure
+    interactions.interaction_queue.close(timeout=1)
+    interactions.configure({}, None)
+
+
+def create_events(count):
+    return [{"event_id": str(uuid.uuid4()), "user_id": "user", "kind": "outfits",
+             "int_id": n, "event": "like", "occurred_at": "2020-06-01T00:00:00+00:00"}
+            for n in range(count)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_events_are_inserted_in_batches(postgrest):
+    queue = interactions.InteractionQueue(
+        {**interactions.DEFAULT_SETTINGS, "batch_size": 5, "flush_interval": 60}, postgrest.host)
+    assert queue.add(create_events(3))
+    assert queue.add(create_events(2))
+    assert wait_for(lambda: len(postgrest.interactions) == 5)
+    assert postgrest.calls["insert"] == 1
+
+    # A batch that is not full is inserted after `flush_interval`
+    queue.settings["flush_interval"] = 0.05
+    assert queue.add(create_events(1))
+    assert wait_for(lambda: len(postgrest.interactions) == 6)
+    queue.close()
+    assert queue.stats()["inserted"] == 6
+
+
+def test_queued_events_are_flushed_on_close(postgrest):
+    queue = interactions.InteractionQueue(
+        {**interactions.DEFAULT_SETTINGS, "flush_interval": 60}, postgrest.host)
+    events = create_events(3)
+    assert queue.add(events + events[:1])
+    queue.close()
+    assert sorted(postgrest.interactions) == sorted(event["event_id"] for event in events)
+    assert queue.stats()["queued"] == 0
+
+
+def test_full_queue_refuses_events_and_keeps_failed_batches():
+    # Nothing listens on this port, every insert fails.
+    queue = interactions.InteractionQueue(
+        {**interactions.DEFAULT_SETTINGS, "queue_size": 3, "batch_size": 1,
+         "retry_interval": 0.01}, "http://127.0.0.1:9/")
+    assert queue.add(create_events(3))
+    assert not queue.add(create_events(1))
+    assert wait_for(lambda: queue.stats()["flush_errors"] > 0)
+    queue.close(timeout=0.1)
+    assert queue.stats()["queued"] == 3
+    assert queue.stats()["refused"] == 1
+
+
+def test_route_queues_single_and_batched_events(app, postgrest, configure_queue):
+    queue = configure_queue({"flush_interval": 60})
+    client = app.test_client()
+    event_id = str(uuid.uuid4())
+    response = client.post("/interactions", json={
+        "event_id": event_id, "user_id": "user", "kind": "outfits", "int_id": 3,
+        "event": "like"})
+    assert response.status_code == 202
+    assert response.get_json() == {"accepted": 1}
+
+    response = client.post("/interactions", json={"events": [
+        {"user_id": "user", "kind": "products", "int_id": 1, "event": "view",
+         "occurred_at": "2020-06-01T00:00:00+00:00"},
+        {"user_id": "user", "kind": "outfits", "int_id": 2, "event": "click"},
+    ]})
+    assert response.status_code == 202
+    assert response.get_json() == {"accepted": 2}
+
+    queue.close()
+    assert len(postgrest.interactions) == 3
+    assert postgrest.interactions[event_id]["int_id"] == 3
+    assert "2020-06-01T00:00:00+00:00" in [row["occurred_at"]
+                                           for row in postgrest.interactions.values()]
+
+
+def test_route_validates_every_event(app, configure_queue):
+    queue = configure_queue({"max_request_events": 2})
+    client = app.test_client()
+    response = client.post("/interactions", json={"events": [
+        {"user_id": "user", "kind": "outfits", "int_id": 1, "event": "like"},
+        {"user_id": "user", "kind": "hats", "int_id": 2, "event": "like"},
+    ]})
+    assert response.status_code == 422
+    assert "kind" in response.get_json()["errors"]["json"]["events"]["1"]
+
+    event = {"user_id": "user", "kind": "outfits", "int_id": 1, "event": "like"}
+    assert client.post("/interactions", json={"events": [event] * 3}).status_code == 400
+    assert queue.stats()["accepted"] == 0
+
+
+def test_route_answers_503_when_the_queue_is_full(app, configure_queue):
+    configure_queue({"queue_size": 2, "flush_interval": 60})
+    client = app.test_client()
+    event = {"user_id": "user", "kind": "outfits", "int_id": 1, "event": "like"}
+    assert client.post("/interactions", json={"events": [event] * 2}).status_code == 202
+    response = client.post("/interactions", json=event)
+    assert response.status_code == 503
+    assert response.get_json()["code"] == 503
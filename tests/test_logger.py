@@ -0,0 +1,52 @@
+"""
+Logging tests, these do not need PostgREST to be running.
+"""
+import json
+import logging
+import os
+import queue
+
+from app import logger as app_logger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def test_project_dir_is_found_without_git():
+    assert os.path.isfile(os.path.join(app_logger.get_project_dir(), "main.py"))
+
+
+def test_queue_logging_writes_json_with_request_id():
+    test_logger = logging.getLogger("test_queue_logging")
+    test_logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    test_logger.addHandler(handler)
+    listener = app_logger.enable_queue_logging(test_logger, debug_sample_rate=0.0)
+    assert app_logger.enable_queue_logging(test_logger) is listener
+
+    token = app_logger.request_id_var.set("abc")
+    test_logger.info("hello %s", "world", extra={"timings": {"total": 1.5}})
+    test_logger.debug("sampled out")
+    app_logger.request_id_var.reset(token)
+    app_logger.stop_queue_logging(listener)
+
+    assert len(handler.lines) == 1
+    entry = json.loads(handler.lines[0])
+    assert entry["message"] == "hello world"
+    assert entry["request_id"] == "abc"
+    assert entry["timings"] == {"total": 1.5}
+    assert app_logger.get_queue_stats(test_logger)["debug_sampled_out"] == 1
+
+
+def test_full_queue_drops_records():
+    queue_handler = app_logger.DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+    queue_handler.handle(record)
+    queue_handler.handle(record)
+    assert queue_handler.dropped == 1
@@ -0,0 +1,75 @@
+"""
+Metrics tests, these use the fake PostgREST of the benchmarks and do not need PostgREST
+to be running.
+"""
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.api import metrics, recommender
+
+
+def get_sample(name: str, labels: dict) -> float:
+    body, _ = metrics.export()
+    for family in text_string_to_metric_families(body.decode()):
+        for sample in family.samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+    return 0.0
+
+
+def test_requests_and_errors_are_exported():
+    labels = {"route": "products", "method": "GET", "status": "200"}
+    before = get_sample("justlooks_api_requests_total", labels)
+    metrics.record_request("products", "GET", 200, 0.02, 2048)
+    assert get_sample("justlooks_api_requests_total", labels) == before + 1
+    assert get_sample("justlooks_api_request_duration_seconds_count", labels) >= 1
+
+    error_labels = {"type": "server_error", "status": "503"}
+    before = get_sample("justlooks_api_upstream_errors_total", error_labels)
+    metrics.record_upstream_error("server_error", 503)
+    assert get_sample("justlooks_api_upstream_errors_total", error_labels) == before + 1
+
+
+def test_proxied_requests_are_labelled_with_known_routes(app):
+    client = app.test_client()
+    labels = {"method": "GET", "status": "404"}
+    before = get_sample("justlooks_api_requests_total", {"route": "other", **labels})
+    for path in ("missing", "also/missing"):
+        assert client.get(f"/api/{path}").status_code == 404
+    assert get_sample("justlooks_api_requests_total", {"route": "other", **labels}) == before + 2
+    assert get_sample("justlooks_api_requests_total", {"route": "missing", **labels}) == 0
+
+    before = get_sample("justlooks_api_requests_total",
+                        {"route": "products", "method": "GET", "status": "200"})
+    assert client.get("/api/products?limit=2").status_code == 200
+    assert get_sample("justlooks_api_requests_total",
+                      {"route": "products", "method": "GET", "status": "200"}) == before + 1
+
+
+def test_streamed_responses_are_not_buffered_to_be_measured(app):
+    app.config["CONFIG"]["streaming"] = {"enabled": True, "min_limit": 0, "chunk_size": 64}
+    labels = {"route": "products"}
+    before = get_sample("justlooks_api_response_size_bytes_count", labels)
+    response = app.test_client().get("/api/products?limit=20", buffered=False)
+    assert not isinstance(response.response, list)
+    assert len(response.get_data()) > 0
+    assert get_sample("justlooks_api_response_size_bytes_count", labels) == before
+
+
+def test_only_postgrest_errors_are_upstream_errors(app, monkeypatch):
+    client = app.test_client()
+    server_labels, upstream_labels = {"status": "503"}, {"type": "server_error", "status": "503"}
+    server_errors = get_sample("justlooks_api_server_errors_total", server_labels)
+    upstream_errors = get_sample("justlooks_api_upstream_errors_total", upstream_labels)
+
+    # No model is loaded
+    monkeypatch.setattr(recommender.model_store, "get", lambda: None)
+    assert client.get("/recommendations/outfits?user_id=user-1").status_code == 503
+    assert get_sample("justlooks_api_server_errors_total", server_labels) == server_errors + 1
+    assert get_sample("justlooks_api_upstream_errors_total", upstream_labels) == upstream_errors
+
+    # PostgREST can not be reached
+    app.config["CONFIG"]["postgrest_host"] = "http://127.0.0.1:1/"
+    assert client.get("/api/products?limit=1").status_code == 503
+    assert get_sample("justlooks_api_server_errors_total", server_labels) == server_errors + 1
+    assert get_sample("justlooks_api_upstream_errors_total",
+                      upstream_labels) == upstream_errors + 1
@@ -0,0 +1,47 @@
+"""
+Recommendation tests, these do not need PostgREST to be running.
+"""
+import os
+import random
+
+import numpy as np
+
+from app.api import recommender
+
+
+def test_top_k_matches_a_full_sort(random_array):
+    scores = random_array(random.Random(1), 1000)
+    assert recommender.top_k(scores, 10).tolist() == np.argsort(-scores)[:10].tolist()
+    assert recommender.top_k(scores[:5], 10).tolist() == np.argsort(-scores[:5]).tolist()
+
+
+def test_recommendations_are_the_highest_scores(tmp_path, export_random_model):
+    model = recommender.RecommendationModel(export_random_model(tmp_path))
+    items = model.items["outfits"]
+    expected = items.embeddings @ model.get_user_embedding("user-7") + items.biases
+
+    recommendation = model.recommend("user-7", "outfits", 5, exclude=[1, 2])
+    assert recommendation.personalized
+    assert recommendation.ids == [int(items.ids[i]) for i in np.argsort(-expected)
+                                  if items.ids[i] not in (1, 2)][:5]
+
+    # Users missing from the model get the most popular items
+    cold_start = model.recommend("user-unknown", "outfits", 5)
+    assert not cold_start.personalized
+    assert cold_start.ids == items.ids[np.argsort(-items.biases)[:5]].tolist()
+
+
+def test_new_models_are_swapped_in(tmp_path, export_random_model):
+    store = recommender.ModelStore(str(tmp_path), check_interval=0)
+    assert store.get() is None
+
+    export_random_model(tmp_path, "1", seed=1)
+    first = store.get()
+    assert first.version == "1"
+    assert store.get() is first
+
+    export_random_model(tmp_path, "2", seed=2)
+    # Make sure the pointer file mtime changes on filesystems with a coarse resolution
+    os.utime(os.path.join(tmp_path, recommender.LATEST_FILE), ns=(0, 0))
+    assert store.get().version == "2"
+    assert store.stats()["loads"] == 2
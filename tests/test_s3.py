@@ -0,0 +1,35 @@
+"""
+S3 presigning tests, these use stubbed credentials and do not need S3.
+"""
+import pytest
+
+from app.api import s3
+
+
+@pytest.fixture
+def stub_credentials():
+    s3.configure({
+        "aws_access_key_id": "AKIAEXAMPLE",
+        "aws_secret_access_key": "secret",
+        "region_name": "us-east-1",
+        "endpoint_url": "http://localhost:9000",
+    })
+    yield
+    s3.configure({})
+
+
+def test_presigned_post(stub_credentials):
+    presigned_post = s3.create_presigned_post("look.jpg", "image/jpeg")
+    assert presigned_post["url"].startswith("http://localhost:9000/justlooks-images")
+    assert presigned_post["fields"]["key"] == "outfits/look.jpg"
+    assert presigned_post["fields"]["Content-Type"] == "image/jpeg"
+    assert "policy" in presigned_post["fields"]
+
+
+def test_client_is_reused_until_it_expires(stub_credentials):
+    client = s3.presign_client.get()
+    assert s3.presign_client.get() is client
+
+    s3.configure({**s3.get_settings(), "client_ttl": 0})
+    expired_client = s3.presign_client.get()
+    assert s3.presign_client.get() is not expired_client
@@ -0,0 +1,65 @@
+"""
+Similarity index tests, these do not need PostgREST to be running.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.api import recommender, similarity
+
+
+@pytest.fixture
+def products_model(tmp_path, export_random_model):
+    return recommender.RecommendationModel(
+        export_random_model(tmp_path, users=1, kind="products", items=300, id_step=10))
+
+
+def test_probing_every_list_is_an_exact_search(tmp_path, products_model):
+    items = products_model.items["products"]
+    path = os.path.join(tmp_path, "index")
+    similarity.build_index(path, items.ids, items.embeddings,
+                           {**similarity.DEFAULT_SETTINGS, "n_lists": 10})
+    index = similarity.IVFIndex(path)
+    assert index.n_lists == 10
+    assert sorted(index.ids.tolist()) == sorted(items.ids.tolist())
+
+    vectors = similarity.normalize(items.embeddings)
+    expected = vectors @ vectors[4]
+    expected[4] = -np.inf
+    neighbours = index.search(int(items.ids[4]), 5, n_probe=10)
+    assert neighbours.ids == items.ids[np.argsort(-expected)[:5]].tolist()
+
+    # Fewer probes scan a subset of the items
+    assert set(index.search(int(items.ids[4]), 300, n_probe=1).ids) < set(items.ids.tolist())
+    assert index.search(7, 5, n_probe=10) is None
+
+
+def test_indexes_are_built_in_the_background_and_persisted(products_model):
+    indexes = similarity.SimilarityIndexes(similarity.DEFAULT_SETTINGS)
+    assert indexes.get(products_model, "products") is None
+    for thread in list(indexes._building.values()):  # pylint: disable=protected-access
+        thread.join()
+    assert indexes.get(products_model, "products").n_lists == int(np.sqrt(300))
+    assert indexes.stats()["builds"] == 1
+
+    # Other workers map the persisted index
+    other_worker = similarity.SimilarityIndexes(similarity.DEFAULT_SETTINGS)
+    assert other_worker.get(products_model, "products") is not None
+    assert other_worker.stats()["builds"] == 0
+
+
+def test_failed_builds_are_counted_and_not_retried_right_away(products_model, monkeypatch):
+    def broken_build(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(similarity, "build_index", broken_build)
+    indexes = similarity.SimilarityIndexes(similarity.DEFAULT_SETTINGS)
+    assert indexes.get(products_model, "products") is None
+    for thread in list(indexes._building.values()):  # pylint: disable=protected-access
+        thread.join()
+    assert indexes.stats()["build_errors"] == 1
+    assert indexes.stats()["building"] == []
+
+    assert indexes.get(products_model, "products") is None
+    assert indexes.stats()["building"] == []
@@ -0,0 +1,57 @@
+"""
+Request coalescing tests, these do not need PostgREST to be running.
+"""
+import asyncio
+import threading
+import time
+
+from app.api import single_flight
+
+
+def test_concurrent_calls_share_one_result():
+    flights = single_flight.SingleFlight()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.2)
+        return b"body"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", slow_call)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [(b"body", False)] + [(b"body", True)] * 4
+
+
+def test_followers_get_the_leader_exception():
+    flights = single_flight.AsyncSingleFlight()
+
+    async def failing_call():
+        await asyncio.sleep(0.1)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[flights.do_async("key", failing_call) for _ in range(3)],
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.stats() == {"leaders": 1, "followers": 2, "in_flight": 0}
+
+
+def test_make_key_is_none_when_disabled():
+    single_flight.configure({"enabled": False})
+    assert single_flight.make_key("GET", "products", {}, {}) is None
+
+    single_flight.configure({"enabled": True})
+    anonymous = single_flight.make_key("GET", "products", {"limit": 10}, {})
+    authorized = single_flight.make_key("GET", "products", {"limit": 10},
+                                        {"Authorization": "Bearer abc"})
+    assert anonymous != authorized
+    single_flight.configure({})
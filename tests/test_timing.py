@@ -0,0 +1,46 @@
+"""
+Request timing tests, these do not need PostgREST to be running.
+"""
+import pytest
+
+from app.api import timing
+
+
+@pytest.fixture
+def timing_enabled():
+    timing.configure({"enabled": True, "server_timing_header": True, "buckets_ms": [10, 100]})
+    yield
+    timing.configure({})
+
+
+def test_spans_are_noops_when_disabled():
+    assert timing.start() is None
+    with timing.span("upstream") as span:
+        assert span is timing.span("headers")
+    assert timing.finish(None, "GET", "/api/products", 200) == {}
+
+
+def test_server_timing_header_and_histograms(timing_enabled):
+    timings = timing.start()
+    with timing.span("upstream"):
+        pass
+    headers = timing.finish(timings, "GET", "/api/products", 200)
+
+    names = [metric.split(";")[0] for metric in headers["Server-Timing"].split(", ")]
+    assert names == ["upstream", "total"]
+    assert timing.stats()["upstream"]["count"] == 1
+    # Spans after the request finished are not recorded.
+    with timing.span("upstream"):
+        pass
+    assert timings.spans == [timings.spans[0]]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = timing.Histogram([10, 100])
+    for value in [5, 50, 500, 10]:
+        histogram.observe(value)
+    assert histogram.snapshot() == {
+        "buckets": {"10": 2, "100": 3, "+Inf": 4},
+        "count": 4,
+        "sum_ms": 565.0,
+    }
@@ -0,0 +1,41 @@
+"""
+Upstream client tests, these do not need PostgREST to be running.
+"""
+from app.api import upstream
+
+
+def test_forwardable_headers_removes_hop_by_hop():
+    headers = [
+        ("Host", "localhost:5000"),
+        ("Connection", "close"),
+        ("Accept", "application/json"),
+        ("Authorization", "Bearer abc"),
+    ]
+    assert upstream.forwardable_headers(headers) == {
+        "Accept": "application/json",
+        "Authorization": "Bearer abc",
+    }
+
+
+def test_session_is_shared_and_rebuilt_on_configure():
+    upstream.configure({"pool_maxsize": 3})
+    session = upstream.get_session()
+    assert upstream.get_session() is session
+    assert upstream.pool_stats()["pool_maxsize"] == 3
+
+    upstream.configure({})
+    assert upstream.get_session() is not session
+    assert upstream.get_settings() == upstream.DEFAULT_SETTINGS
+
+
+def test_configure_keeps_in_flight_of_running_requests(monkeypatch):
+    upstream.configure({})
+    session = upstream.get_session()
+
+    def reconfigure_during_request(*args, **kwargs):  # pylint: disable=unused-argument
+        upstream.configure({})
+        assert upstream.pool_stats()["in_flight"] == 1
+
+    monkeypatch.setattr(session, "request", reconfigure_during_request)
+    upstream.request("GET", "http://127.0.0.1:9/")
+    assert upstream.pool_stats()["in_flight"] == 0